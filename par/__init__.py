@@ -27,45 +27,83 @@ from functools import lru_cache
 _ = lru_cache(maxsize=256)(re.compile)  # each unique (pattern, flags) compiled once
 
 class SimpleVisitor(object):
+    """Turns a parse tree into text by calling `visit_<rule>` (and `visit_<rule>_begin`/`_end`) for each node.
+
+    Handlers are looked up along the MRO, so subclasses inherit them. Each class keeps a dispatch table
+    from rule names to its handlers, filled on first use: set handlers before visiting with a class."""
+    _dispatch: dict[str, tuple] = {}
+    _hooks: tuple | None = None
+    
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        cls._dispatch, cls._hooks = {}, None
+    
     def __init__(self, grammar: dict | None = None) -> None:
         self.grammar = grammar
     
+    @classmethod
+    def _methods(cls) -> dict:
+        """Hook and `visit_` functions of the class and its bases, nearest definition first"""
+        methods = {}
+        for klass in cls.__mro__:
+            for name, value in vars(klass).items():
+                if name.startswith('visit_') or name in ('__begin__', '__end__', 'before_visit', 'after_visit'):
+                    methods.setdefault(name, value)
+        return methods
+    
+    @classmethod
+    def _handlers(cls, name: str) -> tuple:
+        """`(visit_<name>_begin, visit_<name>, visit_<name>_end)`, None where not defined"""
+        if (entry := cls._dispatch.get(name)) is None:
+            methods = cls._methods()
+            entry = cls._dispatch[name] = (methods.get(f'visit_{name}_begin'), methods.get(f'visit_{name}'), methods.get(f'visit_{name}_end'))
+        return entry
+    
+    @classmethod
+    def _visit_hooks(cls) -> tuple:
+        """`(__begin__, before_visit, after_visit, __end__)`, None where not defined"""
+        if cls._hooks is None:
+            methods = cls._methods()
+            cls._hooks = (methods.get('__begin__'), methods.get('before_visit'), methods.get('after_visit'), methods.get('__end__'))
+        return cls._hooks
+    
     def visit(self, nodes, root=False) -> str:
         """Visit nodes and convert them to output.
         Args:
           * nodes: Can be Symbol, Node object, list/tuple of nodes, or string
           * root: Whether this is the root level visit"""
         buf = []
-        if not isinstance(nodes, (list, tuple)):
+        if not isinstance(nodes, (list, tuple, Symbol)):
             nodes = [nodes]
         
-        # Cache class dict for faster method lookups
-        methods = self.__class__.__dict__
+        dispatch = self._dispatch
+        begin, before, after, end = self._hooks or self._visit_hooks()
         
-        if root and (method := methods.get('__begin__')):
-            buf.append(method(self))
+        if root and begin:
+            buf.append(begin(self))
         
         for node in nodes:
             if isinstance(node, str):
                 buf.append(node)
+                continue
+            node_name = node.__name__
+            visit_begin, method, visit_end = dispatch.get(node_name) or self._handlers(node_name)
+            
+            if before:
+                buf.append(before(self, node))
+            if visit_begin:
+                buf.append(visit_begin(self, node))
+            if method:
+                buf.append(method(self, node))
             else:
-                node_name = node.__name__
-                
-                if (method := methods.get('before_visit')):
-                    buf.append(method(self, node))
-                if (method := methods.get(f'visit_{node_name}_begin')):
-                    buf.append(method(self, node))
-                if (method := methods.get(f'visit_{node_name}')):
-                    buf.append(method(self, node))
-                else:
-                    buf.append(node.what if isinstance(node.what, str) else self.visit(node.what))
-                if (method := methods.get(f'visit_{node_name}_end')):
-                    buf.append(method(self, node))
-                if (method := methods.get('after_visit')):
-                    buf.append(method(self, node))
+                buf.append(what if isinstance(what := node.what, str) else self.visit(what))
+            if visit_end:
+                buf.append(visit_end(self, node))
+            if after:
+                buf.append(after(self, node))
         
-        if root and (method := methods.get('__end__')):
-            buf.append(method(self))
+        if root and end:
+            buf.append(end(self))
         
         return ''.join(buf)
 
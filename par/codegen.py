@@ -0,0 +1,341 @@
+"""Generate a standalone Python parser module from a pyPEG grammar.
+
+The generated module has one specialised function per compiled grammar node (see
+`pyPEG.compile_pattern`). Regexes, literals and FIRST-character checks are inlined. Its
+`parse(text, root)` returns the same `Symbol` trees as `parser.parseLine` with packrat enabled.
+
+    from par.codegen import load
+    from par.md import MarkdownGrammar
+
+    markdown = load(MarkdownGrammar)         # generated once, then imported from the cache dir
+    result, rest = markdown.parse(MarkdownGrammar.prepare(text))
+"""
+import hashlib, importlib.util, inspect, os, re, sys
+from pathlib import Path
+from collections.abc import Callable
+
+from . import pyPEG
+from .pyPEG import Node, Rule, Fused, Terminal, Exact, Keyword, Lookahead, Nested, anchored, compile_pattern
+
+_terminals = (Terminal, Exact, Keyword)
+
+
+class _Mode:
+    """How generated functions skip and report: the main parser, the comment skipper, or the parser
+    within a `nested` span, whose memos are cleared around each use."""
+    def __init__(self, prefix: str, skip: str | None, report: bool):
+        self.prefix = prefix
+        self.skip = skip            # expression template for skipping at `{}`, or None
+        self.report = report        # whether failures are recorded for syntax errors
+
+    def skipped(self, var: str) -> str:
+        return self.skip.format(var) if self.skip else var
+
+
+class _Generator:
+    def __init__(self, skipWS: bool, comment: Node | None):
+        ws = '_ws(text, {}, textlen).end()' if skipWS else None
+        self.main = _Mode('', 'skip({})' if comment is not None else ws, True)
+        self.skipper = _Mode('c_', ws, False)
+        self.nested = _Mode('n_', self.main.skip, False)
+        self.comment = comment
+        self.consts: dict[tuple, str] = {}
+        self.const_lines: list[str] = []
+        self.names: dict[tuple[str, Node], str] = {}
+        self.queue: list[tuple[_Mode, Node]] = []
+        self.funcs: list[str] = []
+        self.memos: list[str] = []
+
+    ## Module level constants
+    def const(self, kind: str, value, source: str) -> str:
+        if (name := self.consts.get((kind, value))) is None:
+            name = self.consts[kind, value] = f'_{kind}{len(self.consts)}'
+            self.const_lines.append(f'{name} = {source}')
+        return name
+
+    def matcher(self, regex: re.Pattern[str]) -> tuple[str, bool]:
+        """Name of the bound `.match` for a terminal, and whether it must be called on a slice."""
+        safe = anchored(regex)
+        use = safe if safe is not None else regex
+        return self.const('m', (use.pattern, use.flags), f're.compile({use.pattern!r}, {use.flags}).match'), safe is None
+
+    def charset(self, chars: frozenset[str]) -> str:
+        return self.const('F', chars, f"frozenset({''.join(sorted(chars))!r})")
+
+    ## Functions
+    def fn(self, mode: _Mode, node: Node) -> str:
+        if (name := self.names.get((mode.prefix, node))) is None:
+            label = node.name if isinstance(node, Rule) and node.name else type(node).__name__.lower()
+            name = self.names[mode.prefix, node] = f'{mode.prefix}{label}_{len(self.names)}'
+            self.queue.append((mode, node))
+        return name
+
+    def emit_all(self) -> None:
+        while self.queue:
+            mode, node = self.queue.pop()
+            lines = [f'def {self.fn(mode, node)}(pos, out):']
+            if isinstance(node, Nested):
+                lines.append('    nonlocal textlen')
+            if mode.skip and not isinstance(node, Lookahead):
+                lines.append(f'    pos = {mode.skipped("pos")}')
+            body = getattr(self, f'emit_{type(node).__name__.lower()}')(mode, node)
+            lines.extend('    ' + line for line in body)
+            self.funcs.append('\n'.join(lines))
+
+    def expect(self, mode: _Mode, node: Node, pos: str) -> list[str]:
+        return [f'expect({pos}, {node.describe()!r})'] if mode.report else []
+
+    def attempt(self, mode: _Mode, node: Node, out: str | None, fail: list[str]) -> list[str]:
+        """Inline a terminal at `pos`: on success `pos` is moved past it, otherwise `fail` runs."""
+        fail = self.expect(mode, node, 'pos') + fail
+        match node:
+            case Terminal():
+                m, sliced = self.matcher(node.regex)
+                lines = [f'm = {m}(text[pos:textlen])' if sliced else f'm = {m}(text, pos, textlen)',
+                         'if m is None:', *('    ' + f for f in fail),
+                         'e = pos + m.end()' if sliced else 'e = m.end()']
+                if node.keep and out:
+                    lines += ['if e > pos:', f'    {out}.append(text[pos:e])']
+                return lines + [f'pos = {mode.skipped("e")}']
+            case Keyword():
+                return ['m = _word(text, pos, textlen)', f'if m is None or m.group() != {node.literal!r}:',
+                        *('    ' + f for f in fail), f'pos = {mode.skipped("m.end()")}']
+            case Exact():
+                return [f'if not text.startswith({node.literal!r}, pos, textlen):', *('    ' + f for f in fail),
+                        f'pos = {mode.skipped(f"pos + {len(node.literal)}")}']
+
+    def emit_terminal(self, mode, node):
+        return self.attempt(mode, node, 'out', ['return -1']) + ['return pos']
+    emit_exact = emit_keyword = emit_terminal
+
+    def emit_lookahead(self, mode, node):
+        test = '>=' if node.negate else '<'
+        return [f'if {self.fn(mode, node.node)}({mode.skipped("pos")}, []) {test} 0:', '    return -1', 'return pos']
+
+    def emit_seq(self, mode, node):
+        lines, fail = ['n0 = len(out)'], ['del out[n0:]', 'return -1']
+        for count, item in node.items:
+            if count >= 1:
+                if isinstance(item, _terminals):
+                    once = ([f'pos = {mode.skip.format("pos")}'] if mode.skip else []) + self.attempt(mode, item, 'out', fail)
+                else:
+                    once = [f'pos = {self.fn(mode, item)}(pos, out)', 'if pos < 0:', *('    ' + f for f in fail)]
+                lines += once if count == 1 else [f'for _ in range({count}):', *('    ' + l for l in once)]
+                continue
+            call = f'{self.fn(mode, item)}(pos, out)'
+            if count == 0:
+                lines += ['if pos < textlen:', f'    e = {call}', '    if e >= 0:', '        pos = e']
+            else:
+                if count == -2:
+                    lines += [f'pos = {call}', 'if pos < 0:', *('    ' + f for f in fail)]
+                lines += [f'while (e := {call}) >= 0:', '    pos = e']
+        return lines + ['return pos']
+
+    def emit_choice(self, mode, node):
+        firsts = [alt.first(set()) for alt in node.alts]
+        guards = [None if chars is None or nullable else self.charset(chars) for chars, nullable in firsts]
+        lines = ['c = text[pos:pos + 1]'] if any(guards) else []
+        for alt, guard in zip(node.alts, guards):
+            if isinstance(alt, _terminals):
+                # `attempt` only moves `pos` once it has matched, so a failed try can just break out
+                body = ['while True:', *('    ' + l for l in self.attempt(mode, alt, 'out', ['break'])), '    return pos']
+            else:
+                body = [f'e = {self.fn(mode, alt)}(pos, out)', 'if e >= 0:', '    return e']
+            lines += [f'if c in {guard}:', *('    ' + l for l in body)] if guard else body
+        if mode.report and any(guards):
+            # at the farthest failure, let skipped alternatives report what they expected
+            lines.append('if tracing and pos >= failpos:')
+            lines += [f'    if c not in {guard}: {self.fn(mode, alt)}(pos, [])'
+                      for alt, guard in zip(node.alts, guards) if guard]
+        return lines + ['return -1']
+
+    def emit_fused(self, mode, node):
+        regex = node.regex
+        m = self.const('m', (regex.pattern, regex.flags), f're.compile({regex.pattern!r}, {regex.flags}).match')
+        lines = [f'm = {m}(text, pos, textlen)', 'if m is None:']
+        if mode.report:
+            lines += ['    if pos >= failpos:', *(f'        expect(pos, {t.describe()!r})' for t in node.terminals)]
+        lines += ['    return -1', 'e = m.end()', 'g = m.lastindex']
+        for k, (group, (i, name, keep)) in enumerate(node.actions.items()):
+            branch = []
+            if mode.report and i:   # alternatives before the winner record their failures, as in Fused.match
+                branch += ['if tracing and pos >= failpos:', '    c = text[pos:pos + 1]']
+                for t, chars in zip(node.terminals[:i], node.firsts):
+                    expect = f'expect(pos, {t.describe()!r})'
+                    branch.append(f'    {expect}' if chars is None else f'    if c in {self.charset(chars)}: {expect}')
+            if name is not None:    # as the unfused rule would build it
+                branch.append(f'out.append(Symbol({name!r}, text, pos, e) if e > pos else Symbol({name!r}, [], pos))' if keep
+                              else f'out.append(Symbol({name!r}, [], pos, {mode.skipped("e")}))')
+            elif keep:
+                branch += ['if e > pos:', '    out.append(text[pos:e])']
+            lines += [f'{"elif" if k else "if"} g == {group}:', *('    ' + l for l in branch or ['pass'])]
+        return lines + [f'return {mode.skipped("e")}']
+
+    def emit_nested(self, mode, node):
+        # the inner parse runs with `textlen` at the end of the span and the n_ memos emptied around it
+        m, sliced = self.matcher(node.span.regex)
+        span = 'm.span(1)' if node.span.regex.groups else 'm.span()'
+        return [f'm = {m}(text[pos:textlen])' if sliced else f'm = {m}(text, pos, textlen)',
+                'if m is None:', *('    ' + f for f in self.expect(mode, node.span, 'pos') + ['return -1']),
+                'b = pos' if sliced else 'b = 0', 'e = b + m.end()', f's, t = {span}',
+                'inner = []', 'if s >= 0:', '    saved, textlen = textlen, b + t', '    n_clear()',
+                f'    r = {self.fn(self.nested, node.node)}(b + s, inner)', '    n_clear()', '    textlen = saved',
+                'if s >= 0 and r == b + t:', '    if b + s > pos:', '        out.append(text[pos:b + s])', '    out.extend(inner)',
+                '    if e > b + t:', '        out.append(text[b + t:e])',
+                'elif e > pos:', '    out.append(text[pos:e])', f'return {mode.skipped("e")}']
+
+    def emit_rule(self, mode, node):
+        memo = f'{mode.prefix}memo{len(self.memos)}'
+        self.memos.append(memo)
+        lines = [f'hit = {memo}.get(pos)', 'if hit is not None:',
+                 f'    if hit[0] >= 0: out.{"append" if node.symbol else "extend"}(hit[1])', '    return hit[0]']
+        failed = [f'{memo}[pos] = _FAILED', 'return -1']
+        body = self.fn(mode, node.body) if not node.textual else None
+        if not node.symbol:
+            return lines + ['n0 = len(out)', f'end = {body}(pos, out)', 'if end < 0:', *('    ' + f for f in failed),
+                            f'{memo}[pos] = (end, out[n0:])', 'return end']
+        if node.textual:
+            m, sliced = self.matcher(node.body.regex)
+            lines += [f'm = {m}(text[pos:textlen])' if sliced else f'm = {m}(text, pos, textlen)', 'if m is None:',
+                      *('    ' + f for f in self.expect(mode, node.body, 'pos') + failed),
+                      'e = pos + m.end()' if sliced else 'e = m.end()',
+                      f'sym = Symbol({node.name!r}, text, pos, e) if e > pos else Symbol({node.name!r}, [], pos)',
+                      f'end = {mode.skipped("e")}']
+        else:
+            lines += ['result = []', f'end = {body}(pos, result)', 'if end < 0:', *('    ' + f for f in failed),
+                      f'sym = Symbol({node.name!r}, result, pos, end)']
+        return lines + ['out.append(sym)', f'{memo}[pos] = (end, sym)', 'return end']
+
+
+_HEADER = '''\
+"""{title}
+
+Generated by par.codegen — do not edit. `parse(text, root)` gives the same results as
+`parser.parseLine(text, rule, skipWS={skipWS})` with packrat enabled, without the grammar."""
+import re
+from par.pyPEG import Symbol
+
+KEY = {key!r}
+ROOT = {root!r}
+RULES = {rules!r}
+
+_ws = re.compile(r"\\s*").match
+_word = re.compile(r"\\w+").match
+_FAILED = (-1, None)
+'''
+
+_PARSE = '''\
+def parse(text: str, root: str = ROOT) -> tuple[list, str]:
+    """Parse `text` with rule `root`; returns (results, rest) or raises SyntaxError."""
+    textlen = len(text)
+    failpos = -1
+    expected = []
+    tracing = False     # set for a second parse once the first failed, as by `parser.retrace`
+
+    def expect(pos, what):
+        nonlocal failpos
+        if pos > failpos:
+            failpos = pos
+            expected[:] = [what]
+        elif pos == failpos:
+            expected.append(what)
+        return -1
+'''
+
+def _indent(block: str, prefix: str = '    ') -> str:
+    return '\n'.join(prefix + line if line else line for line in block.split('\n'))
+
+def generate(grammar: dict[str, Callable], root: Callable | None = None, skipWS: bool = False,
+             skipComments: Callable | None = None, key: str = '') -> str:
+    """Return the source of a parser module for `grammar` (a dict of rule name -> rule function).
+    Every rule in the dict is an entry point; `root` (default `grammar.root`) is the default one."""
+    root = root if root is not None else grammar.root
+    rules = {name: compile_pattern(fn) for name, fn in dict(grammar).items()}
+    rules.setdefault(root.__name__, compile_pattern(root))
+    gen = _Generator(skipWS, compile_pattern(skipComments) if skipComments is not None else None)
+    entries = {name: gen.fn(gen.main, node) for name, node in rules.items()}
+    skip = []
+    if gen.comment is not None:
+        comment = gen.fn(gen.skipper, gen.comment)
+        skip = ['def skip(pos):', *(['    pos = _ws(text, pos, textlen).end()'] if skipWS else []),
+                f'    while (end := {comment}(pos, [])) >= 0:', '        pos = end', '    return pos', '']
+    gen.emit_all()
+    if any(prefix == gen.nested.prefix for prefix, _ in gen.names):
+        cleared = [memo for memo in gen.memos if memo.startswith((gen.nested.prefix, gen.skipper.prefix))]
+        skip += ['def n_clear():', *(f'    {memo}.clear()' for memo in cleared), *([] if cleared else ['    pass']), '']
+
+    title = f"Parser for {type(grammar).__name__ if type(grammar) is not dict else 'a grammar'}."
+    out = [_HEADER.format(title=title, skipWS=skipWS, key=key, root=root.__name__, rules=tuple(rules)),
+           *gen.const_lines, '', '', _PARSE]
+    out += [f'    {memo} = {{}}' for memo in gen.memos] + ['']
+    out += [_indent(line) for line in skip]
+    out += [_indent(func) + '\n' for func in reversed(gen.funcs)]
+    out += [_indent('entries = {' + ', '.join(f'{name!r}: {fn}' for name, fn in entries.items()) + '}'),
+            _indent('results = []'),
+            _indent('if (end := entries[root](0, results)) < 0:'),
+            _indent('    failpos, tracing = -1, True     # parse again to collect everything expected there'),
+            *(_indent(f'    {memo}.clear()') for memo in gen.memos),
+            _indent('    entries[root](0, [])'),
+            _indent("    raise SyntaxError('syntax error' if failpos < 0 else "
+                    "'syntax error, expected ' + ', '.join(dict.fromkeys(expected)))"),
+            _indent('return results, text[end:]'), '']
+    return '\n'.join(out)
+
+
+## On-disk cache
+
+def cache_dir() -> Path:
+    """Default directory for generated parsers: $XDG_CACHE_HOME/par, or ~/.cache/par."""
+    return Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'par'
+
+def grammar_key(grammar_cls: type, skipWS: bool = False, skipComments: Callable | None = None) -> str:
+    """Cache key for a grammar class, computed from source without constructing the grammar."""
+    h = hashlib.sha256()
+    for path in (inspect.getsourcefile(grammar_cls), pyPEG.__file__, __file__):
+        h.update(Path(path).read_bytes())
+    h.update(f'{grammar_cls.__qualname__}|{skipWS}|{getattr(skipComments, "__qualname__", None)}'.encode())
+    return h.hexdigest()[:20]
+
+_loaded: dict[Path, object] = {}
+
+def load_module(path: str | Path):
+    """Import a generated parser module from `path` (once per process)."""
+    path = Path(path).resolve()
+    if (module := _loaded.get(path)) is None:
+        spec = importlib.util.spec_from_file_location(f'par_generated_{path.stem}', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _loaded[path] = module
+    return module
+
+def load(grammar_cls: type, directory: str | Path | None = None, skipWS: bool = False,
+         skipComments: Callable | None = None):
+    """Return the generated parser module for `grammar_cls`, generating it into `directory`
+    (default `cache_dir()`) only if the grammar, pyPEG or this generator changed."""
+    key = grammar_key(grammar_cls, skipWS, skipComments)
+    path = Path(directory or cache_dir()) / f'{grammar_cls.__module__.replace(".", "_")}_{grammar_cls.__name__}_{key}.py'
+    if not path.exists():
+        source = generate(grammar_cls(), skipWS=skipWS, skipComments=skipComments, key=key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        tmp.write_text(source, encoding='utf-8')
+        os.replace(tmp, path)       # atomic, so concurrent processes never import a partial file
+    return load_module(path)
+
+
+def main(argv: list[str] | None = None) -> None:
+    """python -m par.codegen package.module:GrammarClass [output.py]"""
+    args = sys.argv[1:] if argv is None else argv
+    if not args or ':' not in args[0]:
+        sys.exit(main.__doc__)
+    module, _, cls = args[0].partition(':')
+    grammar_cls = getattr(importlib.import_module(module), cls)
+    source = generate(grammar_cls(), key=grammar_key(grammar_cls))
+    if len(args) > 1:
+        Path(args[1]).write_text(source, encoding='utf-8')
+    else:
+        sys.stdout.write(source)
+
+
+if __name__ == "__main__":
+    main()
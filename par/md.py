@@ -1,13 +1,16 @@
 """Advanced Markdown parsing and HTML conversion."""
 from .__init__ import SimpleVisitor, MDHTMLVisitor # Visits parsed nodes and converts to HTML/text etc.
 
-import re, types
-from par.pyPEG import _not, _and, keyword, ignore, Symbol, parseLine
+import hashlib, os, re, threading, types
+from bisect import bisect_left, bisect_right
+from html import unescape
+from par.pyPEG import _not, _and, keyword, ignore, nested, Symbol, parser, parseLine, compile_pattern
 
 from dataclasses import dataclass, field, asdict
-from collections import defaultdict
-from functools import lru_cache
-from typing import Literal
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from typing import Callable, IO, Iterable, Iterator, Literal
 
 _ = lru_cache(maxsize=256)(re.compile)
 
@@ -49,10 +52,109 @@ class ResourceStore:
         )
 
 
+class BlockCache:
+    """LRU of rendered top-level blocks, bounded by the bytes of HTML it holds.
+
+    Keys are digests of a block's source and of the render state it depends on; values are
+    `(html, effects)`, where `effects` is what rendering did to the visitor (see
+    `MarkdownHtmlVisitor._render_block`). Pass one to `parseHtml`/`parseHtmlDebug` and reuse it
+    across renders of a changing document: only edited blocks, and those whose context changed, are
+    rendered again. Safe to share between threads."""
+    
+    def __init__(self, max_bytes: int = 8 << 20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self._entries: OrderedDict[bytes, tuple[str, dict, int]] = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: bytes) -> tuple[str, dict] | None:
+        with self._lock:
+            if (entry := self._entries.get(key)) is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0], entry[1]
+    
+    def put(self, key: bytes, html: str, effects: dict) -> None:
+        size = len(html) + len(key) + sum(len(repr(v)) for v in effects.values())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if (old := self._entries.pop(key, None)) is not None:
+                self.nbytes -= old[2]
+            self._entries[key] = (html, effects, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self._entries.popitem(last=False)[1][2]
+                self.evictions += 1
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    @property
+    def stats(self) -> dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self), 'bytes': self.nbytes, 'max_bytes': self.max_bytes}
+
+
+class FragmentCache:
+    """LRU of fragment parse trees keyed by `(rule, text)`, bounded by the total length of the
+    fragments it holds (a tree's size follows its source). Fragments longer than `max_fragment`
+    are parsed but not kept: big list items rarely repeat, the cells and labels that do are short."""
+    
+    def __init__(self, max_chars: int = 256 << 10, max_fragment: int = 2048):
+        self.max_chars = max_chars
+        self.max_fragment = max_fragment
+        self.nchars = 0
+        self.hits = self.misses = self.evictions = 0
+        self._entries: OrderedDict[tuple[str, str], tuple] = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: tuple[str, str], parse: Callable[[], tuple]) -> tuple:
+        with self._lock:
+            if (tree := self._entries.get(key)) is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return tree
+            self.misses += 1
+        tree = parse()
+        if (size := len(key[1])) <= self.max_fragment:
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = tree
+                    self.nchars += size
+                while self.nchars > self.max_chars:
+                    self.nchars -= len(self._entries.popitem(last=False)[0][1])
+                    self.evictions += 1
+        return tree
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.nchars = 0
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    @property
+    def stats(self) -> dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self), 'chars': self.nchars, 'max_chars': self.max_chars}
+
+
 class MarkdownGrammar(dict):
     def __init__(self):
         peg, self.root = self._get_rules()
         self.update(peg)
+        self.fragments = FragmentCache()
+        self.block = compile_pattern(self['content']()[1])  # a single top-level block, for incremental reparsing
         
     def _get_rules(self):
         ## Cheats for return value repeats
@@ -140,15 +242,18 @@ class MarkdownGrammar(dict):
         def title()            : return [atx_title, setext_title]
         
         ## table
+        #  A cell's text up to its trailing spaces is parsed as inline text in place; cells that are blank,
+        #  end in a backslash or don't parse as a whole stay plain text. Only lines followed by a separator
+        #  row are tried as a table, so other lines with a `|` don't have their cells parsed.
         def table_sep()        : return _(r'\|')
-        def table_td()         : return _(r'[^\|\r\n]*'), table_sep
+        def table_td()         : return nested(_(r'(?:([^\|\r\n]*[^\|\s\\])(?![^\|\r\n]*[^\|\s]))?[^\|\r\n]*(?=\|)'), text), table_sep
         def table_horiz_line() : return _(r'\s*:?-+:?\s*'), table_sep
-        def table_other()      : return rest_of_line()
+        def table_other()      : return nested(_(r'(?=[^\r\n])(?:([^\r\n]*[^\s\\])(?![^\r\n]*\S))?[^\r\n]*'), text)
         def table_head()       : return 0, table_sep, -2, table_td, -1, table_other, blankline
         def table_separator()  : return 0, table_sep, -2, table_horiz_line, -1, table_other, blankline
         def table_body_line()  : return 0, table_sep, -2, table_td, -1, table_other, blankline
         def table_body()       : return -2, table_body_line
-        def table()            : return table_head, table_separator, table_body
+        def table()            : return _and(_(r'[^\r\n]*(?:\r\n|\r|\n)\|?\s*:?-+:?\s*\|')), table_head, table_separator, table_body  # a separator row follows
         
         # Cards
         def card_content()     : return _(r'(?:(?!\|\]).)+', re.DOTALL)
@@ -160,18 +265,34 @@ class MarkdownGrammar(dict):
         def side_block()       : return side_block_head, -2, side_block_cont, -1, blankline
         
         ## lists
+        #  `list_level(depth)` makes the rules for a list whose lines start with `depth` indents (4 spaces
+        #  or a tab); an item's content holds the lists of the next level down to `max_list_depth`. Its
+        #  other indented blocks (and deeper lists) stay list_indent_lines, parsed dedented when rendered.
+        max_list_depth = 8
         def check_radio()      : return _(r'\[[\*Xx ]?\]|<[\*Xx ]?>'), space
         def list_rest_of_line(): return _(r'.+'), blankline
         def list_first_para()  : return 0, check_radio, -1, (0, space, text), -1, blanklines
-        def list_lines()       : return list_norm_line, -1, [list_indent_lines, blankline]
-        def list_indent_line() : return _(r' {4}|\t'), list_rest_of_line
-        def list_norm_line()   : return _(r' {1,4}'), text, -1, (0, space, text), -1, blanklines
-        def list_indent_lines(): return list_indent_line, -1, list_indent_line, -1, blanklines
-        def list_content()     : return list_first_para, -1, [list_indent_lines, list_lines]
-        def bullet_list_item() : return 0, _(r' {1,4}'), _(r'[\*\+\-]'), space, list_content
-        def bullet_list_item_empty() : return 0, _(r' {1,4}'), _(r'[\*\+\-]'), 0, space, blankline
-        def number_list_item() : return 0, _(r' {1,4}'), _(r'\d+\.'), space, list_content
-        def lists()            : return -2, [bullet_list_item, bullet_list_item_empty, number_list_item], 0, attr_def
+        def list_level(depth):
+            indent = r'(?: {4}|\t)' * depth
+            # the items of a nested list may also be indented by less than a level, as in `- a\n  - b`
+            item = r'(?: {4}|\t)' * (depth - 1) + r'(?:(?: {4}|\t) {0,4}| {1,3})' if depth else r' {0,4}'
+            sublists = (list_level(depth + 1)['lists'],) if depth < max_list_depth else ()
+            # as the dedented content of an item used to be parsed, a code block or rule comes first there
+            start = (_not(_(indent + r'(?: {4}|\t)')), _not((_(indent), hr))) if depth else ()
+            def list_lines()       : return list_norm_line
+            def list_indent_line() : return _(indent + r'(?: {4}|\t)'), list_rest_of_line
+            def list_norm_line()   : return _(indent + r' {1,4}'), text, -1, (0, space, text), -1, blanklines
+            def list_indent_lines(): return list_indent_line, -1, list_indent_line, -1, blanklines
+            def list_content()     : return list_first_para, -1, [*sublists, list_indent_lines, list_lines]
+            def bullet_list_item() : return _(item), _(r'[\*\+\-]'), space, list_content
+            def bullet_list_item_empty() : return _(item), _(r'[\*\+\-]'), 0, space, blankline
+            def number_list_item() : return _(item), _(r'\d+\.'), space, list_content
+            def lists()            : return (*start, -2, [bullet_list_item, bullet_list_item_empty, number_list_item],
+                                             0, (_(indent), attr_def) if depth else attr_def)
+            return {f.__name__: f for f in (list_lines, list_indent_line, list_norm_line, list_indent_lines, list_content,
+                                            bullet_list_item, bullet_list_item_empty, number_list_item, lists)}
+        list_rules = list_level(0)
+        lists, list_lines, list_indent_lines = list_rules['lists'], list_rules['list_lines'], list_rules['list_indent_lines']
         
         ## Definition Lists
         def dl_dt()            : return _(r"^(?!=\s*[\*\d])"), -2, words(ig=r'--\B'), 0, _(r'--'), blankline
@@ -290,23 +411,80 @@ class MarkdownGrammar(dict):
         
         def article(): return content
         
-        return {k: v for k, v in locals().items() if isinstance(v, types.FunctionType)}, article
+        rules = {k: v for k, v in locals().items() if isinstance(v, types.FunctionType) and v is not list_level}
+        return rules | list_rules, article
     
     def parse(self, text: str, root=None, skipWS: bool = False, **kwargs):
         """Parse markdown text"""
         if not text or not isinstance(text, str):
             return (), ""
+        kwargs.setdefault('packrat', True)
+        return parseLine(self.prepare(text), root or self.root, skipWS=skipWS, **kwargs)
+
+    def parse_fragment(self, text: str, rule: str) -> tuple:
+        """Parse tree of `text` from the rule named `rule` (or the root).
+        Table cells and list items are parsed with the document; visitors parse the rest of the
+        nested content (quotes, cards, link texts, indented blocks) from its text again.
+        `fragments` spares the repeats (the same label or block text), sharing their tree,
+        which is safe because visitors never modify one."""
+        return self.fragments.get((rule, text), partial(self._parse_fragment, text, rule))
+    
+    def _parse_fragment(self, text: str, rule: str) -> tuple:
+        result, _ = self.parse(text, root=self[rule] if rule else None, resultSoFar=[], skipWS=False)
+        return tuple(result)
 
+    @staticmethod
+    def prepare(text: str) -> str:
+        """Normalise text the way `parse` does before handing it to the grammar."""
         # Normalise on unix-style line ending and we end with a newline
-        text = re.sub(r'\r\n|\r', '\n', text + ("\n" if not text.endswith("\n") else ''))
+        text = _RE_LINE_ENDS.sub('\n', text + ("\n" if not text.endswith("\n") else ''))
         # Hard line breaks: two+ trailing spaces or a trailing backslash before newline.
         # FIXME: We replace with literal <br/> so inline processing keeps them within the same paragraph
         # Preserve the trailing newline after converting to a <br/> so parsing retains line boundary
         # Only convert two+ spaces followed by newline into a <br/> when the newline is followed
         # by non-blank content (avoid converting trailing spaces at end-of-text into a <br/>).
-        text = re.sub(r'(?<=[^\s|]) {2,}\n(?=[^\n])|\\\n', '<br/>\n', text)
-        kwargs.setdefault('packrat', True)
-        return parseLine(text, root or self.root, skipWS=skipWS, **kwargs)
+        return _RE_HARD_BREAK.sub('<br/>\n', text)
+
+
+_RE_LINE_ENDS  = re.compile(r'\r\n|\r')
+_RE_HARD_BREAK = re.compile(r'(?<=[^\s|]) {2,}\n(?=[^\n])|\\\n')
+
+
+def _source_offsets(text: str):
+    """Map offsets in `MarkdownGrammar.prepare(text)` back to offsets in `text`.
+    Exact at line starts, which is where blocks begin; inside a rewritten line break it is approximate."""
+    stages = []
+    prepared = text + ("\n" if not text.endswith("\n") else '')
+    for pattern, repl in ((_RE_LINE_ENDS, '\n'), (_RE_HARD_BREAK, '<br/>\n')):
+        outs, ins, shift = [], [], 0
+        for m in pattern.finditer(prepared):
+            shift += len(repl) - (m.end() - m.start())
+            outs.append(m.end() + shift)
+            ins.append(m.end())
+        if outs:
+            prepared = pattern.sub(repl, prepared)
+            stages.append((outs, ins))
+    
+    def source_offset(offset: int) -> int:
+        for outs, ins in reversed(stages):
+            if (i := bisect_right(outs, offset)):
+                offset += ins[i - 1] - outs[i - 1]
+        return min(offset, len(text))
+    return source_offset
+
+
+_grammar_singleton: MarkdownGrammar | None = None
+_grammar_lock = threading.Lock()
+
+
+def the_grammar() -> MarkdownGrammar:
+    """The process-wide grammar; built once and safe to share, as parsing never mutates it."""
+    global _grammar_singleton
+    if _grammar_singleton is None:
+        with _grammar_lock:
+            if _grammar_singleton is None:
+                _grammar_singleton = MarkdownGrammar()
+    return _grammar_singleton
 
 
 _RE_SUBSCRIPT_FALLBACK   = re.compile(r',,([^,\n]+),,')
@@ -315,41 +493,67 @@ _RE_EMPHASIS_RECOVERY    = re.compile(r'^<em><em>([^<]+?) <em>(.+?)</em></em>(.*
 _RE_YOUTUBE = re.compile(r'(?:youtube\.com/(?:watch\?v=|embed/|v/)|youtu\.be/)([^&?]{11})')
 _RE_P_TAG = re.compile(r'</?p\b[^>]*>', re.I | re.MULTILINE)
 _RE_SINGLE_P_BLOCK = re.compile(r'^\s*<p\b[^>]*>(?:(?!<p\b).)*?</p>\s*$', re.I | re.S)
+_RE_LIST_ITEM_BLOCK = re.compile(r'(?:[*+-]|\d+\.|#{1,6})[ \t]')   # an item's first line that opens a block
 
 
 class MarkdownHtmlVisitor(MDHTMLVisitor):    
-    def __init__(self, tag_class={}, grammar=None, footnote_id=1, resources=None):
+    def __init__(self, tag_class={}, grammar=None, footnote_id=1, resources=None, block_cache: BlockCache | None = None):
         super().__init__(grammar)
         
         self.tag_class   = tag_class
         self.footnote_id = footnote_id
         self.resources   = resources if resources is not None else ResourceStore()
+        self.block_cache = block_cache
         self._current_section_level = None
         self._title_id_begin_level: int | None = 1
         self._form_stack: list[dict[str, str]] = []
     
     def visit(self, nodes, root=False) -> str:
-        if root and nodes and isinstance(nodes, (list, tuple)) and len(nodes) > 0:
+        if root:
+            self._prescan(nodes)
+        return super(MarkdownHtmlVisitor, self).visit(nodes, root)
+    
+    def _prescan(self, nodes):
+        if nodes and isinstance(nodes, (list, tuple, Symbol)) and len(nodes) > 0:
             # Single-pass pre-scan: collect link references and ToC titles together
-            first_node = nodes[0] if isinstance(nodes, (list, tuple)) else nodes
+            first_node = nodes[0] if isinstance(nodes, (list, tuple, Symbol)) else nodes
             if hasattr(first_node, 'find_all_names'):
                 for node in first_node.find_all_names(frozenset({'link_reference', 'title'})):
                     match node.__name__:
                         case 'link_reference': self._collect_link_reference(node)
                         case 'title':          self._alt_title(node)
-
-        return super(MarkdownHtmlVisitor, self).visit(nodes, root)
+    
+    def iter_visit(self, nodes) -> Iterator[str]:
+        """`visit(nodes, root=True)` in pieces: the HTML of each top-level block as soon as it is
+        rendered, then what `__end__` adds (closing the last section, footnotes)."""
+        self._prescan(nodes)
+        begin, before, after, end = self._visit_hooks()
+        content_begin, _, content_end = self._handlers('content')
+        if begin:
+            yield begin(self)
+        for node in ([nodes] if isinstance(nodes, str) else nodes):
+            if isinstance(node, Symbol) and node.__name__ == 'content':
+                if before:
+                    yield before(self, node)
+                if content_begin:
+                    yield content_begin(self, node)
+                yield from self._iter_content(node)
+                if content_end:
+                    yield content_end(self, node)
+                if after:
+                    yield after(self, node)
+            else:
+                yield self.visit([node])
+        if end:
+            yield end(self)
     
     def parse_markdown(self, text: str, peg=None, *, title_id_begin_level: int | None = 1) -> str:
-        g = self.grammar if self.grammar else MarkdownGrammar()
+        g = self.grammar if isinstance(self.grammar, MarkdownGrammar) else the_grammar()
         
-        if not isinstance(g, MarkdownGrammar):
-            g = MarkdownGrammar()
-        
-        if isinstance(peg, str):
-            peg = g[peg]
-        resultSoFar = []
-        result, rest = g.parse(text, root=peg, resultSoFar=resultSoFar, skipWS=False)
+        if peg is None or isinstance(peg, str):
+            result = g.parse_fragment(text, peg or '')
+        else:
+            result, rest = g.parse(text, root=peg, resultSoFar=[], skipWS=False)
         
         if not result or len(result) == 0:
             return ""
@@ -365,6 +569,62 @@ class MarkdownHtmlVisitor(MDHTMLVisitor):
         
         return parsed_output
 
+    # Resource lists that rendering appends to; a cached block replays its additions.
+    _block_effect_lists = ('links_ext', 'links_int', 'images', 'videos', 'audios', 'footnotes')
+
+    def visit_content(self, node: Symbol) -> str:
+        if self.block_cache is None:
+            return self.visit(node.what)
+        return ''.join(self._iter_content(node))
+
+    def _iter_content(self, node: Symbol) -> Iterator[str]:
+        if self.block_cache is None:
+            yield from (self.visit([block]) for block in node.what)
+            return
+        res = self.resources
+        context = repr((type(self).__qualname__, sorted(self.tag_class.items()), res.link_references))
+        for block in node.what:
+            yield self.visit([block]) if block.__name__ == 'blankline' else self._render_block(block, context)
+
+    def _render_block(self, block: Symbol, context: str) -> str:
+        """Render one top-level block through `block_cache`.
+        The key covers the block source, the document context and, only for the blocks that read
+        it, the heading/section state (titles, directives) and the footnote counter."""
+        res, source = self.resources, block.text
+        titled   = block.__name__ in ('title', 'directive')
+        noted    = '[^' in source
+        state = [context, block.__name__, source]
+        if titled:
+            state += [sorted(res.titles_ids.items()), self._title_id_begin_level, self._current_section_level]
+            if block.__name__ == 'directive':
+                state.append(res.toc_items)
+        if noted:
+            state += [self.footnote_id, [note['name'] for note in res.footnotes]]
+        key = hashlib.blake2b(repr(state).encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        
+        if (cached := self.block_cache.get(key)) is not None:
+            html, effects = cached
+            for name in self._block_effect_lists:
+                getattr(res, name).extend(effects.get(name, ()))
+            if titled:
+                res.titles_ids.clear()
+                res.titles_ids.update(effects['titles_ids'])
+                self._title_id_begin_level, self._current_section_level = effects['sections']
+            if noted:
+                self.footnote_id = effects['footnote_id']
+            return html
+        
+        before = {name: len(getattr(res, name)) for name in self._block_effect_lists}
+        html = self.visit([block])
+        effects = {name: getattr(res, name)[n:] for name, n in before.items() if len(getattr(res, name)) > n}
+        if titled:
+            effects['titles_ids'] = dict(res.titles_ids)
+            effects['sections'] = (self._title_id_begin_level, self._current_section_level)
+        if noted:
+            effects['footnote_id'] = self.footnote_id
+        self.block_cache.put(key, html, effects)
+        return html
+
     def _extract_attrs(self, node: Symbol) -> dict:
         """Extract attributes from `attr_def` into a kwargs-ready dict.
 
@@ -425,7 +685,11 @@ class MarkdownHtmlVisitor(MDHTMLVisitor):
         return self.tag('hr', enclose=1)
 
     def visit_paragraph(self, node: Symbol) -> str:
-        content = self.visit(node).strip()
+        return self._paragraph(self.visit(node))
+
+    def _paragraph(self, content: str) -> str:
+        """`<p>` around rendered inline content, or '' if it is blank."""
+        content = content.strip()
         # Fallback subscript handling for inline patterns that survive token parsing.
         content = _RE_SUBSCRIPT_FALLBACK.sub(r'<sub>\1</sub>', content)
         # Fallback strikethrough handling for inline patterns that survive token parsing.
@@ -470,8 +734,7 @@ class MarkdownHtmlVisitor(MDHTMLVisitor):
         def process_node(n):
             if n is None:
                 return ''
-            text = ''.join(self.visit(x) for x in n)
-            t = self.parse_markdown(text, 'content').rstrip()
+            t = self._list_item(n).rstrip()
             
             # If content starts with a single paragraph, unwrap it
             if t.startswith('<p>') and t.count('<p>') == 1:
@@ -499,6 +762,28 @@ class MarkdownHtmlVisitor(MDHTMLVisitor):
             return ''.join(l_items)
         return create_list(self.lists)
 
+    def _list_item(self, node: Symbol) -> str:
+        """Blocks of an item's list_content: a paragraph per line and the nested lists, rendered from the
+        tree, and the other indented blocks, parsed from their dedented lines."""
+        blocks, lines = [], []
+        for x in node.what:
+            if x.__name__ == 'list_indent_lines':
+                lines.append(self.visit(x))
+                continue
+            if lines:
+                blocks.append(self.parse_markdown(''.join(lines), 'content'))
+                lines = []
+            if x.__name__ == 'lists':
+                blocks.append(self.visit([x]))
+            elif x.__name__ == 'list_first_para' and _RE_LIST_ITEM_BLOCK.match(x.text):
+                blocks.append(self.parse_markdown(self.visit(x), 'content'))   # `- 1. item`, `- # title`
+            else:
+                html = self.visit(x)
+                blocks.append(self._paragraph(html) or '\n' * html.count('\n'))
+        if lines:
+            blocks.append(self.parse_markdown(''.join(lines), 'content'))
+        return ''.join(blocks)
+
     def visit_dl_begin(self, node: Symbol) -> str:
         return self.tag('dl', newline=True)
 
@@ -729,7 +1014,7 @@ class MarkdownHtmlVisitor(MDHTMLVisitor):
         s = [self.tag('thead')+self.tag('tr', newline=False)]
         for t in ('table_td', 'table_other'):
             for x in node.find_all(t):
-                s.append(self.tag('th', child=self.visit(x).strip(), enclose=2, newline=False))
+                s.append(self.tag('th', child=x.text.removesuffix('|').strip(), enclose=2, newline=False))
         s.append(self.tag('tr', enclose=3)+self.tag('thead', enclose=3))
         return ''.join(s)
 
@@ -743,6 +1028,9 @@ class MarkdownHtmlVisitor(MDHTMLVisitor):
         nodes = list(node.find_all('table_td')) + list(node.find_all('table_other'))
         s = [self.tag('tr', newline=False)]
         for i, x in enumerate(nodes):
+            if inline := next(x.find_all_here('text'), None):
+                s.append(self.tag('td', self.visit(inline).strip(), align=self.table_align.get(i, ''), newline=False, enclose=2))
+                continue
             text = self.visit(x)
             if text != "":
                 # Table cells often carry alignment padding spaces that must not become hard line breaks.
@@ -1254,7 +1542,7 @@ class MarkdownHtmlVisitor(MDHTMLVisitor):
 
 def _safe_parse_and_extract(text, grammar=None):
     """Parse text safely and extract the result element, returning (parse_result, grammar)"""
-    g = grammar or MarkdownGrammar()
+    g = grammar or the_grammar()
     result, _ = g.parse(text, resultSoFar=[], skipWS=False)
     if not result:
         return None, g
@@ -1271,15 +1559,35 @@ def parseText(text, grammar=None, visitor=None):
     return v.visit(parse_result, root=True)
 
 
-def parseHtml(text, tag_class=None, grammar=None, visitor=None):
-    """Parse markdown text and return HTML"""
+def parseHtml(text, tag_class=None, grammar=None, visitor=None, block_cache: BlockCache | None = None):
+    """Parse markdown text and return HTML; with a `BlockCache`, unchanged blocks reuse earlier HTML"""
     parse_result, g = _safe_parse_and_extract(text, grammar)
     if parse_result is None:
         return ""
     v = (visitor or MarkdownHtmlVisitor)(tag_class or {}, g)
+    v.block_cache = block_cache
     return v.visit(parse_result, root=True)
 
 
+def iter_html(text, tag_class=None, grammar=None, visitor=None, block_cache: BlockCache | None = None) -> Iterator[str]:
+    """Like `parseHtml`, but yield the HTML in chunks, one per top-level block, as it is rendered"""
+    parse_result, g = _safe_parse_and_extract(text, grammar)
+    if parse_result is None:
+        return
+    v = (visitor or MarkdownHtmlVisitor)(tag_class or {}, g)
+    v.block_cache = block_cache
+    yield from (chunk for chunk in v.iter_visit(parse_result) if chunk)
+
+
+def render_to(text, file: IO[str], tag_class=None, grammar=None, visitor=None, block_cache: BlockCache | None = None) -> int:
+    """Write the HTML of `text` to `file` block by block; returns the number of characters written"""
+    written = 0
+    for chunk in iter_html(text, tag_class, grammar, visitor, block_cache):
+        file.write(chunk)
+        written += len(chunk)
+    return written
+
+
 def parseEmbeddedHtml(text):
     """Parse markdown and strip outer <p> tags if only one paragraph"""
     if html := parseHtml(text):
@@ -1288,13 +1596,776 @@ def parseEmbeddedHtml(text):
     return html
 
 
-def parseHtmlDebug(text, tag_class=None, grammar=None, visitor=None):
+def parseHtmlDebug(text, tag_class=None, grammar=None, visitor=None, block_cache: BlockCache | None = None):
     """Parse markdown text and return tuple of (HTML, resources_dict)
        * resources_dict contains all tracked resources including links, images, videos, etc.
     """
     parse_result, g = _safe_parse_and_extract(text, grammar)
     v = (visitor or MarkdownHtmlVisitor)(tag_class or {}, g)
+    v.block_cache = block_cache
     if parse_result is None:
         return "", v.resources.to_dict()
     html = v.visit(parse_result, root=True)
-    return (html, v.resources.to_dict())
\ No newline at end of file
+    return (html, v.resources.to_dict())
+
+
+def _title_level(node: Symbol) -> int:
+    """Heading level of an `atx_title` or `setext_title` node"""
+    if node.__name__ == 'setext_title':
+        return 1 if (u.text[0] if (u := node.find('setext_underline')) else '=') == '=' else 2
+    return len(h.text) if (h := node.find('hashes')) and h.text else 1
+
+
+class ResourceCollector(SimpleVisitor):
+    """Collects the resources `MarkdownHtmlVisitor` records, without producing any HTML.
+
+    Walks the parse tree and only stops at the nodes that record something (links, media, headings,
+    footnotes). Text the renderer parses again (quotes, cards, list items, table cells, link texts)
+    is parsed with the shared fragment cache and walked the same way; nothing is escaped or tagged.
+    Footnote texts are kept as their markdown source."""
+
+    _extract_attrs         = MarkdownHtmlVisitor._extract_attrs
+    _extract_title         = MarkdownHtmlVisitor._extract_title
+    _is_safe_url           = MarkdownHtmlVisitor._is_safe_url
+    _get_media_type        = MarkdownHtmlVisitor._get_media_type
+    _collect_link_reference = MarkdownHtmlVisitor._collect_link_reference
+    _alt_title             = MarkdownHtmlVisitor._alt_title
+    get_title_id           = MarkdownHtmlVisitor.get_title_id
+
+    def __init__(self, grammar=None, resources=None):
+        super().__init__(grammar if isinstance(grammar, MarkdownGrammar) else the_grammar())
+        self.resources = resources if resources is not None else ResourceStore()
+        self._title_id_begin_level: int | None = 1
+
+    def collect(self, nodes, source: str | None = None) -> ResourceStore:
+        """Record the resources of a parse result (`[article]`, or a fragment from `parse_fragment`).
+        With the (prepared) `source` it was parsed from, blocks that cannot hold a link are skipped."""
+        if nodes:
+            self._walk(nodes[0], source, toc=True)
+        return self.resources
+
+    # Top-level blocks that change heading state; any other block records nothing unless it has a
+    # link or media, which all need a '[' or an URL scheme in their source.
+    _stateful = frozenset({'title', 'directive'})
+
+    def _walk(self, root: Symbol, source: str | None = None, toc: bool = False) -> None:
+        content = root.what[0] if root.__name__ == 'article' else root
+        if content.__name__ != 'content':
+            self.visit(content)
+            return
+        # Definitions and headings are top-level blocks: the renderer's pre-scan, without the tree walk
+        for block in content.what:
+            match block.__name__:
+                case 'link_reference': self._collect_link_reference(block)
+                case 'title' if toc:   self._alt_title(block)
+        for block in content.what:
+            if (source is None or block.__name__ in self._stateful
+                    or source.find('[', block.offset, block.end) >= 0 or source.find('://', block.offset, block.end) >= 0):
+                self.visit(block)
+
+    def visit(self, nodes, root=False) -> str:
+        dispatch = self._dispatch
+        for node in ([nodes] if isinstance(nodes, Symbol) else nodes):
+            if isinstance(node, Symbol):
+                if (method := (dispatch.get(node.__name__) or self._handlers(node.__name__))[1]):
+                    method(self, node)
+                elif isinstance(node.what, list):
+                    self.visit(node.what)
+        return ''
+
+    def _fragment(self, text: str, peg: str, title_id_begin_level: int | None = 1) -> None:
+        """What `MarkdownHtmlVisitor.parse_markdown` would record for `text`"""
+        if not (result := self.grammar.parse_fragment(text, peg)):
+            return
+        outer = self.resources, self._title_id_begin_level
+        self.resources, self._title_id_begin_level = self.resources.nested_store(), title_id_begin_level
+        try:
+            self._walk(result[0])
+        finally:
+            self.resources, self._title_id_begin_level = outer
+
+    def _media(self, url: str) -> None:
+        match self._get_media_type(url)[0]:
+            case 'youtube' | 'video': self.resources.videos.append(url)
+            case 'audio':             self.resources.audios.append(url)
+            case _:                   self.resources.images.append(url)
+
+    def _link(self, url: str) -> None:
+        if self._is_safe_url(url):
+            self.resources.links_ext.append(url)
+
+    def _list_content(self, node: Symbol) -> None:
+        lines = []      # consecutive indented blocks are parsed together, as `_list_item` renders them
+        for child in node.what:
+            if not isinstance(child, Symbol):
+                continue
+            if child.__name__ == 'list_indent_lines':
+                lines.extend(n.text for n in child.find_all('list_rest_of_line'))
+                lines.extend('\n' for blanks in child.find_all_here('blanklines') for _ in blanks.what)
+                continue
+            if lines:
+                self._fragment(''.join(lines), 'content')
+                lines = []
+            self.visit(child)
+        if lines:
+            self._fragment(''.join(lines), 'content')
+
+    def visit_link_reference(self, node): pass
+    def visit_html_comment(self, node):   pass
+    def visit_check_radio(self, node):    pass
+    def visit_table_head(self, node):     pass
+    def visit_table_separator(self, node): pass
+
+    def visit_title(self, node):
+        title = node.what[0]
+        if not self._extract_attrs(title).get('_id'):
+            self.get_title_id(_title_level(title))
+        if title_node := title.find('title_text'):
+            self._fragment(title_node.text.strip(), 'text')
+
+    def visit_directive(self, node):
+        if (name := node.find('directive_name')) and name.text in ['toc', 'contents'] and self.resources.toc_items:
+            self.resources.titles_ids.clear()
+
+    def visit_footnote_desc(self, node):
+        name = node.find('footnote').text.strip('[^]')
+        if name in [fn['name'] for fn in self.resources.footnotes]:
+            raise Exception("The footnote %s is already existed" % name)
+        text_node = node.find('footnote_text')
+        self._list_content(text_node)
+        self.resources.footnotes.append({'name': name, 'text': text_node.text.strip()})
+
+    def visit_bullet_list_item(self, node):
+        self._list_content(node.find('list_content'))
+
+    visit_number_list_item = visit_bullet_list_item
+
+    def visit_dl_dt(self, node):
+        self._fragment(node.text.strip(':| \t'), 'inline_text')
+
+    def visit_fmt_bold(self, node):
+        if a := node.find('words'):
+            self.visit(a)
+        else:
+            self._fragment(node.text.strip('*_'), 'text')
+
+    visit_fmt_bold2 = visit_fmt_bold
+
+    def visit_blockquote(self, node):
+        lines = node.text.splitlines()
+        self._fragment('\n'.join(line.lstrip('> ').rstrip() for line in lines).strip() + '\n', 'content')
+        if attrib := node.find('quote_name'):
+            self._fragment(attrib.text, 'inline_text')
+
+    def visit_card(self, node):
+        if content_node := node.find('card_content'):
+            self._fragment(content_node.text.strip(), 'content', title_id_begin_level=None)
+
+    def visit_side_block(self, node):
+        for thing in node.find_all('side_block_cont'):
+            self._fragment(thing.text, 'content')
+
+    def visit_table_body_line(self, node):
+        for x in list(node.find_all('table_td')) + list(node.find_all('table_other')):
+            if inline := next(x.find_all_here('text'), None):
+                self.visit(inline)
+                continue
+            sep = x.find('table_sep')
+            if text := (x.text[:len(x.text) - len(sep.text)] if sep else x.text):
+                self._fragment(text.rstrip(), 'text')
+
+    def visit_button(self, node):
+        if label := node.find('button_label'):
+            self._fragment(label.text.strip(), 'inline_text')
+
+    def visit_input_elem(self, node):
+        if label_node := node.find('input_label'):
+            self._fragment(label_node.text.strip(), 'inline_text')
+
+    visit_output_elem = visit_input_elem
+
+    def visit_raw_url(self, node):
+        self._link(node.text)
+
+    def visit_inline_link(self, node):
+        if not (url_node := node.find('link_url')):
+            return
+        self._fragment(text_node.text if (text_node := node.find('link_text')) else url_node.text, 'inline_text')
+        if self._is_safe_url(url := url_node.text):
+            self.resources.links_ext.append(url)
+            if self._extract_attrs(node) == {}:
+                self.resources.links_ext.append(url)
+
+    def visit_reference_link(self, node):
+        if not (text_node := node.find('link_text')):
+            return
+        self._fragment(text_node.text, 'inline_text')
+        # The renderer looks the label up by the rendered text; for plain labels that is the source
+        label = (label_node.text if (label_node := node.find('link_label')) and label_node.text else text_node.text)
+        if ref := self.resources.link_references.get(label.lower()):
+            self._link(ref['url'])
+
+    def visit_shortcut_reference_link(self, node):
+        if not (text_node := node.find('link_text')):
+            return
+        self._fragment(text_node.text, 'inline_text')
+        if ref := self.resources.link_references.get(text_node.text.lower()):
+            self._link(ref['url'])
+
+    def visit_wiki_link(self, node):
+        page   = (page_node.text   if   (page_node := node.find('wiki_link_page')) else '')
+        anchor = (anchor_node.text if (anchor_node := node.find('wiki_link_anchor')) else '')
+        if raw := (text_node.text if (text_node := node.find('wiki_link_text')) else page):
+            self._fragment(raw, 'inline_text')
+        self.resources.links_int.append((page.lower().replace(' ', '-') + '.html' + anchor) if page else anchor)
+
+    def visit_image_link(self, node):
+        image_url = (image_url_node.text if (image_url_node := node.find('image_url')) else '')
+        link_url  = (link_url_node.text if (link_url_node := node.find('link_url')) else '')
+        if not self._is_safe_url(image_url) or not self._is_safe_url(link_url):
+            return
+        self._media(image_url)
+        if alt := (alt_node.text if (alt_node := node.find('image_alt')) else None):
+            self._fragment(alt, 'inline_text')
+        self.resources.links_ext.append(link_url)
+
+    def visit_inline_image(self, node):
+        if (url_node := node.find('image_url')) and self._is_safe_url(url_node.text):
+            self._media(url_node.text)
+
+    def visit_reference_image(self, node):
+        alt = (alt_node.text if (alt_node := node.find('image_alt')) else '')
+        label = (label_node.text.lower()
+                if (label_node := node.find('image_ref_label')) and label_node.text
+                else alt.lower())
+        if (ref := self.resources.image_references.get(label)) and self._is_safe_url(ref['url']):
+            self._media(ref['url'])
+
+    def visit_wiki_image(self, node):
+        if (file_node := node.find('wiki_image_file')) and self._is_safe_url(file_node.text):
+            self._media(file_node.text)
+
+
+def extract_resources(text, grammar=None) -> dict:
+    """The resources dict of `parseHtmlDebug(text)[1]`, collected without rendering any HTML.
+    The one difference: footnote texts are the footnotes' markdown source, not rendered HTML."""
+    parse_result, g = _safe_parse_and_extract(text, grammar)
+    v = ResourceCollector(g)
+    if parse_result is not None:
+        v.collect([parse_result], g.prepare(text))
+    return v.resources.to_dict()
+
+
+@dataclass(slots=True)
+class TextSection:
+    """Plain text of a document section: a top-level heading and the blocks up to the next one"""
+    title: str      # '' for the text before the first heading
+    level: int      # 0 for the text before the first heading
+    start: int      # source offsets of the section, heading included
+    end:   int
+    text:  str
+
+
+_RE_MARKUP   = re.compile(r'[\\*_`\[\]<>&~^!|:]|--|,,|://|\w@\w')
+_RE_HTML_TAG = re.compile(r'<[^>]*>')
+
+
+class PlainTextVisitor(SimpleVisitor):
+    """Text of a parse tree for full-text indexing.
+
+    Markup, URLs, attributes and link definitions are dropped; link texts, image alts, code and table
+    cells are kept. Text the tree holds as raw markdown (quotes, cards, cells, link texts) is parsed
+    through the fragment cache only when it contains markup. Output is appended to `out`."""
+
+    _skip = frozenset({'attr_def', 'link_url', 'link_title', 'link_label', 'image_url', 'image_title',
+                       'image_ref_label', 'link_reference', 'html_comment', 'footnote', 'hashes',
+                       'setext_underline', 'table_sep', 'table_separator', 'check_radio', 'directive',
+                       'pre_lang', 'form_type', 'form_action', 'button_action', 'wiki_link_anchor',
+                       'wiki_image', 'side_block_head'})
+
+    def __init__(self, grammar=None):
+        super().__init__(grammar if isinstance(grammar, MarkdownGrammar) else the_grammar())
+        self.out: list[str] = []
+
+    def iter_sections(self, root: Symbol, source_offset=None) -> Iterator[TextSection]:
+        """Yield a `TextSection` per top-level heading of `root` (a parse result's `article`) as it
+        is rendered. `source_offset` maps offsets of the parsed text to the caller's text."""
+        content = root.what[0] if root.__name__ == 'article' else root
+        to_source = source_offset or (lambda offset: offset)
+        title, level, start = '', 0, 0
+        for block in content.what:
+            if block.__name__ != 'title':
+                self.visit(block)
+                continue
+            end = to_source(block.offset)
+            if (text := self._flush()) or title:
+                yield TextSection(title, level, start, end, text)
+            heading = block.what[0]
+            if title_node := heading.find('title_text'):
+                self._markdown(title_node.text.strip(), 'text')
+            title, level, start = self._flush(), _title_level(heading), end
+        if (text := self._flush()) or title:
+            yield TextSection(title, level, start, to_source(content.end), text)
+
+    def _flush(self) -> str:
+        """The text appended since the last flush, one line per non-blank line"""
+        text = '\n'.join(line for l in ''.join(self.out).split('\n') if (line := ' '.join(l.split())))
+        self.out = []
+        return text
+
+    def visit(self, nodes, root=False) -> str:
+        dispatch, skip, out = self._dispatch, self._skip, self.out
+        for node in ([nodes] if isinstance(nodes, Symbol) else nodes):
+            if isinstance(node, str) or (name := node.__name__) in skip:
+                continue
+            if (method := (dispatch.get(name) or self._handlers(name))[1]):
+                method(self, node)
+            elif (what := node.what).__class__ is str:
+                out.append(what)
+            else:
+                self.visit(what)
+        return ''
+
+    def _markdown(self, text: str, peg: str) -> None:
+        """Append the text of `text` parsed from `peg`; as is when it has no markup or does not parse"""
+        if not _RE_MARKUP.search(text):
+            self.out.append(text)
+            return
+        try:
+            result = self.grammar.parse_fragment(text, peg)
+        except SyntaxError:
+            result = None
+        if result:
+            self.visit(result[0])
+        else:
+            self.out.append(text)
+
+    def visit_blankline(self, node):
+        self.out.append('\n')
+
+    def visit_title(self, node):
+        if title_node := node.what[0].find('title_text'):
+            self._markdown(title_node.text.strip(), 'text')
+        self.out.append('\n')
+
+    def visit_escaped_string(self, node):
+        self.out.append(node.text[1:])
+
+    def visit_htmlentity(self, node):
+        self.out.append(unescape(node.text))
+
+    def visit_longdash(self, node):
+        self.out.append('—')
+
+    def visit_html_inline(self, node):
+        self.out.append(unescape(_RE_HTML_TAG.sub('', node.text)))
+
+    def visit_html_block(self, node):
+        self.out.append(unescape(_RE_HTML_TAG.sub(' ', node.text)) + '\n')
+
+    def visit_fmt_code(self, node):
+        self.out.append(node.text.strip('`'))
+
+    def visit_fmt_bold2(self, node):
+        self.out.append(node.text.strip('_'))
+
+    visit_fmt_italic2 = visit_fmt_bold2
+
+    def visit_pre_indented(self, node):
+        self.out.append(node.text)
+
+    def visit_link_text(self, node):
+        self._markdown(node.text, 'inline_text')
+
+    visit_image_alt = visit_wiki_link_text = visit_button_label = visit_link_text
+
+    def visit_wiki_link(self, node):
+        if text_node := node.find('wiki_link_text'):
+            self.visit_link_text(text_node)
+        elif page_node := node.find('wiki_link_page'):
+            self.out.append(page_node.text)
+
+    def visit_list_indent_lines(self, node):
+        self._markdown(''.join(n.text for n in node.find_all('list_rest_of_line')), 'content')
+
+    def visit_blockquote(self, node):
+        lines = (line.text if (line := q.find('rest_of_line')) else '' for q in node.find_all('quote_lines'))
+        self._markdown('\n'.join(lines) + '\n', 'content')
+        if attr := node.find('quote_attr'):
+            self.out.append('— ')
+            self.visit(attr)
+        self.out.append('\n')
+
+    def visit_quote_date(self, node):
+        self.out.append(f' ({node.text})')
+
+    def visit_card(self, node):
+        if content_node := node.find('card_content'):
+            self._markdown(content_node.text.strip() + '\n', 'content')
+
+    def visit_table_body_line(self, node):
+        for x in list(node.find_all('table_td')) + list(node.find_all('table_other')):
+            if inline := next(x.find_all_here('text'), None):
+                self.visit(inline)
+                self.out.append(' ')
+            elif text := x.text.strip('| \t'):
+                self._markdown(text, 'text')
+                self.out.append(' ')
+        self.out.append('\n')
+
+    visit_table_head = visit_table_body_line
+
+    def visit_input_elem(self, node):
+        if label_node := node.find('input_label'):
+            self._markdown(label_node.text.strip(), 'inline_text')
+        self.out.append('\n')
+
+    visit_output_elem = visit_input_elem
+
+
+def iter_text_sections(text, grammar=None) -> Iterator[TextSection]:
+    """Plain text of markdown `text` for search indexing, one `TextSection` per top-level heading"""
+    parse_result, g = _safe_parse_and_extract(text, grammar)
+    if parse_result is None:
+        return
+    yield from PlainTextVisitor(g).iter_sections(parse_result, _source_offsets(text))
+
+
+## Parallel rendering
+#  Workers parse stretches of the document that start at likely block boundaries, and render the blocks
+#  that do not depend on document-wide state. Headings, directives, link definitions and footnotes are
+#  parsed again and rendered in order by the caller. A stretch that did not start on a real block
+#  boundary, or link definitions that differ from the pre-scan, fall back to a sequential render.
+
+_RE_BLOCK_START = re.compile(r'\n(?:[ \t]*\n)+(?=[A-Za-z#])')
+_RE_LINK_REFERENCE = re.compile(r'^[ \t]*\[([^\]\n]+)\]:[ \t]+(\S+)(?:[ \t]+(["\'][^"\'\n\r]*["\']|\([^\)]*\)))?[ \t]*$', re.M)
+_worker_state: dict = {}
+
+
+def _init_block_worker(source: str, references: dict, tag_class: dict) -> None:
+    _worker_state.update(source=source, references=references, tag_class=tag_class, grammar=the_grammar())
+
+
+def _render_stretch(start: int, stop: int) -> tuple[list[tuple], int, bool]:
+    """Parse blocks from `start` until one ends at or past `stop`.
+    Returns `(start, end, html, effects)` per block (html is None for the blocks left to the caller),
+    where parsing ended and whether it ended because no block matched."""
+    source, g = _worker_state['source'], _worker_state['grammar']
+    p = parser(p=True)
+    p.reset(source)
+    v = MarkdownHtmlVisitor(_worker_state['tag_class'], g)
+    res = v.resources
+    res.link_references = res.image_references = _worker_state['references']
+    items, pos = [], start
+    while pos < stop:
+        found = []
+        if (end := p.parseAt(pos, g.block, found, skipWS=False)) < 0:
+            return items, pos, True
+        block = found[0]
+        if block.__name__ in ('title', 'directive', 'link_reference') or '[^' in block.text:
+            items.append((pos, end, None, None))
+        else:
+            before = {name: len(getattr(res, name)) for name in v._block_effect_lists}
+            html = v.visit([block])
+            items.append((pos, end, html, {name: getattr(res, name)[n:] for name, n in before.items()}))
+        pos = end
+    return items, pos, False
+
+
+def _stitch(stretches: list[tuple[list[tuple], int, bool]], length: int) -> list[tuple] | None:
+    """The blocks of the real parse, from stretches parsed speculatively; None if they do not line up
+    or do not reach the end of the `length` characters of source (or a point where parsing stops)."""
+    blocks, pos = [], 0
+    for items, end, failed in stretches:
+        if end <= pos and not (failed and end == pos):
+            continue                        # all behind the blocks taken so far
+        starts = [item[0] for item in items]
+        if pos not in starts and not (failed and end == pos):
+            return None
+        blocks += items[starts.index(pos):] if pos in starts else []
+        pos = end
+        if failed:
+            return blocks
+    return blocks if pos == length else None
+
+
+def parseHtmlParallel(text, tag_class=None, workers: int | None = None, chunk_chars: int | None = None, resources: bool = False):
+    """Parse and render markdown text across a process pool; returns the HTML, or `(HTML, resources_dict)`
+    with `resources`, exactly as `parseHtml`/`parseHtmlDebug` would.
+       * workers: number of processes (default: the CPU count)
+       * chunk_chars: approximate size of the stretch each task parses
+    """
+    def sequential():
+        html, found = parseHtmlDebug(text, tag_class)
+        return (html, found) if resources else html
+
+    workers = workers or os.cpu_count() or 1
+    source = MarkdownGrammar.prepare(text) if text and isinstance(text, str) else ''
+    chunk_chars = chunk_chars or max(len(source) // (4 * workers), 1 << 14)
+    cuts = [0]
+    while (m := _RE_BLOCK_START.search(source, cuts[-1] + chunk_chars)):
+        cuts.append(m.end())
+    if workers < 2 or len(cuts) < 2:
+        return sequential()
+
+    g = the_grammar()
+    v = MarkdownHtmlVisitor(tag_class or {}, g)
+    for m in _RE_LINK_REFERENCE.finditer(source):    # cheap pre-scan, checked against the parse below
+        label, url, title = m.groups()
+        v.resources.link_references[label.lower()] = {'url': url, 'title': v._extract_title(title) if title else None}
+    references, v.resources.link_references = v.resources.link_references, {}
+
+    with ProcessPoolExecutor(workers, initializer=_init_block_worker, initargs=(source, references, tag_class or {})) as pool:
+        stretches = list(pool.map(_render_stretch, cuts, cuts[1:] + [len(source)]))
+    if not (blocks := _stitch(stretches, len(source))):
+        return sequential()
+
+    p = parser(p=True)
+    p.reset(source)
+    deferred = {}
+    for start, end, html, _ in blocks:
+        if html is None:
+            found = []
+            p.parseAt(start, g.block, found, skipWS=False)
+            deferred[start] = block = found[0]
+            match block.__name__:
+                case 'link_reference': v._collect_link_reference(block)
+                case 'title':          v._alt_title(block)
+    if v.resources.link_references != references:
+        return sequential()
+
+    res, out = v.resources, []
+    for start, end, html, effects in blocks:
+        if html is None:
+            out.append(v.visit([deferred[start]]))
+        else:
+            for name, added in effects.items():
+                getattr(res, name).extend(added)
+            out.append(html)
+    out.append(v.__end__())
+    html = ''.join(out)
+    return (html, res.to_dict()) if resources else html
+
+
+## Batches
+
+def _init_batch_worker() -> None:
+    the_grammar()     # build the grammar once per worker, before the first document arrives
+
+
+def _render_one(text, tag_class=None, resources: bool = False):
+    """`parseHtml`/`parseHtmlDebug` of one batch item; an error is returned instead of raised."""
+    try:
+        html, found = parseHtmlDebug(text, tag_class)
+        return (html, found) if resources else html
+    except Exception as e:
+        return e
+
+
+def parseHtmlMany(texts: Iterable[str], tag_class=None, workers: int | None = None, chunksize: int = 64, resources: bool = False) -> list:
+    """Render many markdown documents, in input order, across a process pool.
+       * workers: number of processes (default: the CPU count; 1 renders in this process)
+       * chunksize: documents sent to a worker at a time
+       * resources: give `(HTML, resources_dict)` per document, as `parseHtmlDebug` does
+    A document that fails to render gives its exception in its place; the rest of the batch is unaffected.
+    """
+    render = partial(_render_one, tag_class=tag_class, resources=resources)
+    workers = workers or os.cpu_count() or 1
+    if workers < 2:
+        return list(map(render, texts))
+    with ProcessPoolExecutor(workers, initializer=_init_batch_worker) as pool:
+        return list(pool.map(render, texts, chunksize=chunksize))
+
+
+def _common_prefix(a: str, b: str, limit: int) -> int:
+    """Length of the common prefix of `a` and `b`, up to `limit`; compares slices, not characters."""
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix(a: str, b: str, limit: int) -> int:
+    lo, hi = 0, limit
+    la, lb = len(a), len(b)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[la - mid:la - lo] == b[lb - mid:lb - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _prepare_span(text: str, start: int, end: int) -> str:
+    """What `text[start:end]` becomes in `MarkdownGrammar.prepare(text)`, for `start` and `end` at line
+    starts: `prepare` only looks one character past a line break, which stands in for the rest."""
+    if end >= len(text):
+        return MarkdownGrammar.prepare(text[start:])
+    if text[end] in '\r\n':
+        return MarkdownGrammar.prepare(text[start:end] + '\n')[:-1]
+    return MarkdownGrammar.prepare(text[start:end] + 'x')[:-2]
+
+
+# Closing tokens of constructs that scan ahead across blocks (html blocks, fences, comments, cards,
+# buttons): an edit with one of these can change how an earlier block parses, so it reparses everything.
+_RE_LONG_RANGE = re.compile(r'</|-->|```|~~~|\|\]|\)\)')
+
+
+class MarkdownDocument:
+    """An editable markdown buffer that keeps its parse tree up to date incrementally:
+
+        doc = MarkdownDocument(text)
+        doc.apply_edit(start, end, 'new text')   # offsets into doc.text
+        html = doc.html()
+
+    An edit normalises and reparses the text from the top-level block before the change up to the
+    first unchanged block boundary after it. The blocks past that point are kept as they are: their
+    offsets are only moved, a run of blocks at a time, when `blocks` or `tree` is read. Rendering
+    goes through a `BlockCache`, so it too only redoes the blocks that changed."""
+
+    _max_shifts = 64    # pending offset shifts kept before they are applied to the blocks
+
+    def __init__(self, text: str = '', grammar: MarkdownGrammar | None = None, block_cache: BlockCache | None = None):
+        self.grammar = grammar or the_grammar()
+        self.block_cache = block_cache if block_cache is not None else BlockCache()
+        self.set_text(text)
+
+    def set_text(self, text: str) -> None:
+        """Replace the whole buffer and parse it from scratch."""
+        source, blocks, rest = MarkdownGrammar.prepare(text) if text else '', [], ''
+        if source:
+            result, rest = parseLine(source, self.grammar.root, [], skipWS=False, packrat=True)
+            blocks = list(result[0].what[0].what)
+        to_text = _source_offsets(text)
+        self.text, self.source, self.rest = text, source, rest
+        self._blocks = blocks
+        self._starts = [to_text(block.offset) for block in blocks]     # offsets of the blocks in `text`
+        # (first block, source delta, text delta): from that block on, the offsets of the blocks and
+        # of `_starts` are off by the deltas, until the next entry
+        self._shifts = [(0, 0, 0)]
+        self.reparsed = range(len(blocks))     # indexes of the blocks the last change parsed
+
+    @property
+    def blocks(self) -> list[Symbol]:
+        """The top-level blocks of the parse."""
+        if len(self._shifts) > 1 or self._shifts[0] != (0, 0, 0):
+            self._apply_shifts()
+        return self._blocks
+
+    def _apply_shifts(self) -> None:
+        blocks, starts, source = self._blocks, self._starts, self.source
+        bounds = self._shifts + [(len(blocks), 0, 0)]
+        for (lo, delta, text_delta), (hi, _, _) in zip(bounds, bounds[1:]):
+            if delta:
+                blocks[lo:hi] = [block.shifted(delta, source) for block in blocks[lo:hi]]
+            if text_delta:
+                starts[lo:hi] = [start + text_delta for start in starts[lo:hi]]
+        self._shifts = [(0, 0, 0)]
+
+    def _shift(self, index: int) -> tuple[int, int, int]:
+        return self._shifts[bisect_right(self._shifts, index, key=lambda shift: shift[0]) - 1]
+
+    def _count_before(self, offset: int, in_text: bool = False) -> int:
+        """Number of blocks starting before `offset` of the source (or with `in_text`, of the text)."""
+        bounds = self._shifts + [(len(self._blocks), 0, 0)]
+        for (lo, delta, text_delta), (hi, _, _) in zip(bounds, bounds[1:]):
+            if in_text:
+                i = bisect_left(self._starts, offset - text_delta, lo, hi)
+            else:
+                i = bisect_left(self._blocks, offset - delta, lo, hi, key=lambda block: block.offset)
+            if i < hi:
+                return i
+        return len(self._blocks)
+
+    def update(self, text: str) -> None:
+        """Replace the buffer with `text`, reparsing only around what differs from the current one."""
+        limit = min(len(text), len(self.text))
+        start = _common_prefix(self.text, text, limit)
+        tail = _common_suffix(self.text, text, limit - start)
+        self.apply_edit(start, len(self.text) - tail, text[start:len(text) - tail])
+
+    def apply_edit(self, start: int, end: int, new_text: str) -> None:
+        """Replace `text[start:end]` with `new_text`."""
+        if not 0 <= start <= end <= len(self.text):
+            raise IndexError(f"edit range {start}:{end} outside of the text")
+        old_text, old = self.text, self.source
+        text = old_text[:start] + new_text + old_text[end:]
+        if not self._blocks or not text or _RE_LONG_RANGE.search(old_text, max(start - 3, 0), end + 3) \
+                or _RE_LONG_RANGE.search(text, max(start - 3, 0), start + len(new_text) + 3):
+            return self.set_text(text)
+
+        blocks, shifts = self._blocks, self._shifts
+        first = self._count_before(start, in_text=True) - 1     # the block the edit starts in, or right after
+        first = max(first - 1, 0)      # one block of context: lines can join or split the previous block
+        while first and blocks[first].__name__ == 'blankline':
+            first -= 1
+        _, shift, text_shift = self._shift(first)
+        span_start, text_start = blocks[first].offset + shift, self._starts[first] + text_shift
+        # normalise from that block to the end of the edited line, and keep the rest of the source
+        line_end = old_text.find('\n', end) + 1 or len(old_text)
+        span_end = len(old) if line_end == len(old_text) else span_start + len(_prepare_span(old_text, text_start, line_end))
+        line_end += len(text) - len(old_text)
+        new = old[:span_start] + _prepare_span(text, text_start, line_end) + old[span_end:]
+        delta, text_delta = len(new) - len(old), len(text) - len(old_text)
+
+        p = parser(p=True)
+        p.reset(new)
+        pos, parsed, resync = span_start, [], None
+        kept = self._count_before(span_end)    # old blocks past the edited lines can be kept as they are
+        while pos < len(new):
+            while kept < len(blocks) and (offset := blocks[kept].offset + self._shift(kept)[1] + delta) < pos:
+                kept += 1
+            if kept < len(blocks) and offset == pos:
+                resync = kept
+                break
+            if (end := p.parseAt(pos, self.grammar.block, parsed, skipWS=False)) < 0:
+                break
+            pos = end
+        if not (first or parsed):
+            return self.set_text(text)
+
+        stop = len(blocks) if resync is None else resync
+        if resync is not None:
+            _, kept_delta, kept_text_delta = self._shift(resync)
+            to_text = _source_offsets(text[text_start:self._starts[resync] + kept_text_delta + text_delta])
+        else:
+            to_text = _source_offsets(text[text_start:])
+            self.rest = new[pos:]
+        moved = len(parsed) - (stop - first)
+        pending = [entry for entry in shifts if entry[0] < first] + [(first, 0, 0)]
+        if resync is not None:
+            pending.append((first + len(parsed), kept_delta + delta, kept_text_delta + text_delta))
+            pending += [(i + moved, d + delta, t + text_delta) for i, d, t in shifts if i > resync]
+        blocks[first:stop] = parsed
+        self._starts[first:stop] = [text_start + to_text(block.offset - span_start) for block in parsed]
+        # an entry is superseded by a later one for the same block, and one past the last block is unused
+        self._shifts = [entry for entry, after in zip(pending, pending[1:] + [(len(blocks), 0, 0)]) if entry[0] < after[0]]
+        self.text, self.source = text, new
+        self.reparsed = range(first, first + len(parsed))
+        if len(self._shifts) > self._max_shifts:
+            self._apply_shifts()
+
+    @property
+    def tree(self) -> list[Symbol]:
+        """The parse result, as `MarkdownGrammar.parse` returns it."""
+        if not (blocks := self.blocks):
+            return []
+        end = blocks[-1].end
+        return [Symbol('article', [Symbol('content', blocks, 0, end)], 0, end)]
+
+    def html(self, tag_class=None, visitor=None) -> str:
+        return self.html_debug(tag_class, visitor)[0]
+
+    def html_debug(self, tag_class=None, visitor=None) -> tuple[str, dict]:
+        """HTML and resources, like `parseHtmlDebug`."""
+        v = (visitor or MarkdownHtmlVisitor)(tag_class or {}, self.grammar)
+        v.block_cache = self.block_cache
+        if not self._blocks:
+            return "", v.resources.to_dict()
+        # rendering reads no offsets, so the blocks are rendered with their shifts still pending
+        return v.visit(Symbol('article', [Symbol('content', self._blocks)]), root=True), v.resources.to_dict()
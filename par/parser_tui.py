@@ -64,6 +64,7 @@ class ParserWrapper:
     def __init__(self, module: Any) -> None:
         self.module = module
         self._grammar_cache: type | None = None
+        self._document: Any | None = None
 
     def _is_symbol(self, obj: Any) -> bool:
         # Prefer explicit pyPEG types
@@ -143,8 +144,20 @@ class ParserWrapper:
             pass
         return None
 
+    def _parse_document(self, document_cls: type, text: str) -> tuple[Any, Any | None]:
+        """Incremental path: keep one document and apply each change of the input to it."""
+        if self._document is None:
+            self._document = document_cls(text)
+        else:
+            self._document.update(text)
+        tree = self._document.tree
+        return self._document.html_debug(), tree[0] if tree else None
+
     def parse(self, text: str, packrat: bool = False) -> tuple[Any, Any | None]:
         """Attempt known parse helpers, return (result, ast_or_None)."""
+        if (document_cls := getattr(self.module, "MarkdownDocument", None)) is not None:
+            return self._parse_document(document_cls, text)
+
         candidates = (
             ("parseHtmlDebug", False),
             ("parseHtml", True),
@@ -2,8 +2,11 @@
 # Based on YPL parser 1.5 by 'VB' -- Thanks!
 # Hacked on by serpn subsequently
 
-import sys, re
-from typing import Any
+import json, sys, re, threading, weakref
+from time import perf_counter
+from array import array
+import re._parser as sre_p, re._constants as sre_c
+from typing import Any, Literal
 from collections.abc import Callable, Generator
 
 print_trace = False # For debugging
@@ -28,6 +31,20 @@ class _and():
 
 class _not(_and): pass
 
+class nested():
+    """Parse `rule` within the text matched by `regex` (its first group, if it has groups)."""
+    def __init__(self, regex: re.Pattern[str], rule: ParsePattern):
+        self._regex = regex
+        self._rule = rule
+
+    @property
+    def regex(self) -> re.Pattern[str]:
+        return self._regex
+
+    @property
+    def rule(self) -> ParsePattern:
+        return self._rule
+
 # Type alias for parse patterns
 type ParsePattern = (
     re.Pattern[str]                    # compiled regex
@@ -36,28 +53,81 @@ type ParsePattern = (
     | ignore                           # ignore specific text via regex
     | _not                             # negative lookahead
     | _and                             # positive lookahead
+    | nested                           # pattern parsed within the text of a regex match
     | int                              # integer repetition count
     | list                             # alternatives (OR) - list of ParsePatterns
     | tuple                            # sequence - tuple of ParsePatterns and/or ints
     | Callable[[], 'ParsePattern']     # callable returning another pattern
 )
 
-class Symbol(list):
-    def __init__(self, name: str, what: Any, offset: int = -1):
+class Symbol:
+    """A parse tree node: a rule name, its children (or matched text) and its source offsets.
+
+    Text matched by a terminal rule is kept as a span of the parsed buffer and only sliced out when
+    `what`/`text` is read. Symbols still behave like the read-only list of their children (or of the
+    characters of their text) for code written against the older list-based Symbol."""
+    __slots__ = ('__name__', '_what', '_offset', '_end')
+
+    def __init__(self, name: str, what: Any, offset: int = -1, end: int | None = None):
+        """`Symbol(name, buffer, start, end)` refers to `buffer[start:end]` without copying it."""
         self.__name__ = name
-        self.what = what
+        self._what = what
         self._offset = offset
-        self.extend(what)
-    
+        self._end = end
+
+    @property
+    def what(self) -> Any:
+        what = self._what
+        if self._end is not None and what.__class__ is str:
+            return what[self._offset:self._end]
+        return what
+
     def __call__(self) -> Any:
         return self.what
-    
+
+    ## Read-only list behaviour, over `what`
+    def __iter__(self):
+        return iter(self.what)
+
+    def __len__(self) -> int:
+        if self._end is not None and self._what.__class__ is str:
+            return self._end - self._offset
+        return len(self._what)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __getitem__(self, index):
+        return self.what[index]
+
+    def __contains__(self, item) -> bool:
+        return item in self.what
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (Symbol, list)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None     # compared by contents, like the list it replaces
+
     def __str__(self) -> str:
         return self.text
     
     def __repr__(self) -> str:
-        return f"Symbol<{self.__name__}, {self.what[:16]}{'...' if len(self.what) > 40 else ''}>"
+        what = self.what
+        return f"Symbol<{self.__name__}, {what[:16]}{'...' if len(what) > 40 else ''}>"
     
+    def shifted(self, delta: int, text: str) -> 'Symbol':
+        """Copy of this subtree with offsets moved by `delta`, its spans referring to `text` instead
+        (the same source with an edit before this node)."""
+        what = self._what
+        if what.__class__ is str:
+            if self._end is None:
+                return Symbol(self.__name__, what, self._offset + delta if self._offset >= 0 else -1)
+            return Symbol(self.__name__, text, self._offset + delta, self._end + delta)
+        return Symbol(self.__name__, [node.shifted(delta, text) if isinstance(node, Symbol) else node for node in what],
+                      self._offset + delta if self._offset >= 0 else -1, None if self._end is None else self._end + delta)
+
     def utf8_tree_str(self, prefix: str = "", connector: str = "") -> str:
         val = f": {self.what[:60]!r}..." if isinstance(self.what, str) and len(self.what) > 60 \
                 else f": {self.what!r}" if isinstance(self.what, str) else ""
@@ -71,7 +141,9 @@ class Symbol(list):
     
     def find(self, name: str) -> 'Symbol | None':
         """Find the first node with the given name."""
-        for node in self.what:
+        if (what := self._what).__class__ is str:
+            return
+        for node in what:
             if not isinstance(node, str):
                 if node.__name__ == name:
                     return node
@@ -80,7 +152,9 @@ class Symbol(list):
     
     def find_all(self, name: str) -> Generator['Symbol', None, None]:
         """Find all nodes with matching name anywhere in the decendants."""
-        for node in self.what:
+        if (what := self._what).__class__ is str:
+            return
+        for node in what:
             if not isinstance(node, str):
                 if node.__name__ == name:
                     yield node
@@ -88,11 +162,14 @@ class Symbol(list):
     
     def find_all_here(self, name: str) -> Generator['Symbol', None, None]:
         """Find all nodes with matching name in the immediate child nodes."""
-        yield from (x for x in self.what if not isinstance(x, str) and x.__name__ == name)
+        if (what := self._what).__class__ is not str:
+            yield from (x for x in what if not isinstance(x, str) and x.__name__ == name)
 
     def find_all_names(self, names: frozenset[str]) -> Generator['Symbol', None, None]:
         """Single-pass traversal yielding all descendants whose name is in `names`."""
-        for node in self.what:
+        if (what := self._what).__class__ is str:
+            return
+        for node in what:
             if not isinstance(node, str):
                 if node.__name__ in names:
                     yield node
@@ -100,40 +177,990 @@ class Symbol(list):
     
     @property
     def text(self) -> str:
-        return ''.join(node if isinstance(node, str) else node.text for node in self.what)
+        what = self._what
+        if what.__class__ is str:
+            return what if self._end is None else what[self._offset:self._end]
+        return ''.join(node if isinstance(node, str) else node.text for node in what)
 
     @property
     def offset(self) -> int:
         """Character offset in source text, or -1 if unknown."""
         return self._offset
 
-def skip(skipper, text: str, skipWS: bool, skipComments: Callable | None) -> str:
-    t = text.lstrip() if skipWS else text
-    while skipComments:
+    @property
+    def end(self) -> int:
+        """Offset just past the matched source text, or -1 if unknown."""
+        if self._end is not None:
+            return self._end
+        return self._offset + len(self._what) if self._offset >= 0 and isinstance(self._what, str) else -1
+
+## Flat trees
+#  Named nodes only, in document (pre-)order, as parallel int columns. Text is read from the buffer.
+
+class FlatTree:
+    """A parse tree stored as `array('i')` columns, for consumers that need kinds, spans and links.
+
+    Node `i` has rule id `kind[i]` (see `names`), spans `text[start[i]:end[i]]` and is linked by
+    `parent`, `first_child` and `next_sibling` (-1 for none). Use `FlatNode` views to navigate."""
+    __slots__ = ('text', 'names', 'ids', 'kind', 'start', 'end', 'parent', 'first_child', 'next_sibling')
+
+    def __init__(self, text: str):
+        self.text = text
+        self.names: list[str] = []
+        self.ids: dict[str, int] = {}
+        self.kind, self.start, self.end = array('i'), array('i'), array('i')
+        self.parent, self.first_child, self.next_sibling = array('i'), array('i'), array('i')
+
+    @classmethod
+    def from_symbols(cls, nodes: list, text: str) -> 'FlatTree':
+        """Flatten a parse result (a list of `Symbol`s and strings) parsed from `text`."""
+        tree = cls(text)
+        ids, names = tree.ids, tree.names
+        kind, start, end = tree.kind, tree.start, tree.end
+        parent, first_child, next_sibling = tree.parent, tree.first_child, tree.next_sibling
+        stack = [[-1, iter(nodes), -1]]     # [node, children iterator, last child added]
+        while stack:
+            frame = stack[-1]
+            for sym in frame[1]:
+                if not isinstance(sym, Symbol):
+                    continue
+                i = len(kind)
+                if (rule := ids.get(sym.__name__)) is None:
+                    rule = ids[sym.__name__] = len(names)
+                    names.append(sym.__name__)
+                kind.append(rule); start.append(sym._offset); end.append(sym.end)
+                parent.append(frame[0]); first_child.append(-1); next_sibling.append(-1)
+                if frame[2] >= 0:
+                    next_sibling[frame[2]] = i
+                elif frame[0] >= 0:
+                    first_child[frame[0]] = i
+                frame[2] = i
+                if sym._what.__class__ is not str:
+                    stack.append([i, iter(sym._what), -1])
+                    break
+            else:
+                stack.pop()
+                if (i := frame[0]) >= 0 and end[i] < 0:    # built without an end offset
+                    end[i] = max(start[i], end[frame[2]]) if frame[2] >= 0 else start[i]
+        return tree
+
+    def __len__(self) -> int:
+        return len(self.kind)
+
+    def __iter__(self):
+        """The top-level nodes."""
+        i = 0 if len(self.kind) else -1
+        while i >= 0:
+            yield FlatNode(self, i)
+            i = self.next_sibling[i]
+
+    def __getitem__(self, index: int) -> 'FlatNode':
+        return FlatNode(self, range(len(self.kind))[index])
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the columns."""
+        return sum(col.itemsize * len(col) for col in (self.kind, self.start, self.end, self.parent,
+                                                         self.first_child, self.next_sibling))
+
+    def subtree_end(self, i: int) -> int:
+        """Index just past the last descendant of node `i` (nodes are stored in pre-order)."""
+        while i >= 0 and self.next_sibling[i] < 0:
+            i = self.parent[i]
+        return self.next_sibling[i] if i >= 0 else len(self.kind)
+
+    def indexes(self, name: str, lo: int = 0, hi: int | None = None) -> Generator[int, None, None]:
+        """Indexes of nodes named `name` in [lo, hi), by a scan of the kind column."""
+        if (rule := self.ids.get(name)) is None:
+            return
+        kind, hi = self.kind, len(self.kind) if hi is None else hi
         try:
-            skip, t = skipper.parseLine(t, skipComments, [], skipWS, None)
-        except SyntaxError:
-            break
-    return t
+            while True:
+                lo = kind.index(rule, lo, hi)
+                yield lo
+                lo += 1
+        except ValueError:
+            return
+
+    def find_all(self, name: str) -> Generator['FlatNode', None, None]:
+        return (FlatNode(self, i) for i in self.indexes(name))
+
+    def find(self, name: str) -> 'FlatNode | None':
+        return next(self.find_all(name), None)
+
+class FlatNode:
+    """`Symbol`-like view of one node of a `FlatTree`."""
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree: FlatTree, index: int):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def __name__(self) -> str:
+        return self.tree.names[self.tree.kind[self.index]]
+
+    @property
+    def offset(self) -> int:
+        return self.tree.start[self.index]
+
+    @property
+    def end(self) -> int:
+        return self.tree.end[self.index]
+
+    @property
+    def text(self) -> str:
+        """The source text spanned by this node (including any skipped text within it)."""
+        return self.tree.text[self.tree.start[self.index]:self.tree.end[self.index]]
+
+    @property
+    def what(self) -> 'str | list[FlatNode]':
+        return list(self) if self.tree.first_child[self.index] >= 0 else self.text
+
+    @property
+    def parent(self) -> 'FlatNode | None':
+        return FlatNode(self.tree, p) if (p := self.tree.parent[self.index]) >= 0 else None
+
+    def __iter__(self):
+        tree, i = self.tree, self.tree.first_child[self.index]
+        while i >= 0:
+            yield FlatNode(tree, i)
+            i = tree.next_sibling[i]
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __getitem__(self, index: int) -> 'FlatNode':
+        return list(self)[index]
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, FlatNode) and other.tree is self.tree and other.index == self.index
+
+    def __hash__(self) -> int:
+        return hash((id(self.tree), self.index))
+
+    def __str__(self) -> str:
+        return self.text
+
+    def __repr__(self) -> str:
+        return f"FlatNode<{self.__name__}, {self.offset}:{self.end}>"
+
+    def find_all(self, name: str) -> Generator['FlatNode', None, None]:
+        """All descendants named `name`, by a scan of this node's range of the kind column."""
+        tree = self.tree
+        return (FlatNode(tree, i) for i in tree.indexes(name, self.index + 1, tree.subtree_end(self.index)))
+
+    def find(self, name: str) -> 'FlatNode | None':
+        return next(self.find_all(name), None)
+
+    def find_all_here(self, name: str) -> Generator['FlatNode', None, None]:
+        yield from (child for child in self if child.__name__ == name)
+
+    def find_all_names(self, names: frozenset[str]) -> Generator['FlatNode', None, None]:
+        tree = self.tree
+        rules = {tree.ids[n] for n in names if n in tree.ids}
+        kind = tree.kind
+        for i in range(self.index + 1, tree.subtree_end(self.index)):
+            if kind[i] in rules:
+                yield FlatNode(tree, i)
+
+def skip(skipper, text: str, skipWS: bool, skipComments: Callable | None) -> str:
+    """String-in, string-out wrapper around `parser.skip` kept for older callers."""
+    skipper.reset(text)
+    skipper.configure(skipWS, skipComments)
+    return text[skipper.skip(0):]
 
 word_regex = re.compile(r"\w+")
+ws_regex = re.compile(r"\s*")
+
+FAIL = -1  # Node.parse result for "no match"; backtracking compares against it instead of raising
+
+# Assertions at the very start of a terminal which look at text *before* the match position.
+# The engine matches against one buffer at an offset, so these are rewritten to keep the
+# original "the remaining text starts here" meaning (i.e. nothing precedes the match).
+_leading_assert = re.compile(r'\^|\\A|\\b|\\B|\(\?<([!=])(?:[^()\\\[]|\\.|\[(?:[^\]\\]|\\.)*\])*\)')
+_lookbehind_ats = frozenset({
+    sre_c.AT_BEGINNING, sre_c.AT_BEGINNING_LINE, sre_c.AT_BEGINNING_STRING,
+    sre_c.AT_BOUNDARY, sre_c.AT_NON_BOUNDARY, sre_c.AT_LOC_BOUNDARY,
+    sre_c.AT_LOC_NON_BOUNDARY, sre_c.AT_UNI_BOUNDARY, sre_c.AT_UNI_NON_BOUNDARY})
+
+def _looks_behind(items, state, consumed: int = 0) -> bool:
+    """True if a parsed regex may inspect characters before its match start."""
+    for op, av in items:
+        if op is sre_c.AT:
+            if consumed == 0 and av in _lookbehind_ats:
+                return True
+        elif op in (sre_c.ASSERT, sre_c.ASSERT_NOT):
+            direction, sub = av
+            if (direction < 0 and consumed < sub.getwidth()[1]) or _looks_behind(sub, state, consumed):
+                return True
+        elif op is sre_c.SUBPATTERN:
+            if _looks_behind(av[-1], state, consumed):
+                return True
+        elif op is sre_c.BRANCH:
+            if any(_looks_behind(alt, state, consumed) for alt in av[1]):
+                return True
+        elif op in (sre_c.MAX_REPEAT, sre_c.MIN_REPEAT, sre_c.POSSESSIVE_REPEAT, sre_c.ATOMIC_GROUP):
+            if _looks_behind(av[-1] if op is not sre_c.ATOMIC_GROUP else av, state, consumed):
+                return True
+        elif op is sre_c.GROUPREF_EXISTS:
+            if any(sub is not None and _looks_behind(sub, state, consumed) for sub in av[1:]):
+                return True
+        consumed += sre_p.SubPattern(state, [(op, av)]).getwidth()[0]
+    return False
+
+_anchored_cache: dict[re.Pattern[str], re.Pattern[str] | None] = {}
+
+def anchored(regex: re.Pattern[str]) -> re.Pattern[str] | None:
+    """Return a pattern whose `.match(buf, pos)` behaves like `regex.match(buf[pos:])`.
+
+    Leading `^`, `\\b` and lookbehind assertions are rewritten for the "start of text"
+    case; returns None if the pattern still depends on text before `pos`."""
+    if regex in _anchored_cache:
+        return _anchored_cache[regex]
+    src, i, head = regex.pattern, 0, []
+    while m := _leading_assert.match(src, i):
+        match m.group(0), m.group(1):
+            case '^' | '\\A', _: pass           # always true at the start of text
+            case _, '!':         pass           # nothing precedes the start of text
+            case '\\b', _:       head.append(r'(?=\w)')
+            case '\\B', _:       head.append(r'(?!\w)')
+            case _:              head.append(r'(?!)')  # positive lookbehind can never hold
+        i = m.end()
+    result = re.compile(''.join(head) + src[i:], regex.flags) if i else regex
+    parsed = sre_p.parse(result.pattern, result.flags)
+    _anchored_cache[regex] = result = None if _looks_behind(parsed, parsed.state) else result
+    return result
+
+## FIRST sets
+#  (chars, nullable): the characters a match can start with — None if that can't be narrowed
+#  down — and whether it can match the empty string. Used to dispatch ordered choices.
+
+First = tuple[frozenset[str] | None, bool]
+_ANY: First = (None, True)
+_EMPTY: First = (frozenset(), True)
+
+def _first_of_seq(firsts) -> First:
+    """FIRST of a sequence, given the FIRST of each of its items (lazily, in order)."""
+    chars = set()
+    for c, nullable in firsts:
+        if c is None:
+            return _ANY
+        chars |= c
+        if not nullable:
+            return frozenset(chars), False
+    return frozenset(chars), True
+
+def _first_of_choice(firsts) -> First:
+    chars, nullable = set(), False
+    for c, n in firsts:
+        if c is None:
+            return _ANY
+        chars |= c
+        nullable = nullable or n
+    return frozenset(chars), nullable
+
+def _regex_set_first(items) -> frozenset[str] | None:
+    chars = set()
+    for op, av in items:
+        if op is sre_c.LITERAL:
+            chars.add(chr(av))
+        elif op is sre_c.RANGE and av[1] - av[0] < 256:
+            chars.update(map(chr, range(av[0], av[1] + 1)))
+        else:       # negated sets, categories like \w, huge ranges
+            return None
+    return frozenset(chars)
+
+def _regex_item_first(op, av) -> First:
+    match op:
+        case sre_c.LITERAL:
+            return frozenset(chr(av)), False
+        case sre_c.IN:
+            return _regex_set_first(av), False
+        case sre_c.SUBPATTERN:
+            return _ANY if av[1] & sre_c.SRE_FLAG_IGNORECASE else _regex_first_of(av[-1])
+        case sre_c.ATOMIC_GROUP:
+            return _regex_first_of(av)
+        case sre_c.BRANCH:
+            return _first_of_choice(_regex_first_of(alt) for alt in av[1])
+        case sre_c.MAX_REPEAT | sre_c.MIN_REPEAT | sre_c.POSSESSIVE_REPEAT:
+            chars, nullable = _regex_first_of(av[-1])
+            return chars, nullable or av[0] == 0
+        case sre_c.AT | sre_c.ASSERT | sre_c.ASSERT_NOT:
+            return _EMPTY   # assertions consume nothing
+        case _:
+            return _ANY
+
+def _regex_first_of(items) -> First:
+    return _first_of_seq(_regex_item_first(op, av) for op, av in items)
+
+def regex_first(regex: re.Pattern[str]) -> First:
+    """FIRST set of a compiled regex (case-insensitive patterns are not narrowed down)."""
+    if regex.flags & re.IGNORECASE:
+        return _ANY
+    return _regex_first_of(sre_p.parse(regex.pattern, regex.flags))
+
+
+## Compiled grammar
+#  Rule functions are called once, at compile time, and resolved into a graph of nodes. Each node
+#  matches at an offset in `parser.text`, appends its results to `out` and returns the new offset or FAIL.
+
+class Node:
+    __slots__ = ()
+
+    def parse(self, p: 'parser', pos: int, out: list) -> int:
+        """Match at `pos`, consulting the packrat memo when it is enabled."""
+        if not p.packrat:
+            return self.match(p, pos, out)
+        key = (pos, self)
+        if (cached := p.memory.lookup(key)) is not None:
+            if cached is False:
+                return FAIL
+            out.extend(cached[0])
+            return cached[1]
+        n = len(out)
+        end = self.match(p, pos, out)
+        p.memory.store(key, False if end < 0 else (out[n:], end))
+        return end
+
+    def match(self, p: 'parser', pos: int, out: list) -> int:
+        raise NotImplementedError
+
+    def describe(self) -> str:
+        return type(self).__name__
+
+    def first(self, active: set) -> First:
+        """FIRST set of this node; `active` holds the rules being expanded, to stop at recursion."""
+        return _ANY
+
+class Terminal(Node):
+    """Regex terminal; `keep` is False for `ignore` patterns, whose text is dropped."""
+    __slots__ = ('regex', 'keep', '_match')
+
+    def __init__(self, regex: re.Pattern[str], keep: bool = True):
+        self.regex = regex
+        self.keep = keep
+        self._match = safe.match if (safe := anchored(regex)) is not None else None
+
+    def match(self, p, pos, out):
+        if p.skipping:
+            pos = p.skip(pos)
+        if (end := self.scan(p, pos)) < 0:
+            return FAIL
+        if self.keep and end > pos:
+            out.append(p.text[pos:end])
+        return p.skip(end) if p.skipping else end
+
+    def scan(self, p: 'parser', pos: int) -> int:
+        """End of the regex match at `pos` (nothing skipped, nothing kept), or FAIL."""
+        if self._match is not None:
+            if m := self._match(p.text, pos, p.textlen):
+                return m.end()
+        elif m := self.regex.match(p.text[pos:p.textlen]):
+            return pos + m.end()
+        return p.expect(pos, self)
+
+    def describe(self):
+        return f"/{self.regex.pattern}/"
+
+    def first(self, active):
+        return regex_first(self.regex)
+
+class Exact(Node):
+    """A literal string."""
+    __slots__ = ('literal',)
+
+    def __init__(self, literal: str):
+        self.literal = literal
+
+    def match(self, p, pos, out):
+        if p.skipping:
+            pos = p.skip(pos)
+        if not p.text.startswith(self.literal, pos, p.textlen):
+            return p.expect(pos, self)
+        end = pos + len(self.literal)
+        return p.skip(end) if p.skipping else end
+
+    def describe(self):
+        return repr(self.literal)
+
+    def first(self, active):
+        return (frozenset(self.literal[0]), False) if self.literal else _EMPTY
+
+class Keyword(Exact):
+    __slots__ = ()
+
+    def match(self, p, pos, out):
+        if p.skipping:
+            pos = p.skip(pos)
+        if not (m := word_regex.match(p.text, pos, p.textlen)) or m.group(0) != self.literal:
+            return p.expect(pos, self)
+        return p.skip(m.end()) if p.skipping else m.end()
+
+    def describe(self):
+        return f"keyword {self.literal!r}"
+
+class Lookahead(Node):
+    """`_and` / `_not`: match without consuming or producing anything."""
+    __slots__ = ('node', 'negate')
+
+    def __init__(self, node: Node, negate: bool):
+        self.node = node
+        self.negate = negate
+
+    def match(self, p, pos, out):
+        found = self.node.parse(p, p.skip(pos) if p.skipping else pos, []) >= 0
+        return FAIL if found == self.negate else pos
+
+    def first(self, active):
+        return _EMPTY if self.negate else self.node.first(active)
+
+class Nested(Node):
+    """`nested`: `node` parses the text matched by `span` (its first group, if it has groups) in place.
+
+    The inner parse keeps the offsets of the buffer but sees the end of the span as the end of the text,
+    with a memo of its own. If it fails or stops short of that end, the matched text is kept as is."""
+    __slots__ = ('span', 'node')
+
+    def __init__(self, span: Terminal, node: Node):
+        self.span = span
+        self.node = node
+
+    def match(self, p, pos, out):
+        if p.skipping:
+            pos = p.skip(pos)
+        span, base = self.span, 0
+        if span._match is not None:
+            m = span._match(p.text, pos, p.textlen)
+        else:
+            m, base = span.regex.match(p.text[pos:p.textlen]), pos
+        if m is None:
+            return p.expect(pos, span)
+        end = base + m.end()
+        start, stop = m.span(1) if m.re.groups else m.span()
+        inner = []
+        if start >= 0 and p.within(self.node, base + start, base + stop, inner) == base + stop:
+            if base + start > pos:
+                out.append(p.text[pos:base + start])
+            out.extend(inner)
+            if end > base + stop:
+                out.append(p.text[base + stop:end])
+        elif end > pos:
+            out.append(p.text[pos:end])
+        return p.skip(end) if p.skipping else end
+
+    def describe(self):
+        return self.span.describe()
+
+    def first(self, active):
+        return self.span.first(active)
+
+class Seq(Node):
+    """Tuple: items are (count, node); count 1 = once, n > 1 = n times, 0 = ?, -1 = *, -2 = +."""
+    __slots__ = ('items',)
+
+    def __init__(self, items: tuple[tuple[int, Node], ...]):
+        self.items = items
+
+    def match(self, p, pos, out):
+        if p.skipping:
+            pos = p.skip(pos)
+        n = len(out)
+        for count, node in self.items:
+            if count == 1:
+                if (pos := node.parse(p, pos, out)) < 0:
+                    del out[n:]
+                    return FAIL
+            elif count > 1:
+                for _ in range(count):
+                    if (pos := node.parse(p, pos, out)) < 0:
+                        del out[n:]
+                        return FAIL
+            elif count == 0:
+                if pos < p.textlen and (end := node.parse(p, pos, out)) >= 0:
+                    pos = end
+            else:
+                found = False
+                while (end := node.parse(p, pos, out)) >= 0:
+                    pos, found = end, True
+                if count == -2 and not found:
+                    del out[n:]
+                    return FAIL
+        return pos
+
+    def first(self, active):
+        return _first_of_seq((c, n or count in (0, -1))
+                             for count, node in self.items for c, n in (node.first(active),))
+
+class Choice(Node):
+    """List: ordered choice, the first alternative that matches wins.
+
+    Alternatives are dispatched on the next character: only those whose FIRST set contains it
+    (or which can match empty) are tried."""
+    __slots__ = ('alts', 'table', 'other')
+
+    def __init__(self, alts: tuple[Node, ...]):
+        self.alts = alts
+        self.table: dict[str, tuple[Node, ...]] | None = None   # built on first use, once rules are complete
+        self.other: tuple[Node, ...] = alts
+
+    def dispatch(self) -> dict[str, tuple[Node, ...]]:
+        firsts = [alt.first(set()) for alt in self.alts]
+        always = [c is None or nullable for c, nullable in firsts]
+        keys = set().union(*(c for c, _ in firsts if c is not None))
+        self.other = tuple(alt for alt, a in zip(self.alts, always) if a)
+        self.table = {k: tuple(alt for alt, (c, _), a in zip(self.alts, firsts, always) if a or k in c)
+                      for k in keys}
+        return self.table
+
+    def match(self, p, pos, out):
+        if p.skipping:
+            pos = p.skip(pos)
+        alts = (self.table if self.table is not None else self.dispatch()).get(p.text[pos:pos + 1], self.other)
+        for alt in alts:
+            if (end := alt.parse(p, pos, out)) >= 0:
+                return end
+        if p.tracing and pos >= p.failpos and len(alts) < len(self.alts):
+            for alt in self.alts:   # at the farthest failure, let skipped alternatives report what they expected
+                if alt not in alts:
+                    alt.parse(p, pos, [])
+        return FAIL
+
+    def first(self, active):
+        return _first_of_choice(alt.first(active) for alt in self.alts)
+
+class Rule(Node):
+    """A grammar function. Named rules wrap their results in a Symbol; `_`-prefixed ones don't."""
+    __slots__ = ('name', 'label', 'body', 'symbol', 'textual', '_first')
+
+    def __init__(self, name: str | None, label: str | None = None):
+        self.name = name
+        self.label = label or name  # the function name, also for anonymous rules
+        self.body: Node = None      # set once by compile_pattern (rules may be recursive)
+        self.symbol = False         # whether a Symbol is produced
+        self.textual = False        # body is a kept regex: the Symbol holds the matched text
+        self._first: First | None = None
+
+    def match(self, p, pos, out):
+        if p.skipping:
+            pos = p.skip(pos)
+        if __debug__ and print_trace and self.name != "comment":
+            sys.stderr.write(f"testing with {self.name}: {p.text[pos:pos + 40]}\n")
+        if not self.symbol:
+            return self.body.parse(p, pos, out)
+        if self.textual:    # the Symbol refers to the matched span of the buffer
+            if (end := self.body.scan(p, pos)) < 0:
+                return FAIL
+            out.append(Symbol(self.name, p.text, pos, end) if end > pos else Symbol(self.name, [], pos))
+            if __debug__ and print_trace and self.name != "comment":
+                sys.stderr.write(f"match: {self.name}\n")
+            return p.skip(end) if p.skipping else end
+        result = []
+        if (end := self.body.parse(p, pos, result)) < 0:
+            return FAIL
+        if __debug__ and print_trace and self.name != "comment":
+            sys.stderr.write(f"match: {self.name}\n")
+        out.append(Symbol(self.name, result, pos, end))
+        return end
+
+    def describe(self):
+        return self.name or "rule"
+
+    def first(self, active):
+        if self._first is None:
+            if self in active:      # left recursion: nothing to narrow down
+                return _ANY
+            active.add(self)
+            self._first = self.body.first(active)
+            active.discard(self)
+        return self._first
+
+class Fused(Node):
+    """Adjacent terminal alternatives of a choice merged into one regex alternation.
+
+    Each alternative becomes a named group; the group that matched says which alternative won and so
+    which Symbol (if any) to produce."""
+    __slots__ = ('alts', 'regex', '_match', 'actions', 'terminals', 'firsts')
+
+    def __init__(self, alts: tuple[Node, ...]):
+        self.alts = alts
+        self.terminals = tuple(alt.body if isinstance(alt, Rule) else alt for alt in alts)
+        self.regex = re.compile('|'.join(f'(?P<_{i}>{_fusable_source(t)})' for i, t in enumerate(self.terminals)),
+                                _fusable_flags(self.terminals[0]))
+        self._match = self.regex.match
+        self.actions = {}           # group number -> (alternative index, Symbol name or None, keep text)
+        for i, (alt, t) in enumerate(zip(alts, self.terminals)):
+            keep = not isinstance(t, Exact) and t.keep
+            self.actions[self.regex.groupindex[f'_{i}']] = (i, alt.name if isinstance(alt, Rule) else None, keep)
+        self.firsts = tuple(None if c is None or nullable else c for c, nullable in (t.first(set()) for t in self.terminals))
+
+    def match(self, p, pos, out):
+        if p.skipping:
+            pos = p.skip(pos)
+        if (m := self._match(p.text, pos, p.textlen)) is None:
+            if pos >= p.failpos:
+                for t in self.terminals:
+                    p.expect(pos, t)
+            return FAIL
+        i, name, keep = self.actions[m.lastindex]
+        if i and p.tracing and pos >= p.failpos:    # alternatives tried before the winner record their failures
+            c = p.text[pos:pos + 1]
+            for t, chars in zip(self.terminals[:i], self.firsts):
+                if chars is None or c in chars:
+                    p.expect(pos, t)
+        end = m.end()
+        after = p.skip(end) if p.skipping else end
+        if name is not None:    # as `Rule.match` would build it
+            out.append((Symbol(name, p.text, pos, end) if end > pos else Symbol(name, [], pos)) if keep
+                       else Symbol(name, [], pos, after))
+        elif keep and end > pos:
+            out.append(p.text[pos:end])
+        return after
+
+    def first(self, active):
+        return _first_of_choice(t.first(active) for t in self.terminals)
+
+    def describe(self):
+        return ' | '.join(t.describe() for t in self.terminals)
+
+def _refers_to_groups(items) -> bool:
+    """True if a parsed regex uses backreferences, which would break once its groups are renumbered."""
+    for op, av in items:
+        if op in (sre_c.GROUPREF, sre_c.GROUPREF_EXISTS, sre_c.GROUPREF_IGNORE):
+            return True
+        subs = (av[-1],) if op in (sre_c.SUBPATTERN, sre_c.MAX_REPEAT, sre_c.MIN_REPEAT, sre_c.POSSESSIVE_REPEAT) \
+            else (av[1],) if op in (sre_c.ASSERT, sre_c.ASSERT_NOT) \
+            else av[1] if op is sre_c.BRANCH \
+            else (av,) if op is sre_c.ATOMIC_GROUP else ()
+        if any(_refers_to_groups(sub) for sub in subs):
+            return True
+    return False
+
+def _fusable_source(node: Node) -> str:
+    return re.escape(node.literal) if isinstance(node, Exact) else anchored(node.regex).pattern
+
+def _fusable_flags(node: Node) -> int | None:
+    """Regex flags a terminal can be fused under, or None if it can't be fused."""
+    if isinstance(node, Rule):
+        return _fusable_flags(node.body) if node.body is not None and not isinstance(node.body, Rule) else None
+    if type(node) is Exact:
+        return re.UNICODE
+    if not isinstance(node, Terminal) or node.regex.groupindex or (safe := anchored(node.regex)) is None:
+        return None
+    if safe.pattern.startswith('(?') and re.match(r'\(\?[aiLmsux]+\)', safe.pattern):
+        return None     # global inline flags must stay at the start of the pattern
+    return None if _refers_to_groups(sre_p.parse(safe.pattern, safe.flags)) else safe.flags
+
+def fuse_alternatives(choice: Choice) -> Choice:
+    """Merge each run of two or more adjacent terminal alternatives of `choice` into a `Fused` node."""
+    alts, run, flags = [], [], None
+    for alt in choice.alts + (None,):
+        f = _fusable_flags(alt) if alt is not None else None
+        if run and (f is None or f != flags):
+            alts.extend((Fused(tuple(run)),) if len(run) > 1 else run)
+            run = []
+        if f is not None:
+            run.append(alt)
+            flags = f
+        elif alt is not None:
+            alts.append(alt)
+    choice.alts = choice.other = tuple(alts)
+    return choice
+
+_compiled: weakref.WeakKeyDictionary[Callable, Rule] = weakref.WeakKeyDictionary()
+_compile_lock = threading.RLock()
+_compiling: list[Choice] = []  # choices created by the compile in progress, fused once every rule is complete
+
+def compile_pattern(pattern: ParsePattern | Node) -> Node:
+    """Resolve a pyPEG pattern, calling each rule function once, into a `Node` graph.
+    Rule functions are compiled once per function object and shared by every pattern using them.
+    Once the outermost call completes, terminal alternatives are fused (see `fuse_alternatives`)."""
+    with _compile_lock:
+        outermost = not _compiling
+        _compiling.append(None)
+        try:
+            node = _compile(pattern)
+        finally:
+            pending = _compiling[:] if outermost else ()
+            if outermost:
+                _compiling.clear()
+        for choice in pending:
+            if choice is not None:
+                fuse_alternatives(choice)
+        return node
+
+def _compile(pattern: ParsePattern | Node) -> Node:
+    match pattern:
+        case Node():      return pattern
+        case keyword():   return Keyword(pattern)   # keyword before str — keyword IS-A str
+        case str():       return Exact(pattern)
+        case _not():      return Lookahead(_compile(pattern.obj), True)
+        case _and():      return Lookahead(_compile(pattern.obj), False)
+        case ignore():    return Terminal(pattern.regex, keep=False)
+        case nested():    return Nested(Terminal(pattern.regex), _compile(pattern.rule))
+        case re.Pattern(): return Terminal(pattern)
+        case list():
+            _compiling.append(choice := Choice(tuple(_compile(p) for p in pattern)))
+            return choice
+        case tuple():
+            items, n = [], 1
+            for p in pattern:
+                if isinstance(p, int):
+                    n = p
+                else:
+                    items.append((n, _compile(p)))
+                    n = 1
+            return Seq(tuple(items))
+        case _ if callable(pattern):
+            if (rule := _compiled.get(pattern)) is not None:
+                return rule
+            label = sys.intern(pattern.__name__)
+            rule = _compiled[pattern] = Rule(label if label[0] != "_" else None, label)
+            try:
+                body = pattern()
+                rule.body = _compile((body,) if callable(body) else body)
+            except BaseException:
+                del _compiled[pattern]      # don't leave a rule without a body behind
+                raise
+            rule.symbol = rule.name is not None and not isinstance(rule.body, Lookahead)
+            rule.textual = isinstance(rule.body, Terminal) and rule.body.keep
+            return rule
+        case _:
+            raise SyntaxError(f"illegal type in grammar: {type(pattern)}")
+
+def compile_grammar(rules: dict[str, Callable]) -> dict[str, Node]:
+    """Compile every rule function of a grammar dict, returning name -> compiled node."""
+    return {name: compile_pattern(fn) for name, fn in rules.items()}
+
+## Profiling
+#  A Profiler parses with an instrumented copy of the rule graph, so the normal graph stays untouched
+#  and costs nothing extra when no profiler is given.
+
+class RuleStats:
+    __slots__ = ('attempts', 'successes', 'failures', 'memo_hits', 'total', 'self_time', 'consumed', 'active')
+
+    def __init__(self):
+        self.attempts = self.successes = self.failures = self.memo_hits = self.consumed = self.active = 0
+        self.total = self.self_time = 0.0
+
+    def as_dict(self) -> dict[str, int | float]:
+        return {k: getattr(self, k) for k in self.__slots__ if k != 'active'}
+
+class ProfiledRule(Rule):
+    __slots__ = ('stats', 'profiler')
+
+    def parse(self, p, pos, out):
+        stats, profiler = self.stats, self.profiler
+        stats.attempts += 1
+        if p.packrat and (pos, self) in p.memory:
+            stats.memo_hits += 1
+        stats.active += 1
+        children = profiler._children
+        children.append(0.0)
+        start = perf_counter()
+        end = Rule.parse(self, p, pos, out)
+        elapsed = perf_counter() - start
+        stats.active -= 1
+        stats.self_time += elapsed - children.pop()
+        if not stats.active:            # count recursive calls once, in the outermost one
+            stats.total += elapsed
+        if children:
+            children[-1] += elapsed
+        if end < 0:
+            stats.failures += 1
+        else:
+            stats.successes += 1
+            stats.consumed += end - pos
+        return end
+
+class Profiler:
+    """Per-rule counters and timings for the parses it is passed to:
+
+        prof = Profiler()
+        parseLine(text, grammar.root, profiler=prof)
+        print(prof.table(limit=20))"""
+    columns = ('attempts', 'successes', 'failures', 'memo_hits', 'total', 'self_time', 'consumed')
+
+    def __init__(self):
+        self.stats: dict[str, RuleStats] = {}
+        self._copies: dict[Node, Node] = {}
+        self._children: list[float] = []    # time spent in nested rules, per active rule
+
+    def instrument(self, node: Node) -> Node:
+        """The profiled copy of a compiled node: rules are replaced by `ProfiledRule`s."""
+        if (copy := self._copies.get(node)) is not None:
+            return copy
+        match node:
+            case Rule():
+                copy = self._copies[node] = ProfiledRule(node.name, node.label)
+                copy.symbol, copy.textual, copy._first = node.symbol, node.textual, node._first
+                copy.stats = self.stats.setdefault(node.label or 'rule', RuleStats())
+                copy.profiler = self
+                copy.body = self.instrument(node.body)
+            case Seq():
+                copy = self._copies[node] = Seq(())
+                copy.items = tuple((count, self.instrument(item)) for count, item in node.items)
+            case Choice():
+                copy = self._copies[node] = Choice(())
+                copy.alts = copy.other = tuple(self.instrument(alt) for alt in node.alts)
+            case Lookahead():
+                copy = self._copies[node] = Lookahead(None, node.negate)
+                copy.node = self.instrument(node.node)
+            case Nested():
+                copy = self._copies[node] = Nested(node.span, None)
+                copy.node = self.instrument(node.node)
+            case _:     # terminals (and fused ones) call no rules
+                return node
+        return copy
+
+    def rows(self, sort: str = 'self_time') -> list[tuple[str, RuleStats]]:
+        return sorted(self.stats.items(), key=lambda item: getattr(item[1], sort), reverse=True)
+
+    def table(self, sort: str = 'self_time', limit: int | None = None) -> str:
+        """The stats as a text table, sorted by one of `columns` (largest first)."""
+        lines = [f"{'rule':<28}{'attempts':>10}{'ok':>9}{'fail':>9}{'memo':>9}{'total ms':>11}{'self ms':>10}{'chars':>10}"]
+        for name, s in self.rows(sort)[:limit]:
+            lines.append(f"{name[:27]:<28}{s.attempts:>10}{s.successes:>9}{s.failures:>9}{s.memo_hits:>9}"
+                         f"{s.total * 1000:>11.2f}{s.self_time * 1000:>10.2f}{s.consumed:>10}")
+        return '\n'.join(lines)
+
+    def as_dict(self, sort: str = 'self_time') -> dict[str, dict[str, int | float]]:
+        return {name: s.as_dict() for name, s in self.rows(sort)}
+
+    def to_json(self, sort: str = 'self_time', **kwargs) -> str:
+        return json.dumps(self.as_dict(sort), **kwargs)
+
+    def reset(self) -> None:
+        for s in self.stats.values():
+            s.__init__()
+
+class Memo(dict):
+    """Packrat memo: (offset, rule) -> (results, end offset), or False for a failed match.
+
+* maxsize : number of entries kept before evicting (default: None, unbounded)
+* policy  : 'fifo' evicts the oldest entry, i.e. the lowest offsets the parse has moved past;
+            'lru' evicts the least recently used one"""
+    def __init__(self, maxsize: int | None = None, policy: Literal['fifo', 'lru'] = 'fifo'):
+        if policy not in ('fifo', 'lru'):
+            raise ValueError(f"unknown eviction policy: {policy!r}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.hits = self.misses = self.evictions = 0
+
+    def lookup(self, key):
+        if (value := self.get(key)) is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            if self.policy == 'lru':
+                self[key] = self.pop(key)
+        return value
+
+    def store(self, key, value) -> None:
+        self[key] = value
+        if self.maxsize is not None and len(self) > self.maxsize:
+            del self[next(iter(self))]
+            self.evictions += 1
+
+    def spawn(self) -> 'Memo':
+        """An empty memo with the same limits, e.g. for a skipper."""
+        return Memo(self.maxsize, self.policy)
+
+    @property
+    def stats(self) -> dict[str, int | None]:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self), 'maxsize': self.maxsize}
 
 class parser(object):
-    def __init__(self, another=False, p=False): 
+    def __init__(self, another=False, p=False, memo: Memo | None = None, profiler: Profiler | None = None):
+        self.memory  = memo if memo is not None else Memo()
+        self.profiler = profiler
         if not(another):
-            self.skipper = parser(True, p)
+            self.skipper = parser(True, p, self.memory.spawn())
             self.skipper.packrat = p
         else:
             self.skipper = self
+        self.text = ""
         self.textlen = 0
         self.restlen = -1
-        self.memory  = {}
+        self.failpos = -1
+        self.expected: list[Node] = []
+        self.tracing = False        # whether choices also report the alternatives they skip, see `retrace`
         self.packrat = p
+        self._compiled: dict[int, tuple[Any, Node]] = {}
+        self.configure(True, None)
+
+    def reset(self, text: str) -> None:
+        """Use `text` as the parse buffer, dropping memoised results for any previous buffer."""
+        if self.text is not text and self.text != text:
+            self.memory.clear()
+            self.skipper.memory.clear()
+        self.text = self.skipper.text = text
+        self.textlen = self.skipper.textlen = len(text)
+        self.restlen = -1
+        self.failpos = -1
+        self.expected = []
+
+    def configure(self, skipWS: bool, skipComments: ParsePattern | None) -> None:
+        """Set what is skipped before and after each token."""
+        self.skipWS = skipWS
+        self.skipComments = self.compile(skipComments) if skipComments is not None else None
+        self.skipping = skipWS or self.skipComments is not None
+        if self.skipper is not self:
+            self.skipper.configure(skipWS, None)
+
+    def skip(self, pos: int) -> int:
+        if self.skipWS:
+            pos = ws_regex.match(self.text, pos, self.textlen).end()
+        while self.skipComments is not None and (end := self.skipComments.parse(self.skipper, pos, [])) >= 0:
+            pos = end
+        return pos
+
+    def within(self, node: Node, start: int, stop: int, out: list) -> int:
+        """Parse `node` at `start` as if the text ended at `stop`, with fresh memos and without
+        reporting failures; returns the end offset or FAIL."""
+        saved = self.textlen, self.memory, self.skipper.memory, self.failpos, self.expected, self.tracing
+        self.textlen = self.skipper.textlen = stop
+        self.memory, self.skipper.memory = self.memory.spawn(), self.skipper.memory.spawn()
+        self.failpos, self.expected, self.tracing = -1, [], False
+        try:
+            return node.parse(self, start, out)
+        finally:
+            self.textlen, self.memory, self.skipper.memory, self.failpos, self.expected, self.tracing = saved
+            self.skipper.textlen = self.textlen
+
+    def expect(self, pos: int, node: Node) -> int:
+        """Record a failed terminal at `pos`, keeping the ones at the farthest offset; returns FAIL."""
+        if pos > self.failpos:
+            self.failpos = pos
+            self.expected = [node]
+        elif pos == self.failpos:
+            self.expected.append(node)
+        return FAIL
+
+    def syntax_error(self) -> SyntaxError:
+        """Build the error for a failed parse from the farthest failure."""
+        if self.failpos < 0:
+            return SyntaxError("syntax error")
+        wanted = ', '.join(dict.fromkeys(node.describe() for node in self.expected))
+        return SyntaxError(f"syntax error, expected {wanted}")
 
-    def parseLine(self, textline, pattern: ParsePattern, resultSoFar=None, skipWS=True, skipComments: Callable | None = None) -> tuple[list, str]:
+    def retrace(self, pos: int, pattern: ParsePattern | Node) -> None:
+        """Parse again from `pos` with `tracing` on, so the farthest failure also lists what the
+        alternatives skipped by FIRST-set dispatch expected. Only done once a parse has failed."""
+        self.memory.clear()         # memoised results would not report again
+        self.failpos = -1
+        self.expected = []
+        self.tracing = True
+        try:
+            self._node(pattern).parse(self, pos, [])
+        finally:
+            self.tracing = False
+
+    def parseLine(self, textline, pattern: ParsePattern | Node, resultSoFar=None, skipWS=True, skipComments: Callable | None = None) -> tuple[list, str]:
         """\
 * textline     : text to parse
-* pattern      : pyPEG language description
+* pattern      : pyPEG language description, or a node from `compile_pattern`
 * resultSoFar  : parsing result so far (default: blank list [])
 * skipWS       : should whitespace be skipped (default: True)
 * skipComments : function which returns pyPEG for matching comments
@@ -141,196 +1168,65 @@ class parser(object):
 - returns:    pyAST, textrest"""
         if resultSoFar is None:
             resultSoFar = []
-        name = None
-        _pattern = pattern
-        _rsf_len = len(resultSoFar)
-
-        def syntaxError(error=None):
-            if self.packrat:
-                self.memory[_cache_key] = False
-            raise SyntaxError(error)
-
-        def Result(result: object, text: str) -> tuple:
-            if __debug__ and print_trace:
-                try:
-                    if (pattern_name := getattr(_pattern, "__name__")) != "comment":
-                        sys.stderr.write(f"match: {pattern_name}\n")
-                except: pass
-
-            if self.restlen == -1:
-                self.restlen = len(text)
-            else:
-                self.restlen = min(self.restlen, len(text))
-            
-            results = resultSoFar
-            if name and result:
-                results.append(Symbol(name, result, _start_offset))
-            elif name:
-                results.append(Symbol(name, [], _start_offset))
-            elif result:
-                if isinstance(result, list):
-                    results.extend(result)
-                else:
-                    results.extend([result])
-            
-            if self.packrat:
-                self.memory[_cache_key] = (results[_rsf_len:], text)
-            
-            return results, text        
-        
-        if self.packrat:
-            _cache_key = (textline,
-                tuple(id(p) for p in pattern) if isinstance(pattern, (list, tuple))
-                else pattern)
-            if (cached := self.memory.get(_cache_key)) is not None:
-                if cached is False:
-                    raise SyntaxError()
-                resultSoFar.extend(cached[0])
-                return resultSoFar, cached[1]
-
-        if callable(pattern):
-            if __debug__:
-                if print_trace:
-                    try:
-                        if pattern.__name__ != "comment":
-                            sys.stderr.write(f"testing with {pattern.__name__}: {textline[:40]}\n")
-                    except: pass
-
-            if pattern.__name__[0] != "_":
-                name = pattern.__name__
-
-            pattern = pattern()
-            if callable(pattern):
-                pattern = (pattern,)
-
-        text = skip(self.skipper, textline, skipWS, skipComments)
-        _start_offset = self.textlen - len(text)
-
-        match pattern:
-            case keyword():   # keyword before str — keyword IS-A str, so order matters
-                if m := word_regex.match(text):
-                    if m.group(0) == pattern:
-                        text = skip(self.skipper, text[len(pattern):], skipWS, skipComments)
-                        return Result(None, text)
-                    else:
-                        syntaxError()
-                else:
-                    syntaxError(word_regex.pattern)
+        self.reset(textline)
+        if (pos := self.parseAt(0, pattern, resultSoFar, skipWS, skipComments)) < 0:
+            self.retrace(0, pattern)
+            raise self.syntax_error()
+        self.restlen = self.textlen - pos
+        return resultSoFar, textline[pos:]
 
-            case str():
-                if text[:len(pattern)] == pattern:
-                    text = skip(self.skipper, text[len(pattern):], skipWS, skipComments)
-                    return Result(None, text)
-                else:
-                    syntaxError()
-
-            case _not():      # _not before _and — _not IS-A _and, so order matters
-                try:
-                    r, t = self.parseLine(text, pattern.obj, [], skipWS, skipComments)
-                except:
-                    return resultSoFar, textline
-                syntaxError()
-
-            case _and():
-                r, t = self.parseLine(text, pattern.obj, [], skipWS, skipComments)
-                return resultSoFar, textline
-
-            case ignore():
-                if m := pattern.regex.match(text):
-                    text = skip(self.skipper, text[len(m.group(0)):], skipWS, skipComments)
-                    return Result(None, text)
-                else:
-                    syntaxError()
-
-            case tuple():
-                n = 1; result = []
-                for p in pattern:
-                    if isinstance(p, int):
-                        n = p
-                    elif isinstance(n, int):
-                        if n > 0:
-                            for i in range(n):
-                                result, text = self.parseLine(text, p, result, skipWS, skipComments)
-                        elif n == 0:
-                            if text != "":
-                                try:
-                                    newResult, newText = self.parseLine(text, p, result, skipWS, skipComments)
-                                    result, text = newResult, newText
-                                except SyntaxError:
-                                    pass
-                        elif n < 0:
-                            found = False
-                            while True:
-                                try:
-                                    newResult, newText = self.parseLine(text, p, result, skipWS, skipComments)
-                                    result, text, found = newResult, newText, True
-                                except SyntaxError:
-                                    break
-                            if n == -2 and not found:
-                                syntaxError(f"{text} function={p}")
-                        n = 1
-                return Result(result, text)
-
-            case list():
-                result = []; found = False
-                for p in pattern:
-                    try:
-                        result, text = self.parseLine(text, p, result, skipWS, skipComments)
-                        found = True
-                    except SyntaxError:
-                        pass
-                    if found:
-                        break
-                if found:
-                    return Result(result, text)
-                else:
-                    syntaxError()
+    def parseAt(self, pos: int, pattern: ParsePattern | Node, resultSoFar: list, skipWS=True, skipComments: Callable | None = None) -> int:
+        """Match `pattern` against `self.text` at offset `pos`.
+        Appends results to `resultSoFar` and returns the offset after the match, or FAIL."""
+        self.configure(skipWS, skipComments)
+        return self.compile(pattern).parse(self, pos, resultSoFar)
 
-            case re.Pattern():
-                if m := pattern.match(text):
-                    text = skip(self.skipper, text[len(m.group(0)):], skipWS, skipComments)
-                    return Result(m.group(0), text)
-                else:
-                    syntaxError()
-
-            case _:
-                raise SyntaxError(f"illegal type in grammar: {type(pattern)}")
+    def compile(self, pattern: ParsePattern | Node) -> Node:
+        """`compile_pattern`, remembering the node for each pattern object this parser has seen."""
+        node = self._node(pattern)
+        return node if self.profiler is None else self.profiler.instrument(node)
 
-        return resultSoFar, textline  # unreachable; satisfies type checkers
+    def _node(self, pattern: ParsePattern | Node) -> Node:
+        if callable(pattern) or isinstance(pattern, Node):
+            return compile_pattern(pattern)
+        if (known := self._compiled.get(id(pattern))) is None or known[0] is not pattern:
+            known = self._compiled[id(pattern)] = (pattern, compile_pattern(pattern))
+        return known[1]
     
 
-def parseLine(textline, pattern, resultSoFar = None, skipWS = True, skipComments = None, packrat = False) -> tuple[list[Any], str]:
-    if resultSoFar is None:
-        resultSoFar = []
-    p = parser(p=packrat)
-    p.textlen = len(textline)  # Set textlen to enable correct offset tracking
-    text = skip(p.skipper, textline, skipWS, skipComments)
-    return p.parseLine(text, pattern, resultSoFar, skipWS, skipComments)
+def parseLine(textline, pattern, resultSoFar = None, skipWS = True, skipComments = None, packrat = False, memo: Memo | None = None,
+              flat: bool = False, profiler: Profiler | None = None) -> tuple[list[Any] | FlatTree, str]:
+    """Parse `textline`; with `flat`, the result is returned as a `FlatTree`. A `Profiler` collects per-rule stats."""
+    result, rest = parser(p=packrat, memo=memo, profiler=profiler).parseLine(textline, pattern, resultSoFar, skipWS, skipComments)
+    return (FlatTree.from_symbols(result, textline) if flat else result), rest
 
-def parse(language, lineSource, skipWS = True, skipComments = None, packrat = False):
+def parse(language, lineSource, skipWS = True, skipComments = None, packrat = False, memo: Memo | None = None, flat: bool = False,
+          profiler: Profiler | None = None):
     """\
 * language     : pyPEG language description
 * lineSource   : a fileinput.FileInput object or iterable of lines
 * skipWS       : should whitespace be skipped (default: True)
 * skipComments : function which returns pyPEG for matching comments
 * packrat      : cache parse results at each position to avoid redundant work (default: False)
+* memo         : `Memo` to use for packrat results, e.g. to bound its size or read its counters
+* flat         : return the tree as a `FlatTree` of int columns instead of `Symbol`s (default: False)
+* profiler     : `Profiler` to record per-rule attempts, timings and memo hits in
 
 - returns   pyAST"""
     
     orig = "".join(lineSource)
     
-    p = parser(p=packrat)
-    p.textlen = len(orig)
+    p = parser(p=packrat, memo=memo, profiler=profiler)
     
     try:
-        text = skip(p.skipper, orig, skipWS, skipComments)
-        result, text = p.parseLine(text, language, [], skipWS, skipComments)
+        result, text = p.parseLine(orig, language, [], skipWS, skipComments)
         if text:
-            raise SyntaxError()
+            p.retrace(0, language)
+            raise p.syntax_error()
     
     except SyntaxError as e:
         err_msg_str = str(e)
-        offset = len(orig) - p.restlen if p.restlen >= 0 else len(orig)
+        offset = p.failpos if p.failpos >= 0 else len(orig) - p.restlen if p.restlen >= 0 else 0
         
         err_msg = err_msg_str if (err_msg_str and err_msg_str != "None") else "syntax error"
         
@@ -342,4 +1238,4 @@ def parse(language, lineSource, skipWS = True, skipComments = None, packrat = Fa
         
         raise SyntaxError(f"parse error at offset {offset}: {err_msg}\n  ...{snippet}...\n  ...{indicator}") from e
 
-    return result
+    return FlatTree.from_symbols(result, orig) if flat else result
@@ -6,12 +6,14 @@
     render(node)        -> canonical plaintext
 """
 
-import re, types
+import heapq, itertools, re, types
+from bisect import bisect_left, insort
 from dataclasses import dataclass, field
-from datetime import date as Date
+from datetime import date as Date, timedelta
 from enum import Enum
 from functools import lru_cache
-from typing import Any, Iterator, Literal
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, Literal
 
 from .pyPEG import Symbol, parseLine
 
@@ -28,6 +30,8 @@ _CHAR_MAP       = { 'x': 'done', 'y': 'done', '/': 'progress', '-': 'cancelled',
 
 type ThingKind = Literal['item', 'section', 'session']
 
+_next_uid = itertools.count(1).__next__
+
 
 class TodoStatus(str, Enum):
     OPEN = 'open'
@@ -66,6 +70,23 @@ class TodoStatus(str, Enum):
                 return cls(str(value))
 
 
+_STATUS_ORDER = tuple(TodoStatus)
+_STATUS_INDEX = {status: i for i, status in enumerate(_STATUS_ORDER)}
+
+
+def _aggregate_status(counts: list[int]) -> TodoStatus:
+    """Status of a group of items from how many of them are in each status (in `TodoStatus` order)"""
+    open_, _, done, _, cancelled = counts
+    if not (total := sum(counts)):
+        return TodoStatus.OPEN
+    return (
+        TodoStatus.CANCELLED if cancelled == total else
+        TodoStatus.DONE if done + cancelled == total else
+        TodoStatus.PROGRESS if open_ < total else
+        TodoStatus.OPEN
+    )
+
+
 @dataclass(frozen=True, slots=True)
 class Tag:
     kind: str
@@ -111,6 +132,10 @@ class TodoThing:
     nodes: list['TodoThing'] = field(default_factory=list)
     notes: list[str] = field(default_factory=list)
     parent: 'TodoDocument | TodoThing | None' = field(default=None, repr=False, compare=False)
+    # Unique within the process and kept across edits and moves; see `TodoDocument.find_item_by_id`
+    uid: int = field(default_factory=_next_uid, init=False, repr=False, compare=False)
+    # Items under this node (itself included, unless a section) per status; see `_status_totals`
+    _counts: list[int] | None = field(default=None, init=False, repr=False, compare=False)
 
     @property
     def is_section(self) -> bool:
@@ -156,15 +181,42 @@ class TodoThing:
     def branch_status(self) -> TodoStatus:
         if not self.is_section and not self.nodes:
             return self.own_status
-        if not (items := [*self.all_items()]):
-            return TodoStatus.OPEN
-        statuses = [item.own_status for item in items]
-        return (
-            TodoStatus.CANCELLED if all(status is TodoStatus.CANCELLED for status in statuses) else
-            TodoStatus.DONE if all(status.value in _CLOSED for status in statuses) else
-            TodoStatus.PROGRESS if any(status is not TodoStatus.OPEN for status in statuses) else
-            TodoStatus.OPEN
-        )
+        return _aggregate_status(self._status_totals())
+
+    @property
+    def status_counts(self) -> dict[TodoStatus, int]:
+        """How many items of the branch (this item included) are in each status"""
+        return dict(zip(_STATUS_ORDER, self._status_totals()))
+
+    def _status_totals(self) -> list[int]:
+        """Counted once, then kept current by the status and text edits and `add_node`/`remove_node`;
+        a cached node always has cached descendants, so an edit only updates its ancestors."""
+        if (counts := self._counts) is None:
+            counts = [0] * len(_STATUS_ORDER)
+            if not self.is_section:
+                counts[_STATUS_INDEX[self.own_status]] += 1
+            for node in self.nodes:
+                for i, n in enumerate(node._status_totals()):
+                    counts[i] += n
+            self._counts = counts
+        return counts
+
+    def _own_status_changed(self, old: TodoStatus) -> None:
+        if self.is_section or (new := self.own_status) is old:
+            return
+        node = self
+        while node is not None and (counts := node._counts) is not None:
+            counts[_STATUS_INDEX[old]] -= 1
+            counts[_STATUS_INDEX[new]] += 1
+            node = node.parent
+
+    def invalidate_status(self) -> None:
+        """Drop the cached status counts of this node and its ancestors; call after changing
+        `nodes` or `tags` directly (along with `TodoDocument.invalidate_index`)"""
+        node = self
+        while node is not None and node._counts is not None:
+            node._counts = None
+            node = node.parent
 
     @property
     def status(self) -> TodoStatus:
@@ -234,9 +286,11 @@ class TodoThing:
             for item in self.all_items():
                 item.set_status(target, cascade=False)
             return self
+        old = self.own_status
         self.tags = [tag for tag in self.tags if tag.kind != 'status']
         if target is not TodoStatus.OPEN:
             self.tags.insert(0, Tag.status('done', Date.today().isoformat()) if target is TodoStatus.DONE else Tag.status(target.tag_name()))
+        self._own_status_changed(old)
         if cascade:
             for node in self.nodes:
                 node.set_status(target, cascade=True)
@@ -253,9 +307,31 @@ class TodoThing:
         clean, tags = _extract_tags(new_text)
         if (old_status := [tag for tag in self.tags if tag.kind == 'status']) and not any(tag.kind == 'status' for tag in tags):
             tags = [*old_status, *tags]
+        old = self.own_status
+        if index := self._item_index():
+            index.discard(self)
         self.text, self.tags, self.raw = clean, tags, ''
+        if index:
+            index.insert(self)
+        self._own_status_changed(old)
         return self
 
+    def _item_index(self) -> '_ItemIndex | None':
+        """The owning document's item index, if it is built and knows this item"""
+        if self.is_section or (doc := _document(self)) is None or (index := doc._index) is None:
+            return None
+        if self.uid not in index.position:
+            doc.invalidate_index()  # added to `nodes` directly after the index was built
+            return None
+        return index
+
+    def add_node(self, node: 'TodoThing', index: int | None = None) -> 'TodoThing':
+        """Insert `node` (moving it from its current parent) at `index` of `nodes`, appending by default"""
+        return _attach(self, node, index)
+
+    def remove_node(self, node: 'TodoThing') -> 'TodoThing':
+        return _detach(self, node)
+
     def to_text(self) -> str:
         return _render_section(self) if self.is_section else _render_item(self, depth=0)
 
@@ -281,12 +357,173 @@ class TodoThing:
 type TodoNode = TodoThing
 
 
+def _index_keys(item: TodoThing) -> set[tuple[str, ...]]:
+    keys: set[tuple[str, ...]] = set()
+    for tag in item.tags:
+        if tag.kind in ('mention', 'hashtag', 'project'):
+            keys.add((tag.kind, tag.name))
+        elif tag.kind == 'meta':
+            keys.update((('meta', tag.name), ('meta', tag.name, tag.value)))
+    return keys
+
+
+@dataclass(slots=True)
+class _ItemIndex:
+    """Position, id, tag and due-date lookups over a document's items (all kept in document order);
+    `TodoThing.edit_text` and `add_node`/`remove_node` update it in place"""
+    items: list[TodoThing] = field(default_factory=list)
+    position: dict[int, int] = field(default_factory=dict)  # uid -> index in `items`
+    by_uid: dict[int, TodoThing] = field(default_factory=dict)
+    buckets: dict[tuple[str, ...], list[TodoThing]] = field(default_factory=dict)
+    due: list[tuple[Date, TodoThing]] = field(default_factory=list)  # sorted by (date, position)
+
+    @classmethod
+    def build(cls, items: Iterator[TodoThing]) -> '_ItemIndex':
+        index = cls(items=list(items))
+        index.position = {item.uid: i for i, item in enumerate(index.items)}
+        index.by_uid = {item.uid: item for item in index.items}
+        for item in index.items:
+            for key in _index_keys(item):
+                index.buckets.setdefault(key, []).append(item)
+            if (due := item.due_date) is not None:
+                index.due.append((due, item))
+        index.due.sort(key=index._due_order)
+        return index
+
+    def _order(self, item: TodoThing) -> int:
+        return self.position[item.uid]
+
+    def _due_order(self, entry: tuple[Date, TodoThing]) -> tuple[Date, int]:
+        return entry[0], self.position[entry[1].uid]
+
+    def knows(self, items: list[TodoThing]) -> bool:
+        return all(item.uid in self.position for item in items)
+
+    def discard(self, item: TodoThing) -> None:
+        """Take a known item out of the buckets its current tags put it in"""
+        for key in _index_keys(item):
+            bucket = self.buckets[key]
+            del bucket[bisect_left(bucket, self._order(item), key=self._order)]
+            if not bucket:
+                del self.buckets[key]
+        if (due := item.due_date) is not None:
+            del self.due[bisect_left(self.due, (due, self._order(item)), key=self._due_order)]
+
+    def insert(self, item: TodoThing) -> None:
+        for key in _index_keys(item):
+            insort(self.buckets.setdefault(key, []), item, key=self._order)
+        if (due := item.due_date) is not None:
+            insort(self.due, (due, item), key=self._due_order)
+
+    def _renumber(self, start: int) -> None:
+        # items keep their relative order, so the buckets stay sorted
+        position, items = self.position, self.items
+        for i in range(start, len(items)):
+            position[items[i].uid] = i
+
+    def add_items(self, at: int, new: list[TodoThing]) -> None:
+        self.items[at:at] = new
+        self.by_uid.update((item.uid, item) for item in new)
+        self._renumber(at)
+        for item in new:
+            self.insert(item)
+
+    def remove_items(self, old: list[TodoThing]) -> None:
+        """Drop a run of consecutive known items, e.g. the items of a removed subtree"""
+        if not old:
+            return
+        for item in old:
+            self.discard(item)
+        at = self.position[old[0].uid]
+        del self.items[at:at + len(old)]
+        for item in old:
+            del self.position[item.uid], self.by_uid[item.uid]
+        self._renumber(at)
+
+    def lookup(self, *key: str | None) -> list[TodoThing]:
+        return list(self.buckets.get(key, ()))
+
+    def count(self, *key: str | None) -> int:
+        return len(self.buckets.get(key, ()))
+
+    def _due_span(self, start: Date | None, end: Date | None) -> slice:
+        lo = bisect_left(self.due, (start,), key=self._due_order) if start else 0
+        return slice(lo, max(lo, bisect_left(self.due, (end,), key=self._due_order) if end else len(self.due)))
+
+    def due_between(self, start: Date | None, end: Date | None) -> list[TodoThing]:
+        return [item for _, item in self.due[self._due_span(start, end)]]
+
+
+def _document(node: 'TodoDocument | TodoThing | None') -> 'TodoDocument | None':
+    while node is not None and node.parent is not None:
+        node = node.parent
+    return node if isinstance(node, TodoDocument) else None
+
+def _add_counts(node: 'TodoDocument | TodoThing | None', delta: list[int], sign: int) -> None:
+    while node is not None and (counts := node._counts) is not None:
+        for i, n in enumerate(delta):
+            counts[i] += sign * n
+        node = node.parent
+
+def _last_item(node: TodoThing) -> TodoThing | None:
+    for child in reversed(node.nodes):
+        if last := _last_item(child):
+            return last
+    return None if node.is_section else node
+
+def _item_before(node: TodoThing) -> TodoThing | None:
+    """The item preceding `node` in document order, i.e. in `all_items()`"""
+    while (parent := node.parent) is not None:
+        siblings = parent.nodes
+        for i in range(next(i for i, sibling in enumerate(siblings) if sibling is node) - 1, -1, -1):
+            if last := _last_item(siblings[i]):
+                return last
+        if isinstance(parent, TodoThing) and not parent.is_section:
+            return parent
+        node = parent
+    return None
+
+def _attach(parent: 'TodoDocument | TodoThing', node: TodoThing, index: int | None) -> TodoThing:
+    if node.parent is not None:
+        node.parent.remove_node(node)
+    parent.nodes.insert(len(parent.nodes) if index is None else index, node)
+    node.parent = parent
+    if parent._counts is not None:
+        _add_counts(parent, node._status_totals(), 1)
+    if (doc := _document(parent)) and (item_index := doc._index) is not None and (new := list(node.all_items())):
+        before = _item_before(node)
+        if before is None or item_index.knows([before]):
+            item_index.add_items(item_index.position[before.uid] + 1 if before else 0, new)
+        else:
+            doc.invalidate_index()
+    return node
+
+def _detach(parent: 'TodoDocument | TodoThing', node: TodoThing) -> TodoThing:
+    i = next((i for i, child in enumerate(parent.nodes) if child is node), None)
+    if i is None:
+        raise ValueError('node is not a child of this parent')
+    if parent._counts is not None:
+        _add_counts(parent, node._status_totals(), -1)
+    if (doc := _document(parent)) and (item_index := doc._index) is not None:
+        if item_index.knows(old := list(node.all_items())):
+            item_index.remove_items(old)
+        else:
+            doc.invalidate_index()
+    del parent.nodes[i]
+    node.parent = None
+    return node
+
+
 @dataclass(slots=True)
 class TodoDocument:
     title: str | None = None
     title_tags: list[Tag] = field(default_factory=list)
     nodes: list[TodoThing] = field(default_factory=list)
     notes: list[str] = field(default_factory=list)
+    _counts: list[int] | None = field(default=None, init=False, repr=False, compare=False)
+    _index: _ItemIndex | None = field(default=None, init=False, repr=False, compare=False)
+
+    parent = None  # the top of every `TodoThing.parent` chain
 
     @property
     def items(self) -> list[TodoThing]:
@@ -302,15 +539,59 @@ class TodoDocument:
 
     @property
     def status(self) -> TodoStatus:
-        if not (items := [*self.all_items()]):
-            return TodoStatus.OPEN
-        statuses = [item.own_status for item in items]
-        return (
-            TodoStatus.CANCELLED if all(status is TodoStatus.CANCELLED for status in statuses) else
-            TodoStatus.DONE if all(status.value in _CLOSED for status in statuses) else
-            TodoStatus.PROGRESS if any(status is not TodoStatus.OPEN for status in statuses) else
-            TodoStatus.OPEN
-        )
+        return _aggregate_status(self._status_totals())
+
+    @property
+    def status_counts(self) -> dict[TodoStatus, int]:
+        return dict(zip(_STATUS_ORDER, self._status_totals()))
+
+    def _status_totals(self) -> list[int]:
+        if (counts := self._counts) is None:
+            counts = [0] * len(_STATUS_ORDER)
+            for node in self.nodes:
+                for i, n in enumerate(node._status_totals()):
+                    counts[i] += n
+            self._counts = counts
+        return counts
+
+    def invalidate_status(self) -> None:
+        self._counts = None
+
+    def _item_index(self) -> _ItemIndex:
+        """Built on first lookup, then kept current by `edit_text`, `add_node` and `remove_node`"""
+        if self._index is None:
+            self._index = _ItemIndex.build(self.all_items())
+        return self._index
+
+    def invalidate_index(self) -> None:
+        """Drop the item index; call after changing `nodes` or `tags` without the methods above"""
+        self._index = None
+
+    def add_node(self, node: TodoThing, index: int | None = None) -> TodoThing:
+        return _attach(self, node, index)
+
+    def remove_node(self, node: TodoThing) -> TodoThing:
+        return _detach(self, node)
+
+    def items_with_mention(self, name: str) -> list[TodoThing]:
+        return self._item_index().lookup('mention', name)
+
+    def items_with_hashtag(self, name: str) -> list[TodoThing]:
+        return self._item_index().lookup('hashtag', name)
+
+    def items_in_project(self, name: str) -> list[TodoThing]:
+        return self._item_index().lookup('project', name)
+
+    def items_with_meta(self, key: str, value: str | None = None) -> list[TodoThing]:
+        """Items carrying a `key:value` tag; any value when `value` is None"""
+        return self._item_index().lookup('meta', key) if value is None else self._item_index().lookup('meta', key, value)
+
+    def items_due(self, start: Date | None = None, end: Date | None = None) -> list[TodoThing]:
+        """Items with a parseable due date in `[start, end)`, earliest first"""
+        return self._item_index().due_between(start, end)
+
+    def query(self) -> 'TodoQuery':
+        return TodoQuery(self)
 
     @property
     def is_complete(self) -> bool:
@@ -341,10 +622,18 @@ class TodoDocument:
         return next((section for section in self.sections if section.text.lower() == target), None)
 
     def find_item(self, index: int) -> TodoThing | None:
-        return next((item for i, item in enumerate(self.all_items(), 1) if i == index), None)
+        items = self._item_index().items
+        return items[index - 1] if 0 < index <= len(items) else None
+
+    def find_item_by_id(self, uid: int) -> TodoThing | None:
+        return self._item_index().by_uid.get(uid)
+
+    def item_number(self, item: TodoThing) -> int | None:
+        """The 1-based index `find_item` takes for `item`"""
+        return None if (i := self._item_index().position.get(item.uid)) is None else i + 1
 
     def indexed_items(self) -> list[tuple[int, TodoThing]]:
-        return [(i, item) for i, item in enumerate(self.all_items(), 1)]
+        return list(enumerate(self._item_index().items, 1))
 
     def to_text(self) -> str:
         return _render_document(self)
@@ -360,6 +649,129 @@ class TodoDocument:
         }
 
 
+def _has_tag(item: TodoThing, key: tuple[str, ...]) -> bool:
+    kind, name, *value = key
+    return any(tag.kind == kind and tag.name == name and (not value or tag.value == value[0]) for tag in item.tags)
+
+def _as_date(value: 'Date | str') -> Date:
+    return Date.fromisoformat(value) if isinstance(value, str) else value
+
+_ORDER_KEYS: dict[str, Callable[[TodoThing], Any]] = {
+    'due': lambda item: (item.due_date is None, item.due_date or Date.min),
+    'priority': lambda item: (item.priority is None, item.priority or ''),
+    'status': lambda item: _STATUS_INDEX[item.status],
+    'text': lambda item: item.text.lower(),
+}
+
+
+class TodoQuery:
+    """Chainable filters over a document's items, e.g.
+
+        doc.query().assignee('alice').due_before('2026-10-25').order_by('due').limit(10)
+
+    Iterating runs the query: the most selective tag or due-date filter picks the candidates
+    from the document's index, the remaining filters are checked per item, and results come
+    lazily in document order unless `order_by` is given."""
+
+    def __init__(self, doc: TodoDocument):
+        self.doc = doc
+        self._keys: list[tuple[str, ...]] = []
+        self._statuses: set[TodoStatus] | None = None
+        self._priorities: set[str] | None = None
+        self._start: Date | None = None
+        self._end: Date | None = None
+        self._order: Callable[[TodoThing], Any] | None = None
+        self._reverse = False
+        self._limit: int | None = None
+
+    def status(self, *values: 'str | TodoStatus') -> 'TodoQuery':
+        self._statuses = {TodoStatus.from_any(value) for value in values}
+        return self
+
+    def assignee(self, name: str) -> 'TodoQuery':
+        self._keys.append(('mention', name))
+        return self
+
+    def hashtag(self, name: str) -> 'TodoQuery':
+        self._keys.append(('hashtag', name))
+        return self
+
+    def project(self, name: str) -> 'TodoQuery':
+        self._keys.append(('project', name))
+        return self
+
+    def meta(self, key: str, value: str | None = None) -> 'TodoQuery':
+        self._keys.append(('meta', key) if value is None else ('meta', key, value))
+        return self
+
+    def priority(self, *values: str) -> 'TodoQuery':
+        self._priorities = set(values)
+        return self
+
+    def due_before(self, value: 'Date | str') -> 'TodoQuery':
+        end = _as_date(value)
+        self._end = min(self._end, end) if self._end else end
+        return self
+
+    def due_after(self, value: 'Date | str') -> 'TodoQuery':
+        start = _as_date(value) + timedelta(days=1)
+        self._start = max(self._start, start) if self._start else start
+        return self
+
+    def order_by(self, key: str | Callable[[TodoThing], Any], *, reverse: bool = False) -> 'TodoQuery':
+        """Sort by 'due', 'priority', 'status', 'text' or a key function; ties keep document order"""
+        self._order, self._reverse = _ORDER_KEYS[key] if isinstance(key, str) else key, reverse
+        return self
+
+    def limit(self, count: int) -> 'TodoQuery':
+        self._limit = count
+        return self
+
+    def _plan(self) -> tuple[str, Iterable[TodoThing], list[Callable[[TodoThing], bool]]]:
+        index = self.doc._item_index()
+        choices = [(index.count(*key), i) for i, key in enumerate(self._keys)]
+        has_due = self._start is not None or self._end is not None
+        if has_due:
+            span = index._due_span(self._start, self._end)
+            choices.append((span.stop - span.start, len(self._keys)))
+        checks: list[Callable[[TodoThing], bool]] = [
+            lambda item, key=key: _has_tag(item, key) for key in self._keys
+        ]
+        if has_due:
+            checks.append(lambda item: (due := item.due_date) is not None and (self._start is None or due >= self._start) and (self._end is None or due < self._end))
+        if not choices:
+            source, label = self.doc.all_items(), 'scan'
+        elif (driver := min(choices)[1]) < len(self._keys):
+            key = self._keys[driver]
+            source, label = list(index.buckets.get(key, ())), ':'.join(map(str, key))
+            del checks[driver]
+        else:
+            source, label = sorted((item for _, item in index.due[span]), key=index._order), 'due'
+            del checks[driver]
+        if self._statuses is not None:
+            checks.append(lambda item: item.status in self._statuses)
+        if self._priorities is not None:
+            checks.append(lambda item: item.priority in self._priorities)
+        return label, source, checks
+
+    def explain(self) -> str:
+        """Which index drives the query ('scan' when none applies)"""
+        return self._plan()[0]
+
+    def __iter__(self) -> Iterator[TodoThing]:
+        _, source, checks = self._plan()
+        items: Iterable[TodoThing] = (item for item in source if all(check(item) for check in checks))
+        if self._order is not None:
+            if self._limit is not None:
+                items = (heapq.nlargest if self._reverse else heapq.nsmallest)(self._limit, items, key=self._order)
+            else:
+                items = sorted(items, key=self._order, reverse=self._reverse)
+        yield from islice(items, self._limit)
+
+    def first(self) -> TodoThing | None:
+        return next(iter(self), None)
+
+
 class TodoGrammar(dict):
     def __init__(self):
         peg, self.root = self._get_rules()
@@ -389,7 +801,7 @@ class TodoGrammar(dict):
         def value(): return _(r'[^\n]*')
         def field(): return indent, key, _(r'\s*:\s*'), value, eol
         def inline():
-            return _(r'(?:(?:x\s+(?:\d{4}-\d{2}-\d{2}\s+)?|\([A-Z]\)\s+)[^\n]*|(?=[^\n]*(?<!\w)(?:\+[A-Za-z][\w-]*|@[A-Za-z][\w.-]*(?:\([^)]+\))?|#[A-Za-z][\w-]*))[^\n]+)'), eol
+            return _(r'(?:(?:x\s+(?:\d{4}-\d{2}-\d{2}\s+)?|\([A-Z]\)\s+)[^\n]*|(?=(?:[^\n]*[^\w\n])?(?:\+[A-Za-z][\w-]*|@[A-Za-z][\w.-]*(?:\([^)]+\))?|#[A-Za-z][\w-]*))[^\n]+)'), eol
         def note(): return _(r'[^\n]+'), eol
         
         def document(): return -1, [blank, heading, header, field, project, item, inline, note]
@@ -398,12 +810,32 @@ class TodoGrammar(dict):
                 if isinstance(value, types.FunctionType)}, document
 
     def parse(self, text: str, root=None, skipWS: bool = False, **kw: Any):
-        text = _(r'\r\n|\r').sub('\n', text + ('\n' if not text.endswith('\n') else ''))
+        text = _normalize_eol(text)
         kw.setdefault('packrat', True)
         kw.setdefault('resultSoFar', [])
         return parseLine(text, root or self.root, skipWS=skipWS, **kw)
 
 
+def _normalize_eol(text: str) -> str:
+    return _(r'\r\n|\r').sub('\n', text + ('\n' if not text.endswith('\n') else ''))
+
+# `TodoGrammar.document` as one regex: its alternatives in the same order, each token atomic `(?>...)`
+# so that, like a PEG terminal, it keeps its first match and is never backtracked into. A few tokens
+# (`\s*` around a field's colon, inline `x\s+`) may run past a newline, exactly as in the grammar.
+_LINE_RE = re.compile('|'.join((
+    r'(?P<blank>(?>[ \t]*)\n)',
+    r'(?P<heading>(?P<heading_level>(?>#{1,6}))(?>[ \t]+)(?P<heading_text>[^\n]*)\n)',
+    r'(?P<header>(?P<name>(?>\S(?:.*?\S)?(?=[ \t]+TODO:[ \t]*\n)))(?>(?i:[ \t]+TODO:[ \t]*))\n)',
+    r'(?P<field>(?>[ \t]*)(?P<key>(?>(?i:Start|End|Notes)))(?>\s*:\s*)(?P<value>[^\n]*)\n)',
+    r'(?P<project>(?P<project_indent>(?>[ \t]*))(?P<project_name>(?>\S(?:.*?\S)?(?=\s*:[ \t]*\n)))(?>\s*:[ \t]*)\n)',
+    r'(?P<item>(?P<item_indent>(?>[ \t]*))(?:(?>[-*\u2022+]|\d+[.)])(?>[ \t]+)|(?=\[[ xX/\-]\]))'
+        r'(?P<checkbox>\[[ xX/\-]\])?(?>[ \t]*)(?P<text>[^\n]*)\n)',
+    r'(?P<inline>(?>(?:(?:x\s+(?:\d{4}-\d{2}-\d{2}\s+)?|\([A-Z]\)\s+)[^\n]*|(?=(?:[^\n]*[^\w\n])?'
+        r'(?:\+[A-Za-z][\w-]*|@[A-Za-z][\w.-]*(?:\([^)]+\))?|#[A-Za-z][\w-]*))[^\n]+))\n)',
+    r'(?P<note>[^\n]+\n)',
+)))
+
+
 class _ASTBuilder:
     def __init__(self):
         self.doc = TodoDocument()
@@ -414,7 +846,25 @@ class _ASTBuilder:
         self.title_seen = False
 
     def build(self, nodes: Symbol | list) -> TodoDocument:
-        self._walk(nodes if isinstance(nodes, list) else [nodes])
+        self._walk(nodes if isinstance(nodes, (list, Symbol)) else [nodes])
+        self._flush_session()
+        return self.doc
+
+    def scan(self, text: str) -> TodoDocument:
+        """Build straight from the source, one `_LINE_RE` match (usually one line) at a time"""
+        text, pos = _normalize_eol(text), 0
+        next_line = _LINE_RE.match
+        while m := next_line(text, pos):
+            match m.lastgroup:
+                case 'blank':   self._blank()
+                case 'heading': self._heading(len(m['heading_level']), m['heading_text'])
+                case 'header':  self._header(m['name'])
+                case 'field':   self._field(m['key'], m['value'])
+                case 'project': self._project(m['project_indent'], m['project_name'])
+                case 'item':    self._append_list_item(m['item_indent'], m['checkbox'] or '', m['text'], _strip_eol(m[0]))
+                case 'inline':  self._append_flat_item(_strip_eol(m[0]))
+                case _:         self._note(_strip_eol(m[0]))
+            pos = m.end()
         self._flush_session()
         return self.doc
 
@@ -452,12 +902,11 @@ class _ASTBuilder:
         self.current_section = section
         self.title_seen = True
 
-    def _append_list_item(self, node: Symbol) -> None:
+    def _append_list_item(self, indent_text: str, checkbox: str, body: str, line: str) -> None:
         self._flush_session()
-        indent = len(_child_text(node, 'indent').expandtabs(4))
-        source = ' '.join(filter(None, (_child_text(node, 'checkbox', strip=True), _child_text(node, 'text', strip=True))))
-        text, tags = _extract_tags(source)
-        item = TodoThing(kind='item', raw=_strip_eol(node.text).rstrip(), text=text, tags=tags, indent=indent)
+        indent = len(indent_text.expandtabs(4))
+        text, tags = _extract_tags(' '.join(filter(None, (checkbox.strip(), body.strip()))))
+        item = TodoThing(kind='item', raw=line.rstrip(), text=text, tags=tags, indent=indent)
         while self.item_stack and self.item_stack[-1].indent >= indent:
             self.item_stack.pop()
         parent = self.item_stack[-1] if self.item_stack else self.current_section or self.doc
@@ -473,13 +922,38 @@ class _ASTBuilder:
         _target_nodes(self.current_section, self.doc).append(TodoThing(kind='item', raw=line.rstrip(), text=text, tags=tags, parent=self.current_section or self.doc))
         self.title_seen = True
 
+    ## Symbol visitors, for `build`; each hands the matched parts on to the line handlers below
     def _visit_blank(self, node: Symbol) -> None:
+        self._blank()
+
+    def _visit_heading(self, node: Symbol) -> None:
+        self._heading(len(_child_text(node, 'heading_level')), _child_text(node, 'heading_text'))
+
+    def _visit_header(self, node: Symbol) -> None:
+        self._header(_child_text(node, 'name'))
+
+    def _visit_project(self, node: Symbol) -> None:
+        self._project(_child_text(node, 'indent'), _child_text(node, 'project_name'))
+
+    def _visit_field(self, node: Symbol) -> None:
+        self._field(_child_text(node, 'key'), _child_text(node, 'value'))
+
+    def _visit_item(self, node: Symbol) -> None:
+        self._append_list_item(_child_text(node, 'indent'), _child_text(node, 'checkbox'), _child_text(node, 'text'), _strip_eol(node.text))
+
+    def _visit_inline(self, node: Symbol) -> None:
+        self._append_flat_item(_strip_eol(node.text))
+
+    def _visit_note(self, node: Symbol) -> None:
+        self._note(_strip_eol(node.text))
+
+    ## Line handlers
+    def _blank(self) -> None:
         self._flush_session()
         self.item_stack.clear()
 
-    def _visit_heading(self, node: Symbol) -> None:
-        level = len(_child_text(node, 'heading_level'))
-        text, tags = _extract_tags(_child_text(node, 'heading_text', strip=True))
+    def _heading(self, level: int, heading_text: str) -> None:
+        text, tags = _extract_tags(heading_text.strip())
         if level == 1 and not self.title_seen:
             self.doc.title, self.doc.title_tags = text or None, tags
             self.title_seen = True
@@ -489,28 +963,20 @@ class _ASTBuilder:
             return
         self._start_section(text, tags, level=level)
 
-    def _visit_header(self, node: Symbol) -> None:
-        text, tags = _extract_tags(_child_text(node, 'name', strip=True))
+    def _header(self, name: str) -> None:
+        text, tags = _extract_tags(name.strip())
         self._start_section(text, tags, level=2)
 
-    def _visit_project(self, node: Symbol) -> None:
-        indent = len(_child_text(node, 'indent').expandtabs(4))
-        text, tags = _extract_tags(_child_text(node, 'project_name', strip=True))
-        self._start_section(text, tags, level=2, indent=indent)
+    def _project(self, indent: str, name: str) -> None:
+        text, tags = _extract_tags(name.strip())
+        self._start_section(text, tags, level=2, indent=len(indent.expandtabs(4)))
 
-    def _visit_field(self, node: Symbol) -> None:
-        if key := _child_text(node, 'key', strip=True).lower():
-            self.session_fields[key] = _child_text(node, 'value', strip=True)
+    def _field(self, key: str, value: str) -> None:
+        if key := key.strip().lower():
+            self.session_fields[key] = value.strip()
             self.title_seen = True
 
-    def _visit_item(self, node: Symbol) -> None:
-        self._append_list_item(node)
-
-    def _visit_inline(self, node: Symbol) -> None:
-        self._append_flat_item(_strip_eol(node.text))
-
-    def _visit_note(self, node: Symbol) -> None:
-        line = _strip_eol(node.text)
+    def _note(self, line: str) -> None:
         stripped = line.strip()
         if not self.title_seen and stripped:
             self.title_seen = True
@@ -673,7 +1139,8 @@ def parse_tree(text: str) -> Symbol:
     return result[0]
 
 def parse(text: str) -> TodoDocument:
-    return _ASTBuilder().build(parse_tree(text))
+    """Same result as building from `parse_tree(text)`, without going through the PEG parser"""
+    return _ASTBuilder().scan(text)
 
 def parse_to_dict(text: str) -> dict:
     return parse(text).to_dict()
@@ -0,0 +1,157 @@
+import re
+import tempfile
+import unittest
+from pathlib import Path
+
+from par.codegen import generate, grammar_key, load, load_module
+from par.md import MarkdownGrammar
+from par.pyPEG import Symbol, keyword, nested, parseLine
+from par.todo import TodoGrammar
+
+
+def tree(node):
+    """Comparable form of a parse result: names, offsets and matched text."""
+    if isinstance(node, Symbol):
+        return (node.__name__, node.offset, node.end, tree(node.what) if isinstance(node.what, list) else node.what)
+    if isinstance(node, list):
+        return [tree(n) for n in node]
+    return node
+
+
+def comment():
+    return re.compile(r"#[^\n]*")
+
+def number():
+    return re.compile(r"\d+")
+
+def name():
+    return re.compile(r"[a-z]\w*")
+
+def _args():
+    return "(", 0, (value, -1, (",", value)), ")"
+
+def call():
+    return name, _args
+
+def value():
+    return [number, call, name]
+
+def statement():
+    return [(keyword("let"), name, "=", value), value], ";"
+
+def program():
+    return -2, statement
+
+
+class CodegenTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def module(self, grammar, **options):
+        path = Path(self.tmp.name) / f"gen_{len(list(Path(self.tmp.name).glob('*.py')))}.py"
+        path.write_text(generate(grammar, **options), encoding="utf-8")
+        return load_module(path)
+
+
+class TestGeneratedParser(CodegenTestCase):
+    rules = {"program": program, "statement": statement, "value": value, "call": call}
+
+    def test_skipping_grammar_matches_interpreter(self):
+        generated = self.module(self.rules, root=program, skipWS=True, skipComments=comment)
+        text = "let x = f(1, g(y)) ; # note\n  z; let q=2;"
+        expected = parseLine(text, program, skipWS=True, skipComments=comment, packrat=True)
+        result, rest = generated.parse(text)
+        self.assertEqual(tree(result), tree(expected[0]))
+        self.assertEqual(rest, expected[1])
+
+    def test_entry_points(self):
+        generated = self.module(self.rules, root=program, skipWS=True)
+        self.assertEqual(generated.ROOT, "program")
+        result, rest = generated.parse("f(2) tail", "call")
+        self.assertEqual(rest, "tail")
+        self.assertEqual(result[0].__name__, "call")
+
+    def test_syntax_error_matches_interpreter(self):
+        generated = self.module(self.rules, root=program, skipWS=True)
+        with self.assertRaises(SyntaxError) as interpreted:
+            parseLine("let = 3;", program, packrat=True)
+        with self.assertRaises(SyntaxError) as compiled:
+            generated.parse("let = 3;")
+        self.assertEqual(str(compiled.exception), str(interpreted.exception))
+
+    def test_fused_literal_rules_match(self):
+        def star():
+            return "*"
+        def plus():
+            return "+"
+        def ops():
+            return -1, [star, plus, number]
+        for skipWS in (False, True):
+            with self.subTest(skipWS=skipWS):
+                generated = self.module({"ops": ops}, root=ops, skipWS=skipWS)
+                text = "+ * 12 +" if skipWS else "+*12+"
+                expected = parseLine(text, ops, skipWS=skipWS, packrat=True)
+                result, rest = generated.parse(text)
+                self.assertEqual(tree(result), tree(expected[0]))
+                self.assertEqual(result[0][0].end, 2 if skipWS else 1)  # a rule's end includes skipped space
+
+    def test_nested_rules_match(self):
+        def word():
+            return re.compile(r"\w+")
+        def cell():
+            return -2, word
+        def row():
+            return -2, (nested(re.compile(r"\[ *(\w[^\]]*?)? *\]"), cell), 0, ",")
+        for skipWS in (False, True):
+            with self.subTest(skipWS=skipWS):
+                generated = self.module({"row": row, "cell": cell, "word": word}, root=row, skipWS=skipWS)
+                text = "[a b],[ c ],[d ?],[]" if skipWS else "[ab],[ c ],[d ?],[],[e]"
+                expected = parseLine(text, row, skipWS=skipWS, packrat=True)
+                result, rest = generated.parse(text)
+                self.assertEqual(tree(result), tree(expected[0]))
+                self.assertEqual(rest, expected[1])
+                self.assertTrue(result[0].find_all("cell"))
+
+    def test_markdown_trees_match(self):
+        grammar = MarkdownGrammar()
+        generated = self.module(grammar)
+        docs = ["# Title\n\nSome *em* and **bold** with a [link](http://x.org).\n",
+                "- one\n- two\n    - nested `code`\n\n> quote\n",
+                "| a | b |\n|---|---|\n| 1 | 2 |\n\n```py\nx = 1\n```\n",
+                "Text with [[Wiki Page|label]] and a footnote[^1].\n\n[^1]: The note  \nsecond line\n",
+                "| *a* | b\\ |   |\n|:--|--:|---|\n|  1 | `2` | |\n| x | y\n",
+                "- a\n  - b\n      - c\n- d\n\n1. e\n    * f\n"]
+        for doc in docs:
+            with self.subTest(doc=doc):
+                expected, rest = grammar.parse(doc, resultSoFar=[])
+                result, generated_rest = generated.parse(MarkdownGrammar.prepare(doc))
+                self.assertEqual(tree(result), tree(expected))
+                self.assertEqual(generated_rest, rest)
+
+    def test_todo_trees_match(self):
+        grammar = TodoGrammar()
+        generated = self.module(grammar)
+        doc = "# Work\nAlice TODO:\n- [ ] write docs @bob #docs\n  - [x] outline\nStart: 9:00\nnote line\n"
+        expected, rest = grammar.parse(doc)
+        result, generated_rest = generated.parse(doc)
+        self.assertEqual(tree(result), tree(expected))
+        self.assertEqual(generated_rest, rest)
+
+
+class TestLoad(CodegenTestCase):
+    def test_cached_on_disk(self):
+        module = load(TodoGrammar, self.tmp.name)
+        files = list(Path(self.tmp.name).glob("*.py"))
+        self.assertEqual(len(files), 1)
+        self.assertIn(grammar_key(TodoGrammar), files[0].name)
+        self.assertEqual(module.KEY, grammar_key(TodoGrammar))
+        self.assertIs(load(TodoGrammar, self.tmp.name), module)
+
+    def test_key_depends_on_options(self):
+        self.assertNotEqual(grammar_key(TodoGrammar), grammar_key(TodoGrammar, skipWS=True))
+        self.assertNotEqual(grammar_key(TodoGrammar), grammar_key(MarkdownGrammar))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,12 @@
 import unittest
-from par.md import parseHtml
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import par.md
+from io import StringIO
+from par import SimpleVisitor
+from par.md import BlockCache, MarkdownDocument, MarkdownHtmlVisitor, TextSection, extract_resources, iter_html, iter_text_sections, parseHtml, parseHtmlDebug, parseHtmlMany, parseHtmlParallel, parseText, render_to, the_grammar
+from par.pyPEG import Symbol
 
 class TestEdgeCasesAndErrorHandling(unittest.TestCase):
     """Tests for edge cases and error handling"""
@@ -312,6 +319,18 @@ class TestListsAdvanced(unittest.TestCase):
         self.assertIn('<li><strong>Mon-Fri</strong>: 8am-6pm</li>', result)
         self.assertIn('<li><strong>Sun</strong>: 8am-6pm</li>', result)
 
+    def test_nested_lists_two_and_four_spaces(self):
+        """Nested lists indented by two or four spaces"""
+        expected = '<ul>\n<li>a\n<ul>\n<li>b\n<ul>\n<li>c</li>\n</ul></li>\n</ul></li>\n<li>d</li>\n</ul>\n'
+        self.assertEqual(parseHtml('- a\n    - b\n        - c\n- d\n'), expected)
+        self.assertEqual(parseHtml('- a\n  - b\n      - c\n- d\n'), expected)
+
+    def test_list_item_rendered_once(self):
+        """An item's inline text is rendered once, not re-parsed from its html"""
+        self.assertIn('<li><p>one</p>\n<p>two</p></li>', parseHtml('- one\n  two\n'))
+        self.assertIn('<li>*not em*</li>', parseHtml('- \\*not em\\*\n'))
+        self.assertIn('<li><code>c</code> text</li>', parseHtml('- `c` text\n'))
+
 class TestCodeBlocksAdvanced(unittest.TestCase):
     """Tests for advanced code block features"""
     
@@ -651,6 +670,13 @@ class TestTablesAdvanced(unittest.TestCase):
         result = parseHtml(md_text)
         self.assertIn('<table>', result)
 
+    def test_table_cells_inline(self):
+        """Body cells are inline text, head cells stay as written"""
+        result = parseHtml('| *h* | b |\n|:--|--:|\n| **x** | `y` |\n| \\ | |\n')
+        self.assertIn('<tr><th>*h*</th><th>b</th></tr>', result)
+        self.assertIn('<tr><td align="left"><strong>x</strong></td><td align="right"><code>y</code></td></tr>', result)
+        self.assertIn('<tr><td align="left"><br/></td><td align="right"></td></tr>', result)
+
 
 class TestHTMLIntegration(unittest.TestCase):
     """Tests for HTML integration features"""
@@ -1135,5 +1161,302 @@ Text[^note1]
         self.assertIn('Alphanumeric footnote', result)
 
 
+class TestSharedGrammar(unittest.TestCase):
+    def test_entry_points_reuse_the_grammar(self):
+        grammar = the_grammar()
+        self.assertIs(the_grammar(), grammar)
+        with mock.patch.object(par.md.MarkdownGrammar, '__init__', side_effect=AssertionError("grammar rebuilt")):
+            self.assertIn('<strong>b</strong>', parseHtml('**b** and [x](#y)'))
+            self.assertEqual(parseText('plain').strip(), 'plain')
+
+    def test_concurrent_use(self):
+        docs = [f'# Title {i}\n\n- item *{i}*\n' for i in range(40)]
+        expected = [parseHtml(doc) for doc in docs]
+        with ThreadPoolExecutor(8) as pool:
+            self.assertEqual(list(pool.map(parseHtml, docs)), expected)
+
+
+class TestFragmentCache(unittest.TestCase):
+    def test_repeated_link_texts_parsed_once(self):
+        grammar = the_grammar()
+        rows = '\n'.join(f'| {i} | [**same**](#s) |' for i in range(30))
+        doc = f'| a | b |\n|---|---|\n{rows}\n'
+        expected = parseHtml(doc, grammar=par.md.MarkdownGrammar())
+        grammar.fragments.clear()
+        hits, misses = grammar.fragments.hits, grammar.fragments.misses
+        self.assertEqual(parseHtml(doc), expected)
+        self.assertLessEqual(grammar.fragments.misses - misses, 2)
+        self.assertGreaterEqual(grammar.fragments.hits - hits, 29)
+
+    def test_cells_and_list_items_not_reparsed(self):
+        grammar = the_grammar()
+        hits, misses = grammar.fragments.hits, grammar.fragments.misses
+        parseHtml('| a | b |\n|---|---|\n| **x** | y |\n\n- a\n    - *b*\n- c\n')
+        self.assertEqual((grammar.fragments.hits, grammar.fragments.misses), (hits, misses))
+
+    def test_fragment_tree_is_shared(self):
+        grammar = the_grammar()
+        first = grammar.parse_fragment('some *text*', 'text')
+        self.assertIs(grammar.parse_fragment('some *text*', 'text'), first)
+        self.assertEqual(first[0].__name__, 'text')
+
+    def test_bounded_by_fragment_length(self):
+        cache = par.md.FragmentCache(max_chars=10, max_fragment=6)
+        for text in ('aaaa', 'bbbb', 'cccc', 'long fragment'):
+            cache.get(('text', text), lambda text=text: (text,))
+        self.assertEqual(cache.stats['chars'], 8)
+        self.assertEqual([key[1] for key in cache._entries], ['bbbb', 'cccc'])
+        self.assertEqual(cache.evictions, 1)
+        calls = []
+        cache.get(('text', 'bbbb'), lambda: calls.append(1))
+        self.assertEqual((calls, cache.hits), ([], 1))
+
+
+class TestBlockCache(unittest.TestCase):
+    doc = ('# Intro\n\nSee [home][h] and ![pic](a.png).\n\n'
+           '## Details\n\nA note[^n] here.\n\n- one\n- two\n\n'
+           '[h]: http://example.org\n\n[^n]: The note\n')
+
+    def test_unchanged_blocks_are_reused(self):
+        cache = BlockCache()
+        self.assertEqual(parseHtmlDebug(self.doc, block_cache=cache), parseHtmlDebug(self.doc))
+        misses = cache.misses
+        edited = self.doc.replace('- two', '- two, edited')
+        self.assertEqual(parseHtmlDebug(edited, block_cache=cache), parseHtmlDebug(edited))
+        self.assertEqual(cache.misses, misses + 1)
+        self.assertGreater(cache.hits, 5)
+
+    def test_context_changes_rerender(self):
+        cache = BlockCache()
+        parseHtml(self.doc, block_cache=cache)
+        for edited in ('# First\n\n' + self.doc,                                   # shifts heading ids
+                       self.doc.replace('http://example.org', 'http://example.com'),  # reference target
+                       'Early[^m].\n\n[^m]: Other\n\n' + self.doc):                  # footnote numbering
+            with self.subTest(edited=edited):
+                self.assertEqual(parseHtmlDebug(edited, block_cache=cache), parseHtmlDebug(edited))
+
+    def test_byte_limit(self):
+        cache = BlockCache(max_bytes=400)
+        parseHtml('\n\n'.join(f'Paragraph number {i} with some text.' for i in range(20)), block_cache=cache)
+        self.assertLessEqual(cache.nbytes, 400)
+        self.assertGreater(cache.evictions, 0)
+        self.assertEqual(cache.stats['entries'], len(cache))
+
+
+def _tree(node):
+    if isinstance(node, Symbol):
+        return (node.__name__, node.offset, node.end, _tree(node.what) if isinstance(node.what, list) else node.what)
+    if isinstance(node, list):
+        return [_tree(n) for n in node]
+    return node
+
+
+class TestMarkdownDocument(unittest.TestCase):
+    doc = ''.join(f'## Part {i}\n\nParagraph {i} with *emphasis* and `code`.\n\n- item {i}\n- item {i}b\n\n' for i in range(20))
+
+    def assertMatchesFullParse(self, document):
+        expected, rest = the_grammar().parse(document.text, resultSoFar=[], skipWS=False)
+        self.assertEqual(_tree(document.tree), _tree(list(expected)))
+        self.assertEqual(document.rest, rest)
+
+    def test_edit_reparses_only_nearby_blocks(self):
+        document = MarkdownDocument(self.doc)
+        at = self.doc.index('Paragraph 10') + len('Paragraph 10')
+        document.apply_edit(at, at, ' **now bold**')
+        self.assertMatchesFullParse(document)
+        self.assertLessEqual(len(document.reparsed), 3)
+        self.assertIn('<strong>now bold</strong>', document.html())
+
+    def test_edits_that_change_structure(self):
+        document = MarkdownDocument(self.doc)
+        for start, end, text in ((0, 0, 'Intro line\n'),                           # joins the first heading
+                                 (30, 31, '\n\n# New\n\n'),
+                                 (len(self.doc) - 5, len(self.doc), ''),
+                                 (100, 100, '<div>\n\n'), (400, 400, '</div>')):      # spans blocks
+            with self.subTest(edit=(start, end, text)):
+                document.apply_edit(start, end, text)
+                self.assertMatchesFullParse(document)
+                self.assertEqual(document.html_debug()[0], parseHtmlDebug(document.text)[0])
+
+    def test_update_with_whole_text(self):
+        document = MarkdownDocument(self.doc)
+        edited = self.doc.replace('item 7b', 'item seven')
+        document.update(edited)
+        self.assertEqual(document.text, edited)
+        self.assertMatchesFullParse(document)
+        self.assertLessEqual(len(document.reparsed), 3)
+
+    def test_later_blocks_are_moved_lazily(self):
+        document = MarkdownDocument(self.doc)
+        last = document.blocks[-1]
+        for at in (40, 45, 50):
+            document.apply_edit(at, at, 'more text ')
+        self.assertIs(document._blocks[-1], last)     # not copied by the edits
+        self.assertEqual(document.html(), parseHtml(document.text))
+        self.assertMatchesFullParse(document)
+        self.assertEqual(document.blocks[-1].end, len(document.source))
+
+    def test_line_breaks_normalised_around_the_edit(self):
+        doc = self.doc.replace('`code`.\n', '`code`.  \n').replace('\n', '\r\n')
+        document = MarkdownDocument(doc)
+        for start, end, text in ((doc.index('Paragraph 3'), doc.index('Paragraph 3'), 'x  \r\ny '),
+                                 (doc.index('\r\n\r\n- item 5') + 2, doc.index('\r\n\r\n- item 5') + 4, ''),   # gives a hard break
+                                 (doc.index('item 9b') - 3, doc.index('item 9b'), '\r'),
+                                 (len(doc) - 2, len(doc), 'end\\\r\nx')):
+            with self.subTest(edit=(start, end, text)):
+                document.apply_edit(start, end, text)
+                self.assertEqual(document.source, the_grammar().prepare(document.text))
+                self.assertMatchesFullParse(document)
+
+    def test_bad_range(self):
+        with self.assertRaises(IndexError):
+            MarkdownDocument('text').apply_edit(3, 10, 'x')
+
+
+class TestStreaming(unittest.TestCase):
+    doc = '# One\n\nText with a note[^a].\n\n## Two\n\n- x\n- y\n\n[^a]: The note\n'
+
+    def test_chunks_join_to_parse_html(self):
+        chunks = list(iter_html(self.doc))
+        self.assertGreater(len(chunks), 3)
+        self.assertEqual(''.join(chunks), parseHtml(self.doc))
+        self.assertIn('footnotes', chunks[-1])       # emitted last, by __end__
+        self.assertTrue(chunks[-1].startswith('</section>'))
+
+    def test_render_to(self):
+        out = StringIO()
+        written = render_to(self.doc, out, block_cache=BlockCache())
+        self.assertEqual(out.getvalue(), parseHtml(self.doc))
+        self.assertEqual(written, len(out.getvalue()))
+
+    def test_empty(self):
+        self.assertEqual(list(iter_html('')), [])
+
+
+class TestParallelRendering(unittest.TestCase):
+    doc = ('.. toc::\n\n' + ''.join(f'# Chapter {i}\n\nSee [the site][site] and ![img](p{i}.png), note[^n{i}].\n\n'
+                                    f'- item {i}\n- [link](http://x.org/{i})\n\n[^n{i}]: Note {i}\n\n' for i in range(12))
+           + '[site]: http://example.org "Site"\n')
+
+    def test_matches_sequential(self):
+        expected = parseHtmlDebug(self.doc)
+        self.assertEqual(parseHtmlParallel(self.doc, workers=2, chunk_chars=200, resources=True), expected)
+        self.assertEqual(parseHtmlParallel(self.doc, workers=2, chunk_chars=200), expected[0])
+
+    def test_falls_back_when_prescan_is_wrong(self):
+        doc = self.doc + '\n```\n[site]: http://elsewhere.org\n```\n'     # not a definition, inside code
+        self.assertEqual(parseHtmlParallel(doc, workers=2, chunk_chars=200, resources=True), parseHtmlDebug(doc))
+
+    def test_fence_across_a_cut(self):
+        doc = ('Paragraph\n\n\tcode here\n\n1. first\n2. second\n3. third\n\n```\nline 1\n\nline 3\n```\n\n\n'
+               '* 3 km (1.9 mi) ~5 min\n* 5 km (3.1 mi) ~10 min\n* 10 km (6.2 mi) ~20 min\n')
+        self.assertEqual(parseHtmlParallel(doc, workers=2, chunk_chars=50, resources=True), parseHtmlDebug(doc))
+
+    def test_stitch_must_reach_the_end(self):
+        blocks = [(0, 10, 'a', {}), (10, 30, 'b', {})]
+        self.assertEqual(par.md._stitch([(blocks, 30, False), ([], 20, True)], 30), blocks)
+        self.assertIsNone(par.md._stitch([(blocks, 30, False), ([], 20, True)], 50))   # the last stretch started mid-block
+        self.assertEqual(par.md._stitch([(blocks, 30, True)], 50), blocks)             # parsing really stops there
+
+    def test_small_documents_render_in_process(self):
+        with mock.patch.object(par.md, 'ProcessPoolExecutor', side_effect=AssertionError("pool used")):
+            self.assertEqual(parseHtmlParallel('# Small\n\ntext\n', workers=4), parseHtml('# Small\n\ntext\n'))
+
+
+class TestBatchRendering(unittest.TestCase):
+    docs = [f'Comment **{i}** with [a link](http://x.org/{i})' for i in range(20)]
+    broken = 'Text[^1]\n\n[^1]: Cats **aaaa**\n\n\nMore[^1]\n\n[^1]: Cats **aaaa**\n'   # duplicate footnote raises
+
+    def test_ordered_results(self):
+        self.assertEqual(parseHtmlMany(self.docs, workers=2, chunksize=3), [parseHtml(doc) for doc in self.docs])
+
+    def test_resources(self):
+        results = parseHtmlMany(self.docs[:3], workers=1, resources=True)
+        self.assertEqual(results, [parseHtmlDebug(doc) for doc in self.docs[:3]])
+        self.assertIn('http://x.org/2', results[2][1]['links_ext'])
+
+    def test_errors_are_isolated(self):
+        results = parseHtmlMany([self.docs[0], self.broken, self.docs[1]], workers=2, chunksize=1)
+        self.assertEqual(results[0], parseHtml(self.docs[0]))
+        self.assertIsInstance(results[1], Exception)
+        self.assertIn('already existed', str(results[1]))
+        self.assertEqual(results[2], parseHtml(self.docs[1]))
+
+
+class TestExtractResources(unittest.TestCase):
+    docs = ['# Title [t](http://t.org)\n\n## Sub {#sub}\n\n.. toc::\n\n# After\n\n**bold [b](http://b.org)** http://raw.org\n',
+            '| a | b |\n|---|---|\n| [x](http://x.org) | ![i](i.png) |\n| http://raw.org | [[Wiki Page#top]] |\n',
+            '- item [a](http://a.org)\n    indented http://b.org\n- [ ] ![v](v.mp4)\n\n> quote ![y](https://youtu.be/abcdefghijk)\n',
+            '[ref] and [text][r2] and ![img][r2]\n\n[![alt](i.png)](http://l.org) [bad](javascript:x) [[image:s.mp3]]\n\n'
+            '[ref]: http://ref.org\n[r2]: http://r2.org/i.png "T"\n',
+            '- [a](http://a.org)\n  - [b](http://b.org)\n\n| [c](http://c.org) |\n|---|\n| [d](http://d.org) |\n']
+
+    def test_matches_rendering(self):
+        for doc in self.docs:
+            with self.subTest(doc=doc):
+                self.assertEqual(extract_resources(doc), parseHtmlDebug(doc)[1])
+
+    def test_footnotes_keep_source(self):
+        doc = 'Text[^1]\n\n[^1]: Note with [a link](http://n.org)\n'
+        resources = extract_resources(doc)
+        self.assertEqual(resources['footnotes'], [{'name': '1', 'text': 'Note with [a link](http://n.org)'}])
+        self.assertEqual(resources['links_ext'], parseHtmlDebug(doc)[1]['links_ext'])
+        with self.assertRaisesRegex(Exception, 'already existed'):
+            extract_resources(TestBatchRendering.broken)
+
+    def test_no_html_is_generated(self):
+        with mock.patch.object(par.md.MarkdownHtmlVisitor, 'tag', side_effect=AssertionError("rendered")):
+            self.assertEqual(extract_resources(self.docs[0])['links_ext'][-1], 'http://raw.org')
+
+
+class TestPlainTextSections(unittest.TestCase):
+    doc = ('Lead **in**.\n\n# First *one* {#first}\n\nSee [the docs](http://x.org "T") and `code` &amp; more.\n\n'
+           '- item ![alt](i.png)\n    more *em*\n\n> quoted **text**\n\nSecond\n------\n\n| a | b |\n|---|---|\n| 1 | [two](http://2) |\n\n'
+           '[ref]: http://r.org\n')
+
+    def test_sections(self):
+        sections = list(iter_text_sections(self.doc))
+        self.assertEqual([(s.title, s.level) for s in sections], [('', 0), ('First one', 1), ('Second', 2)])
+        self.assertEqual(sections[0].text, 'Lead in.')
+        self.assertEqual(sections[1].text, 'See the docs and code & more.\nitem alt\nmore em\nquoted text')
+        self.assertEqual(sections[2].text, 'a b\n1 two')
+
+    def test_offsets(self):
+        sections = list(iter_text_sections(self.doc))
+        self.assertEqual([s.start for s in sections], [0, self.doc.index('# First'), self.doc.index('Second')])
+        self.assertEqual(sections[-1].end, len(self.doc))
+        doc = 'Intro  \r\nline\\\r\nend\r\n\r\n# Head\r\n\r\nBody\r\n'
+        self.assertEqual([s.start for s in iter_text_sections(doc)], [0, doc.index('# Head')])
+
+    def test_streams(self):
+        sections = iter_text_sections(self.doc)
+        self.assertIsInstance(next(sections), TextSection)
+        self.assertEqual(list(iter_text_sections('')), [])
+
+
+class TestVisitorDispatch(unittest.TestCase):
+    def test_subclass_inherits_handlers(self):
+        class Rules(MarkdownHtmlVisitor):
+            def visit_hr(self, node):
+                return '<hr class="rule"/>\n'
+        html = parseHtml('Some *text*\n\n---\n', visitor=Rules)
+        self.assertIn('<p>Some <em>text</em></p>', html)
+        self.assertIn('<hr class="rule"/>', html)
+        self.assertNotIn('class="rule"', parseHtml('Some *text*\n\n---\n'))
+
+    def test_hooks_are_inherited(self):
+        class Marked(SimpleVisitor):
+            def __end__(self):
+                return '!'
+            def visit_string(self, node):
+                return node.text.upper()
+        class Quiet(Marked):
+            def visit_space(self, node):
+                return '_'
+        tree = the_grammar().parse('ab cd\n', resultSoFar=[])[0]
+        self.assertEqual(Quiet(the_grammar()).visit(tree, root=True), 'AB_CD\n!')
+        self.assertEqual(Marked(the_grammar()).visit(tree, root=True), 'AB CD\n!')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,7 +2,8 @@ import unittest
 import sys, re
 from io import StringIO
 
-from par.pyPEG import _and, _not, ignore, keyword, parser, parse, parseLine, Name, Symbol
+from par.pyPEG import _and, _not, ignore, keyword, nested, parser, parse, parseLine, FAIL, Memo, Symbol, compile_pattern, compile_grammar, regex_first, Rule, Seq, Choice, Fused, FlatTree, FlatNode, Profiler
+import json
 
 
 class TestKeyword(unittest.TestCase):
@@ -36,18 +37,6 @@ class TestAndNot(unittest.TestCase):
         self.assertEqual(not_obj.obj, pattern)
 
 
-class TestName(unittest.TestCase):
-    def test_name_is_string(self):
-        name = Name("test")
-        self.assertIsInstance(name, str)
-        self.assertEqual(name, "test")
-    
-    def test_name_has_line_and_file(self):
-        name = Name("test")
-        self.assertEqual(name.line, 0)
-        self.assertEqual(name.file, "")
-
-
 class TestSymbol(unittest.TestCase):
     def test_symbol_creation(self):
         sym = Symbol("test", "value")
@@ -78,6 +67,15 @@ class TestSymbol(unittest.TestCase):
         result = outer.find("target")
         self.assertEqual(result, inner)
     
+    def test_symbol_shifted(self):
+        old, new = "ab cd", "xxab cd"
+        sym = Symbol("pair", [Symbol("word", old, 0, 2), "-", Symbol("word", old, 3, 5)], 0, 5)
+        moved = sym.shifted(2, new)
+        self.assertEqual((moved.offset, moved.end), (2, 7))
+        self.assertEqual([w.text for w in moved.find_all("word")], ["ab", "cd"])
+        self.assertEqual(moved[2].offset, 5)
+        self.assertEqual(moved[1], "-")
+    
     def test_symbol_find_not_found(self):
         sym = Symbol("root", ["test"])
         self.assertIsNone(sym.find("missing"))
@@ -165,7 +163,41 @@ class TestSymbol(unittest.TestCase):
         sym = Symbol("node", long_val)
         rendered = sym.utf8_tree_str()
         self.assertRegex(rendered, r"^node: 'x{60}'\.\.\.\n$")
-        
+
+    def test_span_refers_to_buffer(self):
+        source = "let answer = 42"
+        sym = Symbol("number", source, 13, 15)
+        self.assertEqual(sym.what, "42")
+        self.assertEqual(sym.text, "42")
+        self.assertEqual((sym.offset, sym.end), (13, 15))
+        self.assertEqual(len(sym), 2)
+        self.assertEqual(list(sym), ["4", "2"])
+
+    def test_list_behaviour(self):
+        leaf = Symbol("item", "ab")
+        sym = Symbol("root", [leaf, "c"])
+        self.assertEqual(len(sym), 2)
+        self.assertIs(sym[0], leaf)
+        self.assertEqual(list(sym), [leaf, "c"])
+        self.assertEqual(sym, [["a", "b"], "c"])
+        self.assertFalse(Symbol("empty", []))
+        self.assertIn("c", sym)
+
+    def test_slotted(self):
+        sym = Symbol("test", "value")
+        self.assertFalse(hasattr(sym, "__dict__"))
+        with self.assertRaises(AttributeError):
+            sym.extra = 1
+
+    def test_parsed_terminals_share_the_buffer(self):
+        def word():
+            return re.compile(r"\w+")
+        text = "alpha beta"
+        result, rest = parseLine(text, (word, word))
+        self.assertEqual([n.text for n in result], ["alpha", "beta"])
+        self.assertTrue(all(n._what is text for n in result))
+        self.assertEqual([(n.offset, n.end) for n in result], [(0, 5), (6, 10)])
+
 
 class TestParser(unittest.TestCase):
     def setUp(self):
@@ -300,14 +332,15 @@ class TestParserPackrat(unittest.TestCase):
             return [keyword("class"), keyword("def"), identifier]
         
         initial_cache_size = len(p.memory)
-        result, rest = p.parseLine("myVar", keyword_or_var)
+        # Starts with 'c', so keyword("class") is still tried (and fails) before identifier
+        result, rest = p.parseLine("classVar", keyword_or_var)
         
         # Verify parsing succeeded
         self.assertEqual(rest, "")
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0].__name__, "keyword_or_var")
         
-        # Cache should have entries: failed attempts at 'class' and 'def' keywords,
+        # Cache should have entries: the failed attempt at the 'class' keyword,
         # plus the successful identifier match
         cache_entries = len(p.memory)
         self.assertGreater(cache_entries, initial_cache_size, 
@@ -408,6 +441,288 @@ class TestParserPackrat(unittest.TestCase):
         self.assertEqual(len(operators), 1, "Expression should have one operator")
 
 
+class TestFailureSentinel(unittest.TestCase):
+    def test_parseAt_returns_fail_instead_of_raising(self):
+        p = parser()
+        p.reset("import sys")
+        self.assertEqual(p.parseAt(0, [keyword("class"), keyword("def")], []), FAIL)
+
+    def test_farthest_failure_in_error(self):
+        def greeting():
+            return keyword("hello"), [keyword("world"), "!"]
+
+        with self.assertRaises(SyntaxError) as cm:
+            parse(greeting, ["hello there"])
+        message = str(cm.exception)
+        self.assertIn("parse error at offset 6", message)
+        self.assertIn("keyword 'world'", message)
+        self.assertIn("'!'", message)
+
+    def test_farthest_failure_tracked_on_parser(self):
+        p = parser()
+        with self.assertRaises(SyntaxError):
+            p.parseLine("ab!", (re.compile(r"[a-z]+"), re.compile(r"\d")), skipWS=False)
+        self.assertEqual(p.failpos, 2)
+
+class TestMemo(unittest.TestCase):
+    def test_keys_are_offsets(self):
+        def ident():
+            return re.compile(r"[a-z]+")
+
+        p = parser(p=True)
+        p.parseLine("ab,cd", (ident, -1, (",", ident)), skipWS=False)
+        self.assertIn(3, {pos for pos, _ in p.memory})
+        self.assertTrue(all(isinstance(pos, int) for pos, _ in p.memory))
+
+    def test_counters(self):
+        memo = Memo()
+        pattern = [keyword("class"), re.compile(r"\w+")]
+        parseLine("myVar", pattern, packrat=True, memo=memo)
+        self.assertEqual(memo.hits, 0)
+        self.assertGreater(memo.misses, 0)
+        p = parser(p=True, memo=memo)
+        p.parseLine("myVar", pattern)
+        p.parseLine("myVar", pattern)
+        self.assertEqual(memo.stats['hits'], 1)
+
+    def test_size_cap_evicts_oldest(self):
+        def digit():
+            return re.compile(r"\d")
+
+        memo = Memo(maxsize=4)
+        result, rest = parseLine("12345678", (-2, digit), skipWS=False, packrat=True, memo=memo)
+        self.assertEqual(rest, "")
+        self.assertEqual([n.__name__ for n in result], ["digit"] * 8)
+        self.assertEqual(len(memo), 4)
+        self.assertGreater(memo.evictions, 0)
+        self.assertNotIn((0, compile_pattern(digit)), memo)
+
+    def test_lru_policy_keeps_recent_hits(self):
+        memo = Memo(maxsize=2, policy='lru')
+        memo.store('a', 1); memo.store('b', 2)
+        memo.lookup('a')
+        memo.store('c', 3)
+        self.assertEqual(sorted(memo), ['a', 'c'])
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            Memo(policy='random')
+
+class TestCompile(unittest.TestCase):
+    def test_rule_functions_called_once(self):
+        calls = []
+        def number():
+            calls.append('number')
+            return re.compile(r"\d+")
+        def numbers():
+            calls.append('numbers')
+            return -2, number
+
+        p = parser()
+        for text in ("1 2", "3 4 5"):
+            result, rest = p.parseLine(text, numbers)
+            self.assertEqual(rest, "")
+        self.assertEqual(calls, ['numbers', 'number'])
+        self.assertEqual([n.text for n in result[0]], ['3', '4', '5'])
+
+    def test_recursive_rule_graph(self):
+        def value():
+            return [re.compile(r"\d+"), group]
+        def group():
+            return "(", -1, value, ")"
+
+        node = compile_pattern(group)
+        self.assertIsInstance(node, Rule)
+        self.assertIsInstance(node.body, Seq)
+        self.assertIs(compile_pattern(value).body.alts[1], node)
+        result, rest = parseLine("(1 (2 3))", group)
+        self.assertEqual(rest, "")
+        self.assertEqual([n.what[0] for n in result[0].find_all("value") if isinstance(n.what[0], str)], ['1', '2', '3'])
+
+    def test_compile_grammar(self):
+        def word():
+            return re.compile(r"\w+")
+        def _sep():
+            return [",", ";"]
+
+        compiled = compile_grammar({'word': word, '_sep': _sep})
+        self.assertEqual(compiled['word'].name, 'word')
+        self.assertIsNone(compiled['_sep'].name)
+        self.assertIsInstance(compiled['_sep'].body, Choice)
+        self.assertEqual(parseLine("a,b", (word, compiled['_sep'], word))[0][1].text, 'b')
+
+    def test_illegal_type(self):
+        with self.assertRaises(SyntaxError):
+            compile_pattern(3.5)
+
+class TestFirstDispatch(unittest.TestCase):
+    def test_regex_first(self):
+        self.assertEqual(regex_first(re.compile(r"\*\*[^*]+\*\*")), (frozenset("*"), False))
+        self.assertEqual(regex_first(re.compile(r"(?:ab|[0-2])c")), (frozenset("a012"), False))
+        self.assertEqual(regex_first(re.compile(r"x?y*z")), (frozenset("xyz"), False))
+        self.assertEqual(regex_first(re.compile(r"(?=\w)#*")), (frozenset("#"), True))
+        self.assertIsNone(regex_first(re.compile(r"\w+"))[0])
+        self.assertIsNone(regex_first(re.compile(r"a", re.I))[0])
+
+    def test_only_matching_alternatives_are_tried(self):
+        def bold():
+            return "*", re.compile(r"\w+"), "*"
+        def link():
+            return "[", re.compile(r"\w+"), "]"
+        def word():
+            return re.compile(r"\w+")
+
+        choice = compile_pattern([bold, link, word])
+        self.assertEqual(choice.dispatch()["*"], (compile_pattern(bold), compile_pattern(word)))
+        p = parser(p=True)
+        result, rest = p.parseLine("[x] *y* z", (-1, choice))
+        self.assertEqual(rest, "")
+        self.assertEqual([n.__name__ for n in result], ["link", "bold", "word"])
+        self.assertNotIn((0, compile_pattern(bold)), p.memory)
+
+    def test_skipped_alternatives_only_report_failures(self):
+        def bold():
+            return "*", re.compile(r"\w+"), "*"
+        def link():
+            return "[", re.compile(r"\w+"), "]"
+
+        p = parser(p=True)
+        result, rest = p.parseLine("[x] *y*", (-1, [bold, link]))
+        self.assertEqual([n.__name__ for n in result], ["link", "bold"])
+        self.assertNotIn((7, compile_pattern(bold)), p.memory)    # not run just to record what it expected
+        with self.assertRaises(SyntaxError) as cm:
+            p.parseLine("[x] ?", (-1, [bold, link], "."))
+        self.assertIn("'*'", str(cm.exception))
+        self.assertIn("'['", str(cm.exception))
+        self.assertFalse(p.tracing)
+
+    def test_nullable_alternatives_always_tried(self):
+        def maybe_digits():
+            return re.compile(r"\d*")
+        result, rest = parseLine("x", ["a", maybe_digits, "x"], skipWS=False)
+        self.assertEqual(rest, "x")
+        self.assertEqual(result[0].__name__, "maybe_digits")
+
+    def test_left_recursive_rule_falls_back_to_full_scan(self):
+        def expr():
+            return [(expr, "+"), "1"]
+        self.assertEqual(compile_pattern(expr).first(set()), (None, True))
+
+class TestFusedAlternatives(unittest.TestCase):
+    def test_adjacent_terminals_fused(self):
+        def number():
+            return re.compile(r"\d+")
+        def name():
+            return re.compile(r"[a-z]+")
+        def group():
+            return "(", name, ")"
+
+        choice = compile_pattern([number, name, ",", group, re.compile(r"\s+")])
+        self.assertIsInstance(choice.alts[0], Fused)
+        self.assertEqual(len(choice.alts[0].alts), 3)
+        self.assertIs(choice.alts[1], compile_pattern(group))
+        self.assertNotIsInstance(choice.alts[2], Fused)
+
+        result, rest = parseLine("12,ab (cd)", (-1, choice), skipWS=False)
+        self.assertEqual(rest, "")
+        self.assertEqual([(n.__name__, n.what) if isinstance(n, Symbol) else n for n in result[:3]],
+                         [("number", "12"), ("name", "ab"), " "])
+        self.assertEqual(result[3].__name__, "group")
+
+    def test_order_is_kept(self):
+        def short():
+            return re.compile(r"a")
+        def long():
+            return re.compile(r"ab")
+        result, rest = parseLine("ab", [short, long], skipWS=False)
+        self.assertEqual((result[0].__name__, rest), ("short", "b"))
+
+    def test_backreferences_not_fused(self):
+        choice = compile_pattern([re.compile(r"(a)\1"), re.compile(r"b")])
+        self.assertFalse(any(isinstance(alt, Fused) for alt in choice.alts))
+        self.assertEqual(parseLine("aa", choice)[0], ["aa"])
+
+    def test_symbols_match_unfused_rules(self):
+        def star():
+            return "*"
+        def plus():
+            return "+"
+        def number():
+            return re.compile(r"\d+")
+        def spaces():
+            return ignore(r"\s+")
+
+        def spans(nodes):
+            return [(n.__name__, n.offset, n.end, spans(n.what) if isinstance(n.what, list) else n.what)
+                    for n in nodes if isinstance(n, Symbol)]
+
+        fused = compile_pattern([star, plus, number, spaces])
+        self.assertIsInstance(fused.alts[0], Fused)
+        unfused = [(star,), (plus,), (number,), (spaces,)]   # sequences are never fused
+        for text in ["+", "* 12 +", "1+  *"]:
+            for skipWS in (False, True):
+                with self.subTest(text=text, skipWS=skipWS):
+                    expected = parseLine(text, (-1, unfused), skipWS=skipWS)
+                    result = parseLine(text, (-1, fused), skipWS=skipWS)
+                    self.assertEqual(spans(result[0]), spans(expected[0]))
+                    self.assertEqual(result[1], expected[1])
+        self.assertEqual(spans(parseLine("+", fused, skipWS=False)[0]), [("plus", 0, 1, [])])
+
+    def test_failure_reports_each_alternative(self):
+        def number():
+            return re.compile(r"\d+")
+        with self.assertRaises(SyntaxError) as cm:
+            parse([number, "x"], ["?"])
+        self.assertIn("/\\d+/", str(cm.exception))
+        self.assertIn("'x'", str(cm.exception))
+
+class TestFlatTree(unittest.TestCase):
+    def setUp(self):
+        def number():
+            return re.compile(r"\d+")
+        def name():
+            return re.compile(r"[a-z]+")
+        def _sep():
+            return ","
+        def args():
+            return "(", 0, (value, -1, (_sep, value)), ")"
+        def call():
+            return name, args
+        def value():
+            return [number, call, name]
+        self.value = value
+
+    def test_columns(self):
+        tree, rest = parseLine("f(1, g(x))", self.value, flat=True)
+        self.assertEqual(rest, "")
+        self.assertIsInstance(tree, FlatTree)
+        self.assertEqual([tree.names[k] for k in tree.kind],
+                         ["value", "call", "name", "args", "value", "number", "value", "call", "name", "args", "value", "name"])
+        self.assertEqual(list(tree.parent), [-1, 0, 1, 1, 3, 4, 3, 6, 7, 7, 9, 10])
+        self.assertEqual((tree.start[7], tree.end[7]), (5, 9))
+        self.assertEqual(tree.nbytes, 6 * 4 * len(tree))
+
+    def test_navigation(self):
+        tree = parse(self.value, ["f(1, g(x))"], flat=True)
+        root = next(iter(tree))
+        self.assertIsInstance(root, FlatNode)
+        self.assertEqual(root.__name__, "value")
+        call = root.find("call")
+        self.assertEqual([child.__name__ for child in call], ["name", "args"])
+        self.assertEqual(call.find("name").text, "f")
+        self.assertEqual(call.find("args").text, "(1, g(x))")
+        self.assertEqual(call.find("number").parent.parent.__name__, "args")
+        self.assertEqual([n.text for n in root.find_all("name")], ["f", "g", "x"])
+        self.assertEqual([n.text for n in tree[7].find_all("name")], ["g", "x"])
+        self.assertEqual(len(list(call.find("args").find_all_here("value"))), 2)
+
+    def test_matches_symbol_tree(self):
+        symbols, _ = parseLine("f(1, g(x))", self.value)
+        tree = FlatTree.from_symbols(symbols, "f(1, g(x))")
+        for name in ("value", "name", "args"):
+            self.assertEqual([(n.offset, n.end) for n in symbols[0].find_all(name)],
+                             [(n.offset, n.end) for n in tree[0].find_all(name)])
+
 class TestParseLineFunctions(unittest.TestCase):
     def test_parseLine_function(self):
         result, rest = parseLine("hello world", "hello")
@@ -418,6 +733,60 @@ class TestParseLineFunctions(unittest.TestCase):
         self.assertEqual(result[0], "123")
 
 
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        def number():
+            return re.compile(r"\d+")
+        def name():
+            return re.compile(r"[a-z]+")
+        def _sep():
+            return ","
+        def args():
+            return "(", 0, (value, -1, (_sep, value)), ")"
+        def call():
+            return name, args
+        def var():
+            return name, 0, "'"
+        def value():
+            return [call, number, var]
+        self.value = value
+
+    def test_counts(self):
+        prof = Profiler()
+        result, rest = parseLine("f(1, x)", self.value, profiler=prof)
+        self.assertEqual(rest, "")
+        stats = prof.stats
+        self.assertEqual(stats["value"].attempts, 3)
+        self.assertEqual(stats["value"].successes, 3)
+        self.assertEqual((stats["call"].attempts, stats["call"].failures), (2, 1))    # dispatch skips it on "1"
+        self.assertEqual((stats["_sep"].successes, stats["_sep"].failures), (1, 1))
+        self.assertEqual(stats["value"].consumed, len("f(1, x)") + 1 + 1)
+        self.assertGreaterEqual(stats["value"].total, stats["call"].total)
+        self.assertGreater(stats["value"].self_time, 0)
+
+    def test_memo_hits(self):
+        prof = Profiler()
+        parseLine("f(1, x)", self.value, packrat=True, profiler=prof)
+        self.assertEqual(prof.stats["name"].memo_hits, 1)      # var retries name after call fails on "x"
+
+    def test_same_result_as_unprofiled(self):
+        plain = parseLine("f(1, g(x))", self.value)
+        profiled = parseLine("f(1, g(x))", self.value, profiler=Profiler())
+        self.assertEqual(profiled, plain)
+
+    def test_output(self):
+        prof = Profiler()
+        parse(self.value, ["f(1, x)"], profiler=prof)
+        lines = prof.table(sort="attempts", limit=2).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith("name") or lines[1].startswith("value"))
+        data = json.loads(prof.to_json())
+        self.assertEqual(data["call"]["attempts"], 2)
+        self.assertEqual(set(data["call"]), set(Profiler.columns))
+        prof.reset()
+        self.assertEqual(prof.stats["call"].attempts, 0)
+
+
 class TestParse(unittest.TestCase):
     def test_parse_simple_grammar(self):
         def grammar():
@@ -512,15 +881,76 @@ class TestComplexGrammar(unittest.TestCase):
         self.assertEqual(len(list(result[0].find_all("item"))), 3)
 
 
-class TestLineNumbers(unittest.TestCase):
-    def test_lineNo_calculation(self):
+class TestOffsetParsing(unittest.TestCase):
+    def test_symbol_offsets_follow_buffer_position(self):
+        def item():
+            return re.compile(r"\w+")
+
+        def item_list():
+            return (item, -1, (",", item))
+
+        result, rest = parseLine("ab,cd,ef", item_list, skipWS=False)
+        self.assertEqual([n.offset for n in result[0].find_all("item")], [0, 3, 6])
+
+    def test_leading_assertions_see_start_of_text(self):
+        # Terminals are matched in place, but behave as if the rest of the text started at the match.
+        pattern = (re.compile(r"ab"), re.compile(r"(?<!b)c"), re.compile(r"^d"), re.compile(r"\be"))
+        result, rest = parseLine("abcde", pattern, skipWS=False)
+        self.assertEqual(result, ["ab", "c", "d", "e"])
+        self.assertEqual(rest, "")
+
+    def test_positive_lookbehind_at_start_never_matches(self):
+        with self.assertRaises(SyntaxError):
+            parseLine("ab", ("a", re.compile(r"(?<=a)b")), skipWS=False)
+
+    def test_unrewritable_assertion_falls_back_to_slicing(self):
+        pattern = ("a", re.compile(r"(?=x*(?<!a))b"))
+        result, rest = parseLine("ab", pattern, skipWS=False)
+        self.assertEqual(result, ["b"])
+
+    def test_parser_reuse_with_new_text(self):
+        p = parser(p=True)
+        self.assertEqual(p.parseLine("123", re.compile(r"\d+"))[0], ["123"])
+        self.assertEqual(p.parseLine("45", re.compile(r"\d+"))[0], ["45"])
+
+
+def cell_word():
+    return re.compile(r"\w+")
+
+def cell():
+    return -2, [cell_word, re.compile(r" +")]
+
+
+class TestNested(unittest.TestCase):
+    def test_parsed_in_place(self):
+        result, rest = parseLine("[ab cd]!", (nested(re.compile(r"\[([^\]]*)\]"), cell), "!"), skipWS=False)
+        self.assertEqual(rest, "")
+        self.assertEqual((result[0], result[2]), ("[", "]"))
+        self.assertEqual(result[1].__name__, "cell")
+        self.assertEqual([(w.offset, w.text) for w in result[1].find_all("cell_word")], [(1, "ab"), (4, "cd")])
+
+    def test_span_end_is_end_of_text(self):
+        result, rest = parseLine("(ab)", nested(re.compile(r"\(([^)]*)\)"), re.compile(r"\w+$")), skipWS=False)
+        self.assertEqual(result, ["(", "ab", ")"])
+
+    def test_kept_as_text_unless_consumed(self):
+        pattern = nested(re.compile(r"\[([^\]]*)\]"), cell)
+        self.assertEqual(parseLine("[ab ?]", pattern, skipWS=False), (["[ab ?]"], ""))
+        self.assertEqual(parseLine("[ab]", nested(re.compile(r"\[(?:(x)|[^\]]*)\]"), cell), skipWS=False), (["[ab]"], ""))
+
+    def test_inner_failures_not_reported(self):
         p = parser()
-        p.textlen = 100
-        p.restlen = 50
-        p.lines = [(0, 1), (20, 2), (40, 3), (60, 4), (80, 5)]
-        
-        line = p.lineNo()
-        self.assertGreaterEqual(line, 1)
+        p.reset("[ab ?]")
+        self.assertEqual(p.parseAt(0, nested(re.compile(r"\[([^\]]*)\]"), cell), [], skipWS=False), 6)
+        self.assertEqual((p.failpos, p.expected), (-1, []))
+
+    def test_memo_is_separate(self):
+        letters = re.compile(r"[a-z]+")
+        def word():
+            return letters
+        pattern = [(nested(re.compile(r"(\w)\w*"), word), "!"), word]
+        result, rest = parseLine("abc", pattern, skipWS=False, packrat=True)
+        self.assertEqual((result[0].text, rest), ("abc", ""))
 
 
 if __name__ == '__main__':
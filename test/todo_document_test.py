@@ -0,0 +1,177 @@
+"""Tests for TodoDocument/TodoThing bookkeeping: cached status counts, item indexes and queries."""
+
+import unittest
+from datetime import date
+
+from par.todo import TodoStatus, parse
+
+
+DOC = """\
+# Release
+
+## Build
+- [x] Compile
+- [ ] Package
+  - [/] Sign binaries
+  - [ ] Upload
+
+## Docs
+- [-] Old guide
+"""
+
+
+class TestStatusCounts(unittest.TestCase):
+    def setUp(self):
+        self.doc = parse(DOC)
+        self.build, self.docs = self.doc.sections
+
+    def test_counts(self):
+        counts = self.build.status_counts
+        self.assertEqual((counts[TodoStatus.OPEN], counts[TodoStatus.PROGRESS], counts[TodoStatus.DONE]), (2, 1, 1))
+        self.assertIs(self.build.branch_status, TodoStatus.PROGRESS)
+        self.assertIs(self.docs.branch_status, TodoStatus.CANCELLED)
+        self.assertIs(self.doc.status, TodoStatus.PROGRESS)
+
+    def test_edits_update_ancestors(self):
+        package = self.build.items[1]
+        self.assertIs(package.branch_status, TodoStatus.PROGRESS)
+        package.set_status('done')
+        self.assertIs(package.branch_status, TodoStatus.DONE)
+        self.assertIs(self.build.branch_status, TodoStatus.DONE)
+        self.docs.items[0].toggle_status()
+        self.assertIs(self.docs.branch_status, TodoStatus.OPEN)
+        self.docs.items[0].edit_text('[x] Old guide')
+        self.assertIs(self.doc.status, TodoStatus.DONE)
+        self.build.items[0].cycle_status()
+        cached = self.doc.status_counts
+        self.doc.invalidate_status()
+        self.assertEqual(self.doc.status_counts, cached)
+
+    def test_invalidate_after_direct_changes(self):
+        self.assertIs(self.docs.branch_status, TodoStatus.CANCELLED)
+        self.docs.nodes.append(parse('- [ ] New guide').items[0])
+        self.docs.invalidate_status()
+        self.assertIs(self.docs.branch_status, TodoStatus.PROGRESS)
+        self.assertIs(self.doc.status, TodoStatus.PROGRESS)
+
+
+TAGGED = """\
+Work:
+- [ ] Deploy @alice +web due:2026-10-20
+- [ ] Write notes @bob #docs due:2026-10-14
+- [x] Review @alice #docs est:2h
+- [ ] Plan +web due:someday
+"""
+
+
+class TestTagIndex(unittest.TestCase):
+    def setUp(self):
+        self.doc = parse(TAGGED)
+        self.deploy, self.notes, self.review, self.plan = self.doc.all_items()
+
+    def test_lookups(self):
+        self.assertEqual(self.doc.items_with_mention('alice'), [self.deploy, self.review])
+        self.assertEqual(self.doc.items_with_hashtag('docs'), [self.notes, self.review])
+        self.assertEqual(self.doc.items_in_project('web'), [self.deploy, self.plan])
+        self.assertEqual(self.doc.items_with_meta('est', '2h'), [self.review])
+        self.assertEqual(self.doc.items_with_meta('due'), [self.deploy, self.notes, self.plan])
+        self.assertEqual(self.doc.items_with_mention('carol'), [])
+
+    def test_due_range(self):
+        self.assertEqual(self.doc.items_due(), [self.notes, self.deploy])
+        self.assertEqual(self.doc.items_due(date(2026, 10, 14), date(2026, 10, 20)), [self.notes])
+        self.assertEqual(self.doc.items_due(start=date(2026, 10, 15)), [self.deploy])
+
+    def test_edit_text_updates_index(self):
+        self.doc.items_with_mention('alice')
+        self.review.edit_text('Review @bob due:2026-10-01')
+        self.assertEqual(self.doc.items_with_mention('alice'), [self.deploy])
+        self.assertEqual(self.doc.items_with_mention('bob'), [self.notes, self.review])
+        self.assertEqual(self.doc.items_with_hashtag('docs'), [self.notes])
+        self.assertEqual(self.doc.items_due(), [self.review, self.notes, self.deploy])
+
+    def test_new_items_need_invalidation(self):
+        self.assertEqual(self.doc.items_with_hashtag('ops'), [])
+        section = self.doc.sections[0]
+        item = parse('- [ ] Rotate keys').items[0]
+        item.parent = section
+        section.nodes.append(item)
+        item.edit_text('Rotate keys #ops')  # unknown to the built index, so it is dropped
+        self.assertEqual(self.doc.items_with_hashtag('ops'), [item])
+
+
+class TestQuery(unittest.TestCase):
+    def setUp(self):
+        self.doc = parse(TAGGED + '- [ ] (A) Ship @alice due:2026-10-18\n')
+        self.deploy, self.notes, self.review, self.plan, self.ship = self.doc.all_items()
+
+    def test_filters(self):
+        query = self.doc.query()
+        self.assertEqual(list(query.assignee('alice').status('open')), [self.deploy, self.ship])
+        self.assertEqual(list(self.doc.query().project('web').hashtag('docs')), [])
+        self.assertEqual(list(self.doc.query().priority('A')), [self.ship])
+        self.assertEqual(list(self.doc.query().due_after('2026-10-14').due_before(date(2026, 10, 20))), [self.ship])
+        self.assertEqual(list(self.doc.query().meta('est', '2h')), [self.review])
+
+    def test_order_and_limit(self):
+        self.assertEqual(list(self.doc.query().order_by('due')), [self.notes, self.ship, self.deploy, self.review, self.plan])
+        self.assertEqual(list(self.doc.query().assignee('alice').order_by('due', reverse=True).limit(2)), [self.review, self.deploy])
+        self.assertEqual(list(self.doc.query().limit(2)), [self.deploy, self.notes])
+        self.assertIs(self.doc.query().hashtag('docs').order_by('text').first(), self.review)
+        self.assertIsNone(self.doc.query().assignee('carol').first())
+
+    def test_plan_uses_most_selective_index(self):
+        self.assertEqual(self.doc.query().status('done').explain(), 'scan')
+        self.assertEqual(self.doc.query().assignee('alice').project('web').explain(), 'project:web')
+        self.assertEqual(self.doc.query().assignee('alice').due_before('2026-10-15').explain(), 'due')
+        self.assertEqual(self.doc.query().assignee('alice').hashtag('missing').explain(), 'hashtag:missing')
+
+
+class TestItemIndex(unittest.TestCase):
+    def setUp(self):
+        self.doc = parse(DOC)
+        self.build, self.docs = self.doc.sections
+
+    def test_find_item(self):
+        items = list(self.doc.all_items())
+        self.assertEqual([item for _, item in self.doc.indexed_items()], items)
+        self.assertIs(self.doc.find_item(3), items[2])
+        self.assertIsNone(self.doc.find_item(0))
+        self.assertIsNone(self.doc.find_item(len(items) + 1))
+        self.assertEqual(self.doc.item_number(items[4]), 5)
+
+    def test_ids_survive_edits(self):
+        upload = self.doc.find_item(4)
+        uid = upload.uid
+        upload.edit_text('Upload to the mirror @bob')
+        upload.set_status('done')
+        self.assertIs(self.doc.find_item_by_id(uid), upload)
+        self.assertEqual(len({item.uid for item in self.doc.walk()}), len(list(self.doc.walk())))
+
+    def test_add_and_remove_nodes(self):
+        _, package = self.build.items
+        self.assertIs(self.doc.find_item(2), package)  # built before the edits, then kept current
+        new = parse('- [ ] Notarize @carol').items[0]
+        new.parent = None
+        package.add_node(new, 1)
+        self.assertEqual(self.doc.item_number(new), 4)
+        self.assertEqual(self.doc.find_item(5).text, 'Upload')
+        self.assertEqual(self.doc.items_with_mention('carol'), [new])
+        self.assertEqual(self.doc.status_counts[TodoStatus.OPEN], 3)
+
+        self.build.remove_node(package)
+        self.assertIsNone(package.parent)
+        self.assertEqual([item.text for _, item in self.doc.indexed_items()], ['Compile', 'Old guide'])
+        self.assertIsNone(self.doc.find_item_by_id(new.uid))
+        self.assertIs(self.doc.status, TodoStatus.DONE)
+
+        self.doc.add_node(package, 0)  # moves keep ids
+        self.assertIs(self.doc.find_item(1), package)
+        self.assertIs(self.doc.find_item_by_id(new.uid), new)
+        self.assertEqual(list(self.doc.all_items()), [item for _, item in self.doc.indexed_items()])
+        with self.assertRaises(ValueError):
+            self.build.remove_node(package)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from par.todo import _ASTBuilder, parse, parse_tree
+
+
+def built_from_tree(text):
+    return _ASTBuilder().build(parse_tree(text))
+
+
+class TestLineScanner(unittest.TestCase):
+    """`parse` scans lines itself; it must build exactly what the PEG grammar does"""
+
+    docs = [
+        "",
+        "# Plan  #q4\nintro note\n\nAlice TODO:\n- [ ] write docs @bob #docs due:2026-10-20\n  - [x] outline\n    detail\n",
+        "Work:\n  Sub project:\n    1. [/] step one +web\n    2) step two\n[-] dropped\n\n• bullet\n",
+        "Start: 9:00\nEnd: 10:30\nNotes: went fine\n  more\n\n## Next\nx 2026-10-01 shipped\n(A) urgent @alice(2h)\n",
+        "####### not a heading\n#nospace\n-no space\n- [X]tight\n\t- tabbed\r\nwindows\rmac",
+        # tokens that run past a newline, as in the grammar
+        "Start:\n\nvalue below\n",
+        "Start:\n",
+        "Name\n:\n- [ ] item\n",
+        "x\n\nfoo\nx  \n",
+        "todo TODO:\nAlice todo:\n",
+    ]
+
+    def test_matches_grammar(self):
+        for text in self.docs:
+            with self.subTest(text=text):
+                scanned, expected = parse(text), built_from_tree(text)
+                self.assertEqual(scanned, expected)
+                self.assertEqual(scanned.to_dict(), expected.to_dict())
+                self.assertEqual([item.raw for item in scanned.all_items()], [item.raw for item in expected.all_items()])
+
+    def test_multiline_field(self):
+        doc = parse("Start:\n\nvalue below\n")
+        self.assertEqual(doc.nodes[0].tags[0].value, 'value below')
+
+
+if __name__ == '__main__':
+    unittest.main()